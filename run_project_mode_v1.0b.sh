@@ -11,50 +11,59 @@
 # │   ├── <filename>.bam
 # │   ├── <filename>.bam.pbi
 # │   └── <filename>.bam.xml
-# ├── css.fastq
+# ├── passnum_stat.json
 # ├── recall/
 # ├── discarded/
-# ├── fqsplit/
-# │   ├── css.fastq-partxxx
-# │   └── ...
 # ├── valid/
 # ├── invalid/
+# ├── manifest/
+# ├── dedup/
 # ├── run_project_mode_v1.0b.sh
 # ├── proj_meta.json
 # └── scripts/
 #     ├── extr_MASseq_v1.0b.py
-#     ├── fastq-splitter.pl
 #     ├── split_MASseq_v1.0b.py
 #     ├── recall_MASseq_v1.0b.py
 #     ├── false_split_detect_v1.0b.py
-#     └── convert_tsv2fqgz_v1.0b.py
-mkdir fqsplit
-mkdir valid
-mkdir invalid
-mkdir recall
-mkdir recall/false_split
-mkdir discard
-mkdir split_result
+#     ├── convert_tsv2fqgz_v1.0b.py
+#     ├── dedup_MASseq_v1.0b.py
+#     ├── batch_MASseq_v1.0b.py
+#     ├── matcher_MASseq.py
+#     ├── config_MASseq.py
+#     ├── recaller_MASseq.py
+#     ├── segment_MASseq.py
+#     ├── bgzf_MASseq.py
+#     ├── ubam_MASseq.py
+#     ├── manifest_MASseq.py
+#     ├── metrics_MASseq.py
+#     ├── reader_MASseq.py
+#     ├── readstat_MASseq.py
+#     ├── pbi_MASseq.py
+#     ├── pipeline_MASseq.py
+#     ├── workqueue_MASseq.py
+#     └── umi_MASseq.py
+# The directories are kept if they exist, so this script can be run again on the same project.
+# A rerun skips the stages whose outputs are up to date with their manifests in "manifest/", and continues an unfinished split from its last checkpoint.
+mkdir -p valid
+mkdir -p invalid
+mkdir -p recall/false_split
+mkdir -p discard
+mkdir -p split_result
+mkdir -p manifest
 
-mkdir log_files
-mkdir log_files/fqsplit_log
+mkdir -p log_files
 
-# Extracting CCS reads and their pass number from the .bam file.
-python -u scripts/extr_MASseq_v1.0a.py -p > log_files/seq_extract.log
+# Splitting CCS reads directly from the .bam file in 50 worker processes.
+# CCS reads with a pass number less than 3 are filtered out on the fly, so no intermediate css.fastq is written.
+# Invalid reads are recalled inline by the split workers, which replaces 'python -u scripts/recall_MASseq_v1.0b.py -p'.
+# Potential false splits are found in each CCS read and rejoined, which replaces 'python -u scripts/false_split_detect_v1.0b.py -p'.
+# Valid reads are written into split_result/<sample_name>.fastq.gz directly (BGZF, compressed by 8 threads), which replaces 'python -u scripts/convert_tsv2fqgz_v1.0b.py'.
+# The number of reads of each sample is recorded as "Sample_reads" in valid/<file_name>.stat.json.
+# The read lengths, pass numbers, UMI lengths and valid reads per CCS read of each sample are counted on the fly into valid/<file_name>.sample_stat.json, and summarized in sample_summary.json.
+# Only the first .bam file in hifi_reads/ is split, several cells (or .bam files) can be split in one batch with a shared worker pool by 'python -u scripts/batch_MASseq_v1.0b.py'.
+bamf_name=$(ls hifi_reads/ | grep '\.bam$' | head -n 1)
+python -u scripts/split_MASseq_v1.0b.py -p --workers 50 --inline-recall --rejoin --demux fastq.gz --demux-threads 8 --resume hifi_reads/${bamf_name} >> log_files/css_split.log
 
-scripts/fastq-splitter.pl --n-parts 100 css.fastq
-mv css.part-*.fastq fqsplit/
-rm css.fastq
-
-# Splitting CCS reads in 50 threads.
-for i in {01..100}; do echo "python -u scripts/split_MASseq_v1.0a.py -p css.part-${i}.fastq > log_files/fqsplit_log/part-${i}_split.log"; done > mas_split.sh 
-ParaFly -c mas_split.sh -CPU 50
-
-python -u scripts/recall_MASseq_v1.0a.py -p 
-
-# Finding potential false splits, which would not take a long time.
-python -u scripts/false_split_detect_v1.0a.py -p
-
-cat valid/*.tsv | awk -F '|' '{print $4}' | sort | uniq -c > sample_reads.txt
-
-python -u scripts/convert_tsv2fqgz_v1.0a.py > log_files/compress_by_sample.log
+# Collapsing the PCR duplicates of the valid reads in split_result/ by their samples and UMIs (within one mismatch), one representative read for each molecule.
+# The representative reads are written into dedup/<sample_name>.fastq.gz, and the duplicate rate of each sample into dedup/dedup_stat.json.
+python -u scripts/dedup_MASseq_v1.0b.py -p --resume >> log_files/dedup.log
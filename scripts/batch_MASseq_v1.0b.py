@@ -0,0 +1,277 @@
+# 2026/10/17
+# Author: JIA Zheng
+# This is the script to split the data of several SMRT cells (or .bam files) in one batch, with one pool of worker processes shared by all of them.
+# Each cell is split by its own run of 'split_MASseq_<version>.py' under the "project mode", as 'run_project_mode_v1.0b.sh' does, which publishes its chunks into a work queue;
+# the workers of the batch take the chunks of the cells one after another, so a cell is started as soon as there are free workers, instead of after the last cell is finished.
+# Current version: 1.0-beta
+
+# Load the necessary libraries.
+# Standard Python libraries:
+import os
+import sys
+import time
+import json
+import glob
+import getopt
+import subprocess
+
+# Modules in the same directory:
+import bgzf_MASseq
+import readstat_MASseq
+
+def getDatetime():
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+# ==================================== User Interface & Parameter Parsing ====================================
+# Get the options provided by users in a dictionary.
+usage = """This is a script to split the MAS-PAIso-seq(2) data of several SMRT cells in one batch, with one pool of worker processes shared by all the cells.
+Each cell is split under the "project mode" as 'run_project_mode_v1.0b.sh' does: the CCS reads are split directly from the .bam file, recalled inline, checked for false splits and rejoined,
+and written into "split_result/<sample_name>.fastq.gz" of the cell. The outputs, the logs and the statistics of each cell are kept in its own project directory.
+
+General usage:
+  python batch_MASseq_<version>.py [-h] [-m <meta_information_file>] [-o <batch_directory>] [-l <list_file>] [--workers <N>] [--chunk-size <reads>] [--demux-threads <threads>] [--lease-timeout <seconds>] [--merge <merge_directory>] [<cell_directory>|<PATH>/<file_name>.bam ...]
+
+The cells to split:
+  <cell_directory>    A standard project directory, e.g. "cell-<x>/", with one .bam file (and its PacBio index .pbi) in "hifi_reads/". The outputs are written into it;
+  <file_name>.bam     A .bam file with its PacBio index "<file_name>.bam.pbi". A project directory "<batch_directory>/<file_name>/" is created for it, linking to the .bam file in its "hifi_reads/";
+  -l                  A file listing the cell directories or the .bam files, one in a line, in addition to the ones given in the command line.
+
+Options:
+  -m                 The file name with or without the PATH to a .json files cantains necessary meta information, used by all the cells.
+                     Leave it NULL to use the "proj_meta.json" of each cell directory, or the "proj_meta.json" in current WD if there isn't one;
+  -o                 The directory to create the project directories of the .bam files, the logs of the workers ("log_files/"), the statistics of the batch ("batch_stat.json"), and the summary of the samples of all the cells ("sample_summary.json"), leave it NULL to use current WD;
+  --workers          The number of worker processes shared by all the cells, default 1. Besides the workers, each cell has a process writing its outputs, which also splits the chunks no worker has taken;
+  --chunk-size       The number of reads in a chunk, default 2000;
+  --demux-threads    The number of threads of each cell to compress its "fastq.gz" files, default 8;
+  --lease-timeout    A chunk taken by a worker is taken again by others, if the worker is stopped for this time in seconds (default 120);
+  --merge            Merge the "fastq.gz" files of each sample of all the cells into "<merge_directory>/<sample_name>.fastq.gz", after all the cells are split successfully.
+  The cells are split with "--resume", so a batch can be run again to continue its unfinished cells.
+
+To view the usage information:
+  -h    Print usage information and exit.
+"""
+
+optlist, args = getopt.getopt(sys.argv[1:], 'hm:o:l:', ['workers=', 'chunk-size=', 'demux-threads=', 'lease-timeout=', 'merge='])
+optdict = dict(optlist)
+projWD = os.getcwd()
+
+if ("-h" in optdict.keys()) or (len(sys.argv)==1):
+    sys.stderr.write(usage)
+    sys.exit()
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+worker_num = max(1, int(optdict.get("--workers", 1)))
+chunk_size = max(1, int(optdict.get("--chunk-size", 2000)))
+demux_threads = max(1, int(optdict.get("--demux-threads", 8)))
+lease_timeout = optdict.get("--lease-timeout", "")
+
+batch_dir = os.path.join(projWD, optdict["-o"]) if optdict.get("-o") else projWD
+merge_dir = os.path.join(projWD, optdict["--merge"]) if optdict.get("--merge") else None
+
+meta_json = os.path.join(projWD, optdict["-m"]) if optdict.get("-m") else None
+
+input_lis = list(args)
+if optdict.get("-l"):
+    with open(os.path.join(projWD, optdict["-l"])) as lf:
+        input_lis.extend(line.strip() for line in lf if line.strip() and not line.startswith("#"))
+
+if not input_lis:
+    sys.stderr.write("No cell directory or .bam file is provided :-(\n")
+    sys.exit()
+
+
+# ================================= Defining Functions ====================================
+# Find the project directory and the .bam file of a cell directory or a .bam file.
+# Return: a dictionary of the cell, or an error message.
+def locateCell(input_name):
+    input_path = os.path.abspath(os.path.join(projWD, input_name))
+
+    if os.path.isdir(input_path):
+        bam_lis = sorted(glob.glob(f"{input_path}/hifi_reads/*.bam"))
+        if len(bam_lis)!=1:
+            return f"{len(bam_lis)} .bam files found in {input_path}/hifi_reads/, there should be one. Please provide the .bam files instead."
+        cell_dic = {"name": os.path.basename(input_path.rstrip("/")), "project": input_path, "bam": bam_lis[0], "link": False}
+
+    elif input_path.endswith(".bam") and os.path.isfile(input_path):
+        file_name = os.path.basename(input_path)[:-4]
+        cell_dic = {"name": file_name, "project": os.path.join(batch_dir, file_name), "bam": input_path, "link": True}
+
+    else:
+        return f"{input_path} is neither a cell directory nor a .bam file."
+
+    # The .bam file is shared through the work queue by its shards, which are cut by its PacBio index.
+    if not os.path.exists(f"{cell_dic['bam']}.pbi"):
+        return f"There isn't a PacBio index {cell_dic['bam']}.pbi, which is needed to share the .bam file between the workers. It can be created by 'pbindex'."
+
+    return cell_dic
+
+
+# Create a standard project directory for a cell, as 'run_project_mode_v1.0b.sh' does. A .bam file given directly is linked into "hifi_reads/".
+def makeProject(cell_dic):
+    for sub_dir in ["hifi_reads", "valid", "invalid", "recall/false_split", "discard", "split_result", "manifest", "log_files"]:
+        os.makedirs(os.path.join(cell_dic["project"], sub_dir), exist_ok=True)
+
+    if cell_dic["link"]:
+        for suffix in ["", ".pbi"]:
+            link_name = os.path.join(cell_dic["project"], "hifi_reads", os.path.basename(cell_dic["bam"]) + suffix)
+            if os.path.islink(link_name):
+                os.remove(link_name)
+            os.symlink(cell_dic["bam"] + suffix, link_name)
+
+    # The progress of a former batch is dropped, so that no worker leaves the queue before the cell publishes its chunks again.
+    queue_dir = os.path.join(cell_dic["project"], "queue")
+    if os.path.exists(f"{queue_dir}/progress.json"):
+        os.remove(f"{queue_dir}/progress.json")
+
+    return queue_dir
+
+
+# The meta information of a cell: the one given by "-m", the "proj_meta.json" of the cell, or the one in current WD.
+def cellMeta(cell_dic):
+    if meta_json:
+        return meta_json
+    if os.path.exists(os.path.join(cell_dic["project"], "proj_meta.json")):
+        return os.path.join(cell_dic["project"], "proj_meta.json")
+
+    return f"{projWD}/proj_meta.json"
+
+
+# Start the run splitting a cell, which writes the outputs of the cell, the same as the one in 'run_project_mode_v1.0b.sh' except for the work queue.
+def startCell(cell_dic):
+    split_args = ["-p", "--workers", "1", "--chunk-size", str(chunk_size), "--inline-recall", "--rejoin", "--demux", "fastq.gz", "--demux-threads", str(demux_threads),
+                  "--resume", "--queue", cell_dic["queue"], "-m", cellMeta(cell_dic)]
+    if lease_timeout:
+        split_args.extend(["--lease-timeout", lease_timeout])
+
+    logf = open(os.path.join(cell_dic["project"], "log_files", "css_split.log"), "a")
+    return subprocess.Popen([sys.executable, "-u", os.path.join(script_dir, "split_MASseq_v1.0b.py")] + split_args + [f"hifi_reads/{os.path.basename(cell_dic['bam'])}"],
+                            cwd=cell_dic["project"], stdout=logf, stderr=subprocess.STDOUT)
+
+
+# Start a worker of the batch, which takes the chunks of the cells in their order.
+def startWorker(worker_id, queue_lis):
+    logf = open(os.path.join(batch_dir, "log_files", f"batch_worker_{worker_id}.log"), "a")
+    return subprocess.Popen([sys.executable, "-u", os.path.join(script_dir, "split_MASseq_v1.0b.py")] + [f"--queue-worker={queue_dir}" for queue_dir in queue_lis],
+                            cwd=batch_dir, stdout=logf, stderr=subprocess.STDOUT)
+
+
+# Load a .json file written by a cell, or None if it isn't written.
+def loadJson(json_name):
+    try:
+        with open(json_name) as jf:
+            return json.load(jf)
+    except (OSError, ValueError):
+        return None
+
+
+# ================================= Main ====================================
+print(f"[{getDatetime()}] Will split {len(input_lis)} cells in a batch, batch directory: {batch_dir}")
+
+cell_lis = []
+for input_name in input_lis:
+    cell_dic = locateCell(input_name)
+    if isinstance(cell_dic, str):
+        sys.stderr.write(f"{cell_dic} :-(\n")
+        sys.exit(1)
+    cell_lis.append(cell_dic)
+
+# The project directories of the cells should be different, or their outputs would be mixed.
+if len(set(cell_dic["project"] for cell_dic in cell_lis))!=len(cell_lis):
+    sys.stderr.write("Some cells share the same project directory, please check the names of the cell directories and the .bam files :-(\n")
+    sys.exit(1)
+
+os.makedirs(os.path.join(batch_dir, "log_files"), exist_ok=True)
+
+for cell_dic in cell_lis:
+    cell_dic["queue"] = makeProject(cell_dic)
+    print(f"[{getDatetime()}] Cell {cell_dic['name']}: {cell_dic['bam']}, project directory: {cell_dic['project']}")
+
+batch_start = time.time()
+
+cell_procs = [startCell(cell_dic) for cell_dic in cell_lis]
+worker_procs = [startWorker(worker_id, [cell_dic["queue"] for cell_dic in cell_lis]) for worker_id in range(worker_num)]
+
+print(f"[{getDatetime()}] {len(cell_lis)} cells started with {worker_num} shared worker processes, the logs of the workers: {batch_dir}/log_files/batch_worker_<N>.log")
+
+batch_stat = {"cells": {}, "workers": worker_num}
+
+# The cells are checked every second, as they are done in any order.
+running_dic = dict(enumerate(cell_procs))
+while running_dic:
+    time.sleep(1)
+
+    for cell_id, cell_proc in list(running_dic.items()):
+        if cell_proc.poll() is None:
+            continue
+
+        del running_dic[cell_id]
+        cell_dic = cell_lis[cell_id]
+        fqf_name = os.path.basename(cell_dic["bam"])[:-4]
+
+        cell_stat = {
+            "project": cell_dic["project"],
+            "bam": cell_dic["bam"],
+            "exit_code": cell_proc.returncode,
+            "time": round(time.time() - batch_start, 3),
+            "split": loadJson(os.path.join(cell_dic["project"], "valid", f"{fqf_name}.stat.json")),
+            "pass_number": loadJson(os.path.join(cell_dic["project"], "passnum_stat.json"))
+        }
+        batch_stat["cells"][cell_dic["name"]] = cell_stat
+
+        if cell_proc.returncode:
+            print(f"[{getDatetime()}] Cell {cell_dic['name']} failed with exit code {cell_proc.returncode}, see {cell_dic['project']}/log_files/css_split.log :-(", flush=True)
+        else:
+            print(f"[{getDatetime()}] Cell {cell_dic['name']} done in {cell_stat['time']:.1f}s.", flush=True)
+
+# The statistics are kept in the order of the cells.
+batch_stat["cells"] = {cell_dic["name"]: batch_stat["cells"][cell_dic["name"]] for cell_dic in cell_lis}
+
+# All the chunks are written by the cells now, the workers left are waiting for a cell which failed.
+for worker_proc in worker_procs:
+    if worker_proc.poll() is None:
+        worker_proc.terminate()
+    worker_proc.wait()
+
+batch_stat["time"] = round(time.time() - batch_start, 3)
+failed_lis = [cell_name for cell_name, cell_stat in batch_stat["cells"].items() if cell_stat["exit_code"]]
+
+# The reads of a sample in all the cells are merged into one file, the files are concatenated block by block without decompressing.
+if merge_dir and failed_lis:
+    print(f"[{getDatetime()}] The samples are not merged, as {len(failed_lis)} cells failed.")
+
+elif merge_dir:
+    os.makedirs(merge_dir, exist_ok=True)
+
+    sample_dic = {}
+    for cell_dic in cell_lis:
+        for sample_file in sorted(glob.glob(os.path.join(cell_dic["project"], "split_result", "*.fastq.gz"))):
+            sample_dic.setdefault(os.path.basename(sample_file)[:-9], []).append(sample_file)
+
+    batch_stat["merged"] = {}
+    for sample_name, sample_lis in sample_dic.items():
+        merged_name = os.path.join(merge_dir, f"{sample_name}.fastq.gz")
+        merged_size = bgzf_MASseq.concatFiles(merged_name, sample_lis)
+
+        sample_reads = 0
+        for cell_stat in batch_stat["cells"].values():
+            if cell_stat["split"]:
+                sample_reads += cell_stat["split"].get("Sample_reads", {}).get(sample_name, 0)
+
+        batch_stat["merged"][sample_name] = {"file": merged_name, "cells": len(sample_lis), "reads": sample_reads, "bytes": merged_size}
+        print(f"[{getDatetime()}] Sample {sample_name}: {sample_reads} reads of {len(sample_lis)} cells merged into {merged_name}.")
+
+# The statistics of the valid reads of each sample in all the cells, merged from the "sample_summary.json" of the cells.
+readstat_MASseq.mergeFiles([os.path.join(cell_dic["project"], "sample_summary.json") for cell_dic in cell_lis]).dump(os.path.join(batch_dir, "sample_summary.json"))
+print(f"[{getDatetime()}] Summary of the samples of all the cells: {batch_dir}/sample_summary.json.")
+
+with open(os.path.join(batch_dir, "batch_stat.json"), "w") as jf:
+    json.dump(batch_stat, jf, indent=4)
+
+print(f"[{getDatetime()}] Json file: {batch_dir}/batch_stat.json.")
+
+if failed_lis:
+    sys.stderr.write(f"{len(failed_lis)} cells failed: {', '.join(failed_lis)} :-(\n")
+    sys.exit(1)
+
+print(f"[{getDatetime()}] All {len(cell_lis)} cells done in {batch_stat['time']:.1f}s :-)")
@@ -0,0 +1,303 @@
+# 2026/10/17
+# Author: JIA Zheng
+# This is the script to benchmark the splitting workflow on the CCS reads simulated by 'simulate_MASseq_<version>.py'.
+# Each stage is run as it is run by users, in a project directory, and timed; the valid reads are compared with the ground truth of the simulation.
+# The results are dumped into a .json file, which can be compared with the one of another version by "--compare".
+# Current version: 1.0-beta
+
+# Load the necessary libraries.
+# Standard Python libraries:
+import os
+import sys
+import time
+import json
+import gzip
+import glob
+import shutil
+import getopt
+import platform
+import tempfile
+import subprocess
+
+def getDatetime():
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+# ==================================== User Interface & Parameter Parsing ====================================
+# Get the options provided by users in a dictionary.
+usage = """This is a script to benchmark the throughput and the accuracy of the splitting workflow with simulated CCS reads.
+The CCS reads are simulated into a .bam file by 'simulate_MASseq_<version>.py', then processed under the "project mode" in two ways:
+  - the stages run one by one: extract ('extr_MASseq_<version>.py'), split, recall, false split (with "--rejoin") and convert;
+  - the stages fused in one run of 'split_MASseq_<version>.py' from the .bam file, as 'run_project_mode_v1.0b.sh' does ("inline").
+The reads per second and the bases per second of the input of each stage are reported,
+together with the precision and the recall of the valid reads of the split stage, of the stages run one by one ("pipeline"), and of the fused run ("inline").
+
+General usage:
+  python benchmark_MASseq_<version>.py [-h] [-m <meta_information_file>] [-n <read_number>] [-s <seed>] [-w <workers>] [-d <work_directory>] [-o <report_file>] [--label <label>] [--compare <old_report_file>]
+
+  -m           The file name with or without the PATH to a .json files cantains necessary meta information, leave it NULL to find a 'proj_meta.json' file in current WD;
+  -n           The number of simulated CCS reads, default 10000;
+  -s           The seed of the simulation, default 1. Reports are only comparable in accuracy with the same seed and number of reads;
+  -w           The number of worker processes of the split and the recall stages, default 1;
+  -d           The directory to run the benchmark in, which is kept afterwards. Leave it NULL to use a temporary directory, which is removed afterwards;
+  -o           The report file, default "benchmark_report.json" in current WD;
+  --label      A label of this run stored in the report, e.g. a version or a commit;
+  --compare    Print the changes from an older report, e.g. the one of the last version.
+  The options of the simulation (e.g. "--sub 0.01") can be passed after "--", e.g. "python benchmark_MASseq_<version>.py -n 5000 -- --false-split 0.1".
+
+To view the usage information:
+  -h    Print usage information and exit.
+"""
+
+optlist, args = getopt.getopt(sys.argv[1:], 'hm:n:s:w:d:o:', ['label=', 'compare='])
+optdict = dict(optlist)
+projWD = os.getcwd()
+
+if "-h" in optdict.keys():
+    sys.stderr.write(usage)
+    sys.exit()
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+read_num = int(optdict.get("-n", 10000))
+seed = int(optdict.get("-s", 1))
+worker_num = max(1, int(optdict.get("-w", 1)))
+report_name = os.path.join(projWD, optdict.get("-o", "benchmark_report.json"))
+label = optdict.get("--label", "")
+
+if ("-m" in optdict.keys()) and optdict["-m"]:
+    meta_json = os.path.join(projWD, optdict["-m"])
+else:
+    meta_json = f"{projWD}/proj_meta.json"
+
+if ("-d" in optdict.keys()) and optdict["-d"]:
+    bench_dir = os.path.join(projWD, optdict["-d"])
+    keep_dir = True
+else:
+    bench_dir = tempfile.mkdtemp(prefix="MASseq_benchmark_")
+    keep_dir = False
+
+
+# ================================= Defining Functions ====================================
+# Create a standard project directory with the meta information, as 'run_project_mode_v1.0b.sh' does.
+def makeProject(proj_dir):
+    for sub_dir in ["hifi_reads", "valid", "invalid", "recall/false_split", "discard", "split_result", "log_files"]:
+        os.makedirs(os.path.join(proj_dir, sub_dir), exist_ok=True)
+    shutil.copy(meta_json, os.path.join(proj_dir, "proj_meta.json"))
+
+
+# Run a script of the workflow in a project directory, its output is written into "log_files/<stage>.log".
+# Return: the time cost in seconds.
+def runScript(stage, proj_dir, script_name, script_args):
+    log_name = os.path.join(proj_dir, "log_files", f"{stage}.log")
+
+    start_time = time.perf_counter()
+    with open(log_name, "w") as logf:
+        proc = subprocess.run([sys.executable, os.path.join(script_dir, script_name)] + script_args, cwd=proj_dir, stdout=logf, stderr=subprocess.STDOUT)
+    time_cost = time.perf_counter() - start_time
+
+    if proc.returncode:
+        sys.stderr.write(f"Stage '{stage}' failed with exit code {proc.returncode}, see {log_name} :-(\n")
+        sys.exit(1)
+
+    return time_cost
+
+
+# Read the (ID, sequence) of the entries in .tsv, .fastq or .fastq.gz files.
+def readEntries(file_lis):
+    for file_name in file_lis:
+        if file_name.endswith(".tsv"):
+            with open(file_name) as f:
+                for line in f:
+                    entry_lis = line.split("\t")
+                    yield (entry_lis[0], entry_lis[1] if len(entry_lis)>1 else "")
+
+        else:
+            with (gzip.open(file_name, "rt") if file_name.endswith(".gz") else open(file_name)) as f:
+                for i, line in enumerate(f):
+                    if i % 4==0:
+                        entry_ID = line[1:].rstrip("\n")
+                    elif i % 4==1:
+                        yield (entry_ID, line.rstrip("\n"))
+
+
+# The number of reads and bases of the input of a stage.
+def countInput(file_lis):
+    read_count = 0
+    base_count = 0
+    for entry_ID, entry_seq in readEntries(file_lis):
+        read_count += 1
+        base_count += len(entry_seq)
+
+    return (read_count, base_count)
+
+
+def stageResult(time_cost, read_count, base_count):
+    return {
+        "seconds": round(time_cost, 3),
+        "reads": read_count,
+        "bases": base_count,
+        "reads_per_s": round(read_count / max(time_cost, 1e-9), 1),
+        "bases_per_s": round(base_count / max(time_cost, 1e-9), 1)
+    }
+
+
+# Load the ground truth, the transcripts of the CCS reads with a pass number less than 3 are filtered out by the workflow and not expected.
+# Return: a dictionary with (CCS_read_name, split_index) as keys and (category, barcode_ID, UMI) as values.
+def loadTruth(truth_name):
+    truth_dic = {}
+    with open(truth_name) as f:
+        for line in f:
+            if line[0]=="#":
+                continue
+            truth_lis = line.rstrip("\n").split("\t")
+            if int(truth_lis[1])>=3:
+                truth_dic[(truth_lis[0], truth_lis[2])] = (truth_lis[3], truth_lis[4], truth_lis[5])
+
+    return truth_dic
+
+
+# Compare the valid reads with the ground truth.
+# A valid read is a true positive if its transcript should be valid (a "valid" transcript or a rejoined "false_split" transcript), and its barcode is correct.
+def scoreValid(file_lis, truth_dic):
+    expect_num = sum(truth[0] in ("valid", "false_split") for truth in truth_dic.values())
+    cate_dic = {cate: {"transcripts": 0, "called_valid": 0} for cate in ("valid", "degraded", "noBC", "false_split")}
+    for truth in truth_dic.values():
+        cate_dic[truth[0]]["transcripts"] += 1
+
+    score_dic = dict.fromkeys(["valid_reads", "true_positives", "wrong_barcode", "not_in_truth", "duplicated", "umi_exact"], 0)
+    seen_set = set()
+
+    for entry_ID, entry_seq in readEntries(file_lis):
+        score_dic["valid_reads"] += 1
+        id_lis = entry_ID.split("|")
+        read_key = (id_lis[0], id_lis[2])
+
+        if read_key not in truth_dic:
+            score_dic["not_in_truth"] += 1
+            continue
+        if read_key in seen_set:
+            score_dic["duplicated"] += 1
+            continue
+        seen_set.add(read_key)
+
+        category, bc, umi = truth_dic[read_key]
+        cate_dic[category]["called_valid"] += 1
+
+        if category not in ("valid", "false_split"):
+            continue
+        if id_lis[3]!=bc:
+            score_dic["wrong_barcode"] += 1
+            continue
+
+        score_dic["true_positives"] += 1
+        score_dic["umi_exact"] += id_lis[4]==umi
+
+    score_dic["expected"] = expect_num
+    score_dic["precision"] = round(score_dic["true_positives"] / max(score_dic["valid_reads"], 1), 5)
+    score_dic["recall"] = round(score_dic["true_positives"] / max(expect_num, 1), 5)
+    score_dic["umi_exact_rate"] = round(score_dic["umi_exact"] / max(score_dic["true_positives"], 1), 5)
+    score_dic["categories"] = cate_dic
+
+    return score_dic
+
+
+# Print the changes of the throughput and the accuracy from an older report.
+def compareReports(old_report, new_report):
+    if old_report["params"]["simulation"]!=new_report["params"]["simulation"]:
+        print("The reports are simulated with different options or seeds, only the throughput is comparable.")
+
+    print(f"Stage\t{old_report.get('label') or 'old'} reads/s\t{new_report.get('label') or 'new'} reads/s\tSpeedup")
+    for stage, new_res in new_report["stages"].items():
+        old_res = old_report["stages"].get(stage)
+        if old_res:
+            print(f"{stage}\t{old_res['reads_per_s']}\t{new_res['reads_per_s']}\t{new_res['reads_per_s'] / max(old_res['reads_per_s'], 1e-9):.2f}x")
+
+    print("Output\tPrecision\tRecall")
+    for out_name, new_score in new_report["accuracy"].items():
+        old_score = old_report["accuracy"].get(out_name)
+        if old_score:
+            print(f"{out_name}\t{old_score['precision']} -> {new_score['precision']}\t{old_score['recall']} -> {new_score['recall']}")
+
+
+# ================================= Main ====================================
+print(f"[{getDatetime()}] Benchmark directory: {bench_dir}")
+
+# Simulate the CCS reads into the .bam file of the project of the stages run one by one, the fused run reads the same file.
+pipe_dir = os.path.join(bench_dir, "pipeline")
+inline_dir = os.path.join(bench_dir, "inline")
+makeProject(pipe_dir)
+makeProject(inline_dir)
+
+bam_name = os.path.join(pipe_dir, "hifi_reads", "sim.bam")
+sim_time = runScript("simulate", pipe_dir, "simulate_MASseq_v1.0b.py", ["-n", str(read_num), "-s", str(seed), "-o", "hifi_reads/sim", "--bam"] + args)
+
+with open(os.path.join(pipe_dir, "hifi_reads", "sim.sim.json")) as jf:
+    sim_inf = json.load(jf)
+
+truth_dic = loadTruth(os.path.join(pipe_dir, "hifi_reads", "sim.truth.tsv"))
+print(f"[{getDatetime()}] {sim_inf['stats']['reads']} CCS reads simulated in {sim_time:.1f}s, {len(truth_dic)} transcripts are expected to be processed.")
+
+stage_dic = {}
+bam_count = (sim_inf["stats"]["reads"], sim_inf["stats"]["bases"])
+
+# The stages run one by one, the input of each stage is counted before it is run.
+stage_dic["extract"] = stageResult(runScript("extract", pipe_dir, "extr_MASseq_v1.0b.py", ["-p", "-t", str(worker_num)]), *bam_count)
+
+split_input = countInput([os.path.join(pipe_dir, "css.fastq")])
+stage_dic["split"] = stageResult(runScript("split", pipe_dir, "split_MASseq_v1.0b.py", ["-p", "--workers", str(worker_num), "css.fastq"]), *split_input)
+
+recall_input = countInput(sorted(glob.glob(os.path.join(pipe_dir, "invalid", "*.err.tsv")) + glob.glob(os.path.join(pipe_dir, "invalid", "*.deg.tsv")) + glob.glob(os.path.join(pipe_dir, "invalid", "*.noBC.tsv"))))
+stage_dic["recall"] = stageResult(runScript("recall", pipe_dir, "recall_MASseq_v1.0b.py", ["-p", "--workers", str(worker_num)]), *recall_input)
+
+fsd_input = countInput(sorted(glob.glob(os.path.join(pipe_dir, "recall", "false_split", "*_true.tsv"))))
+stage_dic["false_split"] = stageResult(runScript("false_split", pipe_dir, "false_split_detect_v1.0b.py", ["-p", "--rejoin"]), *fsd_input)
+
+convert_input = countInput(sorted(glob.glob(os.path.join(pipe_dir, "valid", "*.tsv"))))
+stage_dic["convert"] = stageResult(runScript("convert", pipe_dir, "convert_tsv2fqgz_v1.0b.py", []), *convert_input)
+
+# The fused run.
+shutil.copy(bam_name, os.path.join(inline_dir, "hifi_reads", "sim.bam"))
+stage_dic["inline"] = stageResult(runScript("inline", inline_dir, "split_MASseq_v1.0b.py", ["-p", "--workers", str(worker_num), "--inline-recall", "--rejoin", "--demux", "fastq.gz", "hifi_reads/sim.bam"]), *bam_count)
+
+for stage, stage_res in stage_dic.items():
+    print(f"[{getDatetime()}] {stage}: {stage_res['seconds']}s, {stage_res['reads_per_s']} reads/s, {stage_res['bases_per_s'] / 1e6:.2f} Mb/s.")
+
+accuracy_dic = {
+    "split": scoreValid([os.path.join(pipe_dir, "valid", "css.BCassigned.tsv")], truth_dic),
+    "pipeline": scoreValid(sorted(glob.glob(os.path.join(pipe_dir, "split_result", "*.fastq.gz"))), truth_dic),
+    "inline": scoreValid(sorted(glob.glob(os.path.join(inline_dir, "split_result", "*.fastq.gz"))), truth_dic)
+}
+
+for out_name, score_dic in accuracy_dic.items():
+    print(f"[{getDatetime()}] {out_name}: precision {score_dic['precision']}, recall {score_dic['recall']}, {score_dic['valid_reads']} valid reads.")
+
+
+# Dump the report into a .json file.
+report_dic = {
+    "version": "1.0b",
+    "label": label,
+    "time": getDatetime(),
+    "host": platform.node(),
+    "python": platform.python_version(),
+    "params": {
+        "reads": read_num,
+        "seed": seed,
+        "workers": worker_num,
+        "simulation": sim_inf["params"]
+    },
+    "truth": sim_inf["stats"],
+    "stages": stage_dic,
+    "accuracy": accuracy_dic
+}
+
+with open(report_name, "w") as jf:
+    json.dump(report_dic, jf, indent=4)
+
+print(f"[{getDatetime()}] Report: {report_name}.")
+
+if ("--compare" in optdict.keys()) and optdict["--compare"]:
+    with open(os.path.join(projWD, optdict["--compare"])) as jf:
+        compareReports(json.load(jf), report_dic)
+
+if not keep_dir:
+    shutil.rmtree(bench_dir)
@@ -0,0 +1,186 @@
+# Author: JIA Zheng
+# This is the module to write block-gzip (BGZF) files, with the blocks compressed in a thread pool.
+# "zlib" releases the GIL while compressing, so independent blocks are compressed in parallel by threads.
+# A BGZF file is a series of gzip members, which is still a valid .gz file for "gzip", "zcat" and "pysam", and can be indexed by "samtools" or "tabix".
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import os
+import time
+import zlib
+import struct
+import collections
+
+
+# The maximum uncompressed size of a block, the same as the one used by "htslib".
+BLOCK_SIZE = 65280
+
+# The maximum size of a compressed block, including its 18-byte header and 8-byte footer.
+MAX_BLOCK_SIZE = 65536
+
+# The empty block marking the end of a BGZF file.
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+# ================================= Defining Functions ====================================
+# Compress a block of data into a BGZF block.
+# Return: (block, time cost in seconds).
+def compressBlock(data, level):
+    start_time = time.perf_counter()
+
+    comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = comp.compress(data) + comp.flush()
+
+    # Incompressible data is stored as it is, to keep the block within 64 KiB.
+    if len(cdata) + 26 > MAX_BLOCK_SIZE:
+        comp = zlib.compressobj(0, zlib.DEFLATED, -15)
+        cdata = comp.compress(data) + comp.flush()
+
+    header = struct.pack("<4BIBBH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25)
+    footer = struct.pack("<II", zlib.crc32(data), len(data))
+
+    return (header + cdata + footer, time.perf_counter() - start_time)
+
+
+# ================================= BGZF Writer ====================================
+class BGZFWriter:
+    """
+    A text file handle writing a BGZF file, the blocks are compressed by the "executor" if it is provided, else in the current thread.
+    The blocks are written in order, at most "max_pending" blocks of each file are held in memory.
+    With an "offset", an unfinished file is continued from that size, which should be a size returned after "flush".
+
+    Attributes:
+      raw_bytes (int): the uncompressed size written.
+      gz_bytes (int): the compressed size written.
+      comp_time (float): the time cost of compressing the blocks in seconds, summed over the threads.
+    """
+
+    def __init__(self, file_name, level=6, executor=None, max_pending=16, offset=None):
+        self.file_name = file_name
+        self.name = file_name  # The same attribute as a file object.
+        self.level = level
+        self.executor = executor
+        self.max_pending = max_pending
+
+        self.raw_bytes = 0
+        self.gz_bytes = 0
+        self.comp_time = 0.0
+
+        if offset is None:
+            self._handle = open(file_name, "wb")
+        else:
+            os.truncate(file_name, offset)
+            self._handle = open(file_name, "ab")
+        self._buffer = []
+        self._buffer_len = 0
+        self._rest = b""
+        self._pending = collections.deque()
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffer_len += len(text)
+
+        if self._buffer_len >= BLOCK_SIZE:
+            self._flushBuffer(False)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    # Cut the buffered text into blocks, the last incomplete block is kept unless "final" is True.
+    def _flushBuffer(self, final):
+        data = self._rest + "".join(self._buffer).encode()
+        self._buffer = []
+        self._buffer_len = 0
+
+        block_end = len(data) if final else len(data) - len(data) % BLOCK_SIZE
+        for i in range(0, block_end, BLOCK_SIZE):
+            self._submit(data[i: i+BLOCK_SIZE])
+
+        self._rest = data[block_end:]
+
+    def _submit(self, data):
+        self.raw_bytes += len(data)
+
+        if self.executor is None:
+            self._writeBlock(compressBlock(data, self.level))
+            return
+
+        self._pending.append(self.executor.submit(compressBlock, data, self.level))
+        while len(self._pending) > self.max_pending:
+            self._writeBlock(self._pending.popleft().result())
+
+    # The number of blocks submitted to the executor but not written yet.
+    @property
+    def pending_blocks(self):
+        return len(self._pending)
+
+    def _writeBlock(self, comp_res):
+        self._handle.write(comp_res[0])
+        self.gz_bytes += len(comp_res[0])
+        self.comp_time += comp_res[1]
+
+    # Write all the buffered text out, the last block may be smaller than "BLOCK_SIZE". The file ends at a block boundary afterwards.
+    def flush(self):
+        self._flushBuffer(True)
+        while self._pending:
+            self._writeBlock(self._pending.popleft().result())
+
+        self._handle.flush()
+
+    def close(self):
+        if self._handle.closed:
+            return
+
+        self.flush()
+        self._handle.write(EOF_BLOCK)
+        self.gz_bytes += len(EOF_BLOCK)
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_inf):
+        self.close()
+
+
+# ================================= Sample Sinks ====================================
+# Open a file to write the FastQ records of a sample, "fmt" is "fastq.gz" (BGZF) or "fastq".
+# With an "offset", the file is continued from that size, e.g. the size saved in a checkpoint.
+def openSink(file_name, fmt, level=6, executor=None, offset=None):
+    if fmt=="fastq.gz":
+        return BGZFWriter(file_name, level, executor, offset=offset)
+    elif fmt=="fastq":
+        if offset is None:
+            return open(file_name, "w")
+        os.truncate(file_name, offset)
+        return open(file_name, "a")
+    else:
+        raise ValueError(f"Unknown output format: '{fmt}', it should be 'fastq.gz' or 'fastq'.")
+
+
+# Concatenate the files of a sample, e.g. the ones of several SMRT cells, into one file without decompressing them.
+# The blocks of BGZF files are copied as they are, only the end-of-file blocks in the middle are left out. Return the size of the merged file.
+def concatFiles(out_name, file_lis, fmt="fastq.gz"):
+    with open(out_name, "wb") as out_handle:
+        for file_name in file_lis:
+            with open(file_name, "rb") as in_handle:
+                file_size = os.fstat(in_handle.fileno()).st_size
+                if fmt=="fastq.gz" and file_size>=len(EOF_BLOCK):
+                    in_handle.seek(file_size - len(EOF_BLOCK))
+                    if in_handle.read()==EOF_BLOCK:
+                        file_size -= len(EOF_BLOCK)
+                    in_handle.seek(0)
+
+                copy_size = file_size
+                while copy_size>0:
+                    data = in_handle.read(min(copy_size, 16 * 1024**2))
+                    if not data:
+                        break
+                    out_handle.write(data)
+                    copy_size -= len(data)
+
+        if fmt=="fastq.gz":
+            out_handle.write(EOF_BLOCK)
+
+        return out_handle.tell()
@@ -0,0 +1,98 @@
+# Author: JIA Zheng
+# This is the module to load the meta information of a project and build the matchers used by the splitting scripts.
+# The built matchers are cached on the disk next to the meta-information file, so that every run (or worker) of the scripts only needs to load them.
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import os
+import json
+import time
+import pickle
+import hashlib
+
+# Third party packages:
+import regex
+
+# Modules in the same directory:
+import matcher_MASseq
+
+
+# The cache will be rebuilt when this version or the source code of this module or "matcher_MASseq" is changed.
+BUNDLE_VERSION = "1.0b"
+
+
+# ================================= Pattern Bundle ====================================
+class PatternBundle:
+    """
+    The meta information of a project, with the matchers built from it.
+
+    Attributes:
+      meta_inf (dict): the content of the meta-information file.
+      used_bc (list): the IDs of the used 3' adapter barcodes.
+      bc_index (matcher_MASseq.BarcodeIndex): the barcode index of the used barcodes, allowing 2 edits.
+      sample_dic (dict): the barcode IDs as keys and the sample names as values, a barcode is named after itself if no "Adapter2Sample" is provided.
+      umi_pattern (regex.Pattern): the pattern to split the UMI and the "ATGGG" sequence from the 5' end of a split read.
+    """
+
+    def __init__(self, meta_inf):
+        self.meta_inf = meta_inf
+        self.used_bc = list(meta_inf["UsedAdapter"])
+        self.bc_index = matcher_MASseq.BarcodeIndex({bc: meta_inf["AdapterBC"][bc] for bc in self.used_bc}, 2)
+
+        self.sample_dic = {}
+        for bc in self.used_bc:
+            self.sample_dic[bc] = meta_inf.get("Adapter2Sample", {}).get(bc, bc)
+
+        self.umi_pattern = regex.compile("(^[ATCG]{8,12})(ATGGG){s<=1}")
+
+
+def bundleKey(meta_bytes):
+    """
+    The content hash of a meta-information file, together with the bundle version and the source code of this module and "matcher_MASseq".
+    """
+    key_hash = hashlib.sha256()
+    key_hash.update(BUNDLE_VERSION.encode())
+    key_hash.update(meta_bytes)
+    for src_name in (__file__, matcher_MASseq.__file__):
+        with open(src_name, "rb") as srcf:
+            key_hash.update(srcf.read())
+
+    return key_hash.hexdigest()
+
+
+def loadBundle(meta_json, use_cache=True):
+    """
+    Load the pattern bundle of a meta-information file, from its cache file "<meta_json>.bundle.pkl" if the cache is up to date.
+    The cache file is (re)written after the bundle is built, a failure of writing it is ignored.
+
+    Return: (bundle, load_info), load_info is a dictionary containing the source of the bundle ("cache" or "built"), the time cost in seconds, and the key of the bundle.
+    """
+    start_time = time.time()
+    cache_name = f"{meta_json}.bundle.pkl"
+
+    with open(meta_json, "rb") as metaf:
+        meta_bytes = metaf.read()
+    meta_key = bundleKey(meta_bytes)
+
+    if use_cache and os.path.exists(cache_name):
+        try:
+            with open(cache_name, "rb") as cachef:
+                cache_key, bundle = pickle.load(cachef)
+            if cache_key == meta_key:
+                return (bundle, {"source": "cache", "time": time.time() - start_time, "key": meta_key})
+        except Exception:
+            pass
+
+    bundle = PatternBundle(json.loads(meta_bytes))
+
+    if use_cache:
+        tmp_name = f"{cache_name}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_name, "wb") as cachef:
+                pickle.dump((meta_key, bundle), cachef, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_name, cache_name)
+        except OSError:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+    return (bundle, {"source": "built", "time": time.time() - start_time, "key": meta_key})
@@ -4,15 +4,26 @@
 # The output files are named after their sample names or their barcodes.
 # The current version of this script only works in a "project" mode. 
 # This script demands a .json file caontaining the essential meta information. 
-# nohup python convert_tsv2fqgz.py &
+# nohup python convert_tsv2fqgz.py [-l <compress_level>] [-t <threads>] [--resume] [--metrics <prefix>] &
+# The .fastq.gz files are written in the block-gzip (BGZF) format, with the blocks compressed by a pool of threads.
 # Current version: 1.0-beta
 
 
 import os
+import sys
 import time
+import getopt
+import itertools
 
-import gzip 
-import json 
+from concurrent.futures import ThreadPoolExecutor
+
+# Modules in the same directory:
+import config_MASseq
+import bgzf_MASseq
+import manifest_MASseq
+import metrics_MASseq
+import pipeline_MASseq
+import readstat_MASseq
 
 # ================================= Defining Functions ====================================
 # Get current date time.
@@ -20,50 +31,178 @@ def getDatetime():
     return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
 
+# ==================================== Parameter Parsing ==================================== 
+usage = """This is the script to convert the valid reads in "valid/*.tsv" into a .fastq.gz file for each sample, under a project directory.
+The .fastq.gz files are written in the block-gzip (BGZF) format, which is still a valid gzip format.
+
+General usage: 
+  python convert_tsv2fqgz_<version>.py [-h] [-l <compress_level>] [-t <threads>] [--resume] [--metrics <prefix> [--metrics-interval <seconds>]]
+
+  -l                    The compression level from 1 to 9, default 6;
+  -t                    The number of threads used to compress the blocks, default 4;
+  --resume              Skip this run if the outputs are up to date with its manifest "manifest/convert.json";
+  --metrics             Write snapshots of the metrics into "<prefix>.json" and "<prefix>.prom" (the Prometheus text format, for the textfile collector of "node_exporter") while running: 
+                        the reads of each sample as counters, the uncompressed and compressed MB and the compression MB/s of each sample, the reads per second, and the queue depths of the BGZF blocks and of the chunks;
+  --metrics-interval    The minimum interval between two snapshots in seconds, default 10. A last snapshot is always written at the end;
+  -h                    Print usage information and exit.
+"""
+
+optlist, args = getopt.getopt(sys.argv[1:], 'hl:t:', ['resume', 'metrics=', 'metrics-interval='])
+optdict = dict(optlist)
+
+if "-h" in optdict.keys():
+    sys.stderr.write(usage)
+    sys.exit()
+
+comp_level = 6
+thread_num = 4
+
+if ("-l" in optdict.keys()) and optdict["-l"]:
+    comp_level = min(9, max(1, int(optdict["-l"])))
+if ("-t" in optdict.keys()) and optdict["-t"]:
+    thread_num = max(1, int(optdict["-t"]))
+
+resume = "--resume" in optdict.keys()
+
+run_metrics = None
+if ("--metrics" in optdict.keys()) and optdict["--metrics"]:
+    metrics_interval = metrics_MASseq.SNAPSHOT_INTERVAL
+    if ("--metrics-interval" in optdict.keys()) and optdict["--metrics-interval"]:
+        metrics_interval = max(0.0, float(optdict["--metrics-interval"]))
+    run_metrics = metrics_MASseq.Metrics("convert", optdict["--metrics"], metrics_interval)
+
+
 # ================================ Basic Information Loading ====================================
-# Loading meta information from a .json file.
-with open('proj_meta.json') as metaf:
-    meta_inf = json.load(metaf)
+# Loading meta information from a .json file, with the pattern bundle cached by the splitting scripts.
+meta_bundle, bundle_inf = config_MASseq.loadBundle('proj_meta.json')
+meta_inf = meta_bundle.meta_inf
+
+conv_files = sorted(f for f in os.listdir("valid/") if f[-4:]==".tsv")
+
+# The run is skipped if the .tsv files, the meta information and the compression level are the same as the finished run in the manifest.
+conv_man = manifest_MASseq.StageManifest("manifest/convert.json", "convert", [f"valid/{tsvf}" for tsvf in conv_files] + ['proj_meta.json'], {
+    "meta": manifest_MASseq.metaParams(meta_bundle),
+    "options": {"level": comp_level}
+})
+
+if resume and conv_man.isComplete():
+    print(f"[{getDatetime()}] The outputs are up to date with the manifest manifest/convert.json, skipped :-)")
+    sys.exit()
+
+conv_man.begin()
 
 gz_handle_dic = {}
-rnum_stat = {}
+
+# The reads of each sample are counted with the statistics of the valid reads, which are dumped into "split_result/sample_stat.json".
+read_stats = readstat_MASseq.ReadStats()
 
 # If there isn't a "Adapter2Sample" key in the meta information file, the output files will be named after their barcodes. 
-samp_name_dic = {}
-if "Adapter2Sample" in meta_inf.keys():
-    for bc in meta_inf["UsedAdapter"]:
-        samp_name_dic[bc] = meta_inf["Adapter2Sample"][bc]
-    else:
-        samp_name_dic[bc] = bc
+samp_name_dic = meta_bundle.sample_dic
+
+# All samples share one pool of compressing threads.
+comp_pool = ThreadPoolExecutor(thread_num)
 
 for bc in meta_inf["UsedAdapter"]:
-    gz_handle_dic[bc] = gzip.open(f'split_result/{samp_name_dic[bc]}.fastq.gz', 'wt', compresslevel=6)
-    rnum_stat[bc] = 0
+    gz_handle_dic[bc] = bgzf_MASseq.BGZFWriter(f'split_result/{samp_name_dic[bc]}.fastq.gz', comp_level, comp_pool)
+
 
-conv_files = [f for f in os.listdir("valid/") if f[-4:]==".tsv"]
+# The number of reads in a chunk of the pipeline.
+chunk_size = 2000
+
+def snapshotMetrics():
+    for bc in meta_inf["UsedAdapter"]:
+        gz_handle = gz_handle_dic[bc]
+        run_metrics.counters[f"Sample_reads.{samp_name_dic[bc]}"] = read_stats.reads(bc)
+        run_metrics.gauge("raw_megabytes", gz_handle.raw_bytes / 1024**2, sample=samp_name_dic[bc])
+        run_metrics.gauge("gz_megabytes", gz_handle.gz_bytes / 1024**2, sample=samp_name_dic[bc])
+        run_metrics.gauge("compress_megabytes_per_second", gz_handle.raw_bytes / 1024**2 / max(gz_handle.comp_time, 1e-9), sample=samp_name_dic[bc])
+
+    read_num = read_stats.read_num
+    run_metrics.counters["reads_done"] = read_num
+    run_metrics.gauge("reads_per_second", read_num / max(time.time() - run_metrics.start_time, 1e-9))
+    run_metrics.gauge("queue_depth", sum(gz_handle.pending_blocks for gz_handle in gz_handle_dic.values()), queue="bgzf_blocks")
+    for queue_name, queue_depth in conv_pipe.queueDepths().items():
+        run_metrics.gauge("queue_depth", queue_depth, queue=queue_name)
+    run_metrics.snapshot()
+
+
+# Read the entries of the .tsv files in chunks.
+# The files are read line by line, by the reader thread of the pipeline.
+def convertEntries():
+    for tsvf in conv_files:
+        print(f"Converting .tsv file {tsvf}...")
+        with open(f"valid/{tsvf}") as tsv_fil:
+            for line in tsv_fil:
+                yield line.rstrip("\n").split("\t")
+
+
+def chunkEntries(entry_iter, size):
+    while True:
+        chunk = list(itertools.islice(entry_iter, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Format the entries of a chunk into FastQ records, grouped by the samples, and count them in the statistics of the chunk.
+# The barcode is parsed only once from the ID "<read_name>|<pass_number>|<split_index>|<barcode>|<UMI>".
+def convertChunk(chunk):
+    rec_dic = {bc: [] for bc in meta_inf["UsedAdapter"]}
+    chunk_reads = readstat_MASseq.ReadStats()
+    for entry_ID, entry_seq, entry_qual in chunk:
+        bc = entry_ID.split("|", 4)[3]
+        rec_dic[bc].append(f"@{entry_ID}\n{entry_seq}\n+\n{entry_qual}\n")
+        chunk_reads.addID(bc, entry_ID, len(entry_seq))
+
+    return (rec_dic, chunk_reads)
+
+
+# Write the records of a chunk, called by the writer thread of the pipeline, a snapshot of the metrics is written if it is due.
+def writeChunk(chunk_res):
+    rec_dic, chunk_reads = chunk_res
+    for bc, rec_lis in rec_dic.items():
+        gz_handle_dic[bc].writelines(rec_lis)
+    read_stats.merge(chunk_reads.state())
+
+    if run_metrics and run_metrics.due():
+        snapshotMetrics()
 
 
 # ================================= Main loop ====================================
-print(f"[{getDatetime()}] Timer started.")
+print(f"[{getDatetime()}] Timer started, compressing with {thread_num} threads at level {comp_level}.")
 curr_time = time.time()
 start_time = curr_time
 
-for tsvf in conv_files:
-    print(f"Converting .tsv file {tsvf}...", end='\t')
-    for line in open(f"valid/{tsvf}"):
-        entryLis = line.strip().split()
-        gz_handle_dic[entryLis[0].split("|")[3]].write(f"@{entryLis[0]}\n{entryLis[1]}\n+\n{entryLis[-1]}\n")
-        rnum_stat[entryLis[0].split("|")[3]] += 1
-    print(f"Time cost: {time.time() - curr_time}")
-    curr_time = time.time()
-
-print(f"[{getDatetime()}] Totally cost: {curr_time - start_time}s.")
+conv_pipe = pipeline_MASseq.Pipeline(convertChunk, writeChunk)
+conv_pipe.run(chunkEntries(convertEntries(), chunk_size))
 
 for bc in meta_inf["UsedAdapter"]:
     gz_handle_dic[bc].close()
 
+comp_pool.shutdown()
+curr_time = time.time()
+
+# The throughput of each sample is the uncompressed size divided by the time its blocks were compressed, summed over the threads.
+for bc in meta_inf["UsedAdapter"]:
+    gz_handle = gz_handle_dic[bc]
+    raw_mb = gz_handle.raw_bytes / 1024**2
+    print(f"{samp_name_dic[bc]}: {read_stats.reads(bc)} reads, {raw_mb:.1f} MB -> {gz_handle.gz_bytes / 1024**2:.1f} MB, {raw_mb / max(gz_handle.comp_time, 1e-9):.1f} MB/s per thread.")
+
+total_mb = sum(gz_handle.raw_bytes for gz_handle in gz_handle_dic.values()) / 1024**2
+print(f"[{getDatetime()}] Totally cost: {curr_time - start_time}s, {total_mb / max(curr_time - start_time, 1e-9):.1f} MB/s.")
+
 
 # Dump statistic information into a .json file.
-with open("sample_reads.stat") as f:
+with open("sample_reads.stat", "w") as f:
     for bc in meta_inf["UsedAdapter"]:
-        f.write(f"{bc}\t{meta_inf["Adapter2Sample"][bc]}\t{rnum_stat[bc]}\n")
\ No newline at end of file
+        f.write(f"{bc}\t{samp_name_dic[bc]}\t{read_stats.reads(bc)}\n")
+
+read_stats.dump("split_result/sample_stat.json", samp_name_dic)
+print(f"[{getDatetime()}] Statistics of the reads of each sample: split_result/sample_stat.json.")
+
+conv_man.complete([gz_handle.file_name for gz_handle in gz_handle_dic.values()] + ["sample_reads.stat", "split_result/sample_stat.json"], {samp_name_dic[bc]: read_stats.reads(bc) for bc in meta_inf["UsedAdapter"]})
+print(f"[{getDatetime()}] Manifest: manifest/convert.json.")
+
+if run_metrics:
+    snapshotMetrics()
+    print(f"[{getDatetime()}] Metrics: {run_metrics.prefix}.json, {run_metrics.prefix}.prom.")
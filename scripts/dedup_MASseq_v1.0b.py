@@ -0,0 +1,246 @@
+# 2026/10/17
+# Author: JIA Zheng
+# This is the script to collapse the PCR duplicates of the valid reads by their samples and UMIs, after the splitting workflow.
+# The UMI is the last field of the ID of a valid read "<read_name>|<pass_number>|<split_index>|<barcode>|<UMI>", which is written by 'split_MASseq_<version>.py' and 'recall_MASseq_<version>.py'.
+# The UMIs of a sample are clustered within one mismatch, and one representative read is written for each molecule, with a report of the duplicate rates.
+# Current version: 1.0-beta
+
+# Load the necessary libraries.
+# Standard Python libraries:
+import os
+import sys
+import getopt
+import time
+import json
+import glob
+import math
+import shutil
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party packages:
+import pysam
+
+# Modules in the same directory:
+import config_MASseq
+import bgzf_MASseq
+import manifest_MASseq
+import reader_MASseq
+import umi_MASseq
+
+def getDatetime():
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+# ==================================== User Interface & Parameter Parsing ====================================
+# Get the options provided by users in a dictionary.
+usage = """This is a script to collapse the PCR duplicates of the valid reads, by their samples (3' adapter barcodes) and their UMIs.
+The UMIs of a sample within one mismatch are clustered into one molecule ("directional" clustering: a UMI takes in the neighbors with at most about half of its reads),
+and the read with the best mean base quality of each molecule is written out as its representative.
+The reads, the UMIs, the molecules and the duplicate rate of each sample are reported in "dedup_stat.json".
+
+The input files are read twice: the UMIs are counted and clustered at first, then the reads are spilled into partition files by their molecules,
+and the partitions are collapsed one by one, so only the UMI counts and one partition of reads are held in the memory.
+
+General usage:
+  python dedup_MASseq_<version>.py [-p] [-h] [-m <meta_information_file>] [-o <output_directory>] [-l <compress_level>] [-t <threads>] [--memory <MB>] [--resume] [<file_name>.fastq.gz|<file_name>.fastq|<file_name>.tsv ...]
+
+This script can either run within or without a standard project directory structure:
+  -p    If this parameter is provided, this script will run in a "project mode": the .fastq(.gz) files in "split_result/" are read (including the "*.recalled.*" ones),
+        the representative reads are written into "dedup/<sample_name>.fastq.gz", and the report into "dedup/dedup_stat.json";
+  -m    The file name with or without the PATH to a .json files cantains necessary meta information, leave it NULL to find a 'proj_meta.json' file in current WD.
+        It is used to name the output files after the samples ("Adapter2Sample").
+
+The fillowing parameters is need when it is under a "standalone mode":
+  <file_name>    The files of valid reads: .fastq.gz or .fastq files (e.g. the ones written with "--demux"), or .tsv files (e.g. "<file_name>.BCassigned.tsv").
+                 The reads are grouped by the barcodes in their IDs, so a sample can be spread over several files;
+  -o             The directory to create "<sample_name>.dedup.fastq.gz" and "dedup_stat.json", leave it NULL to create them in current WD.
+
+Options:
+  -l          The compression level of the .fastq.gz files from 1 to 9, default 6;
+  -t          The number of threads used to compress the blocks, default 4;
+  --memory    The memory in MB for the reads of a partition, default 1024. The reads of a sample are spilled into more partitions if they are larger;
+  --resume    Skip this run if the outputs are up to date with its manifest, "manifest/dedup.json" under the "project mode", or "dedup.manifest.json" in the output directory under the "standalone mode".
+
+To view the usage information:
+  -h    Print usage information and exit.
+"""
+
+optlist, args = getopt.getopt(sys.argv[1:], 'phm:o:l:t:', ['memory=', 'resume'])
+optdict = dict(optlist)
+projWD = os.getcwd()
+
+if ("-h" in optdict.keys()) or (len(sys.argv)==1):
+    sys.stderr.write(usage)
+    sys.exit()
+
+comp_level = 6
+thread_num = 4
+memory_mb = 1024
+
+if ("-l" in optdict.keys()) and optdict["-l"]:
+    comp_level = min(9, max(1, int(optdict["-l"])))
+if ("-t" in optdict.keys()) and optdict["-t"]:
+    thread_num = max(1, int(optdict["-t"]))
+if ("--memory" in optdict.keys()) and optdict["--memory"]:
+    memory_mb = max(1, int(optdict["--memory"]))
+
+resume = "--resume" in optdict.keys()
+
+if "-p" in optdict.keys():
+    print(f"[{getDatetime()}] Will run in a 'project' mode, project WD: {projWD}")
+
+    input_lis = sorted(glob.glob(f"{projWD}/split_result/*.fastq.gz") + glob.glob(f"{projWD}/split_result/*.fastq"))
+    out_dir = f"{projWD}/dedup"
+    out_suffix = "fastq.gz"
+    manifest_name = f"{projWD}/manifest/dedup.json"
+
+else:
+    print(f"[{getDatetime()}] Will run in a 'standalone' mode, current WD: {projWD}")
+
+    input_lis = [os.path.join(projWD, file_name) for file_name in args]
+    out_dir = os.path.join(projWD, optdict["-o"]) if optdict.get("-o") else projWD
+    out_suffix = "dedup.fastq.gz"
+    manifest_name = os.path.join(out_dir, "dedup.manifest.json")
+
+if not input_lis:
+    sys.stderr.write("No file of valid reads is found :-(\n")
+    sys.exit()
+
+os.makedirs(out_dir, exist_ok=True)
+spill_dir = os.path.join(out_dir, "dedup_spill")
+json_name = os.path.join(out_dir, "dedup_stat.json")
+
+
+# ================================ Basic Information Loading ====================================
+# The meta information is only used for the names of the samples.
+if ("-m" in optdict.keys()) and optdict["-m"]:
+    meta_json = os.path.join(projWD, optdict["-m"])
+else:
+    meta_json = f"{projWD}/proj_meta.json"
+
+meta_bundle, bundle_inf = config_MASseq.loadBundle(meta_json)
+samp_name_dic = meta_bundle.sample_dic
+
+print(f"[{getDatetime()}] {len(input_lis)} files of valid reads will be collapsed.")
+
+# The run is skipped if the input files, the meta information and the options are the same as the finished run in the manifest.
+dedup_man = manifest_MASseq.StageManifest(manifest_name, "dedup", input_lis + [meta_json], {
+    "meta": manifest_MASseq.metaParams(meta_bundle),
+    "options": {"level": comp_level}
+})
+
+if resume and dedup_man.isComplete():
+    print(f"[{getDatetime()}] The outputs are up to date with the manifest {manifest_name}, skipped :-)")
+    sys.exit()
+
+dedup_man.begin()
+
+
+# ================================= Defining Functions ====================================
+# Read the valid reads of a file as (ID, sequence, quality) tuples.
+def readEntries(file_name):
+    if file_name.endswith(".tsv"):
+        with open(file_name) as tsv_fil:
+            for line in tsv_fil:
+                entry = line.rstrip("\n").split("\t")
+                if len(entry)==3:
+                    yield entry
+    elif file_name.endswith(".gz"):
+        for entry in pysam.FastxFile(file_name):
+            yield (entry.name, entry.sequence, entry.quality)
+    else:
+        yield from reader_MASseq.fastqEntries(file_name)
+
+
+def readAll():
+    for file_name in input_lis:
+        print(f"[{getDatetime()}] Reading {file_name}...", flush=True)
+        yield from readEntries(file_name)
+
+
+# The name of a sample from its barcode, the barcode itself if it isn't in the meta information.
+def sampleName(bc):
+    return samp_name_dic.get(bc, bc)
+
+
+# ================================= Main ====================================
+start_time = time.time()
+
+# Pass 1: count the reads of each UMI, and the bytes of the reads of each sample.
+umi_count_dic = collections.defaultdict(collections.Counter)
+byte_dic = collections.Counter()
+
+for read_ID, seq, qual in readAll():
+    bc, umi = umi_MASseq.readUMI(read_ID)
+    umi_count_dic[bc][umi] += 1
+    byte_dic[bc] += len(read_ID) + len(seq) + len(qual)
+
+print(f"[{getDatetime()}] {sum(byte_dic.values()) / 1024**2:.1f} MB of valid reads of {len(umi_count_dic)} samples counted.", flush=True)
+
+# Cluster the UMIs of each sample, the counts are dropped afterwards.
+cluster_dic = {}
+for bc in sorted(umi_count_dic.keys()):
+    cluster_dic[bc] = umi_MASseq.UMIClusters(umi_count_dic[bc])
+    print(f"[{getDatetime()}] {sampleName(bc)}: {len(cluster_dic[bc].counts)} UMIs clustered into {cluster_dic[bc].molecule_num} molecules.", flush=True)
+
+# Pass 2: spill the reads into the partitions of their samples by their molecules.
+# A partition is about "memory_mb" / 2, as a string in the memory takes about twice the bytes of the text.
+shutil.rmtree(spill_dir, ignore_errors=True)
+os.makedirs(spill_dir)
+
+spill_dic = {}
+for bc in cluster_dic.keys():
+    part_num = max(1, math.ceil(byte_dic[bc] * 2 / (memory_mb * 1024**2)))
+    spill_dic[bc] = umi_MASseq.PartitionSpill(os.path.join(spill_dir, bc), part_num)
+
+for read_ID, seq, qual in readAll():
+    bc, umi = umi_MASseq.readUMI(read_ID)
+    spill_dic[bc].write(cluster_dic[bc].heads[umi], read_ID, seq, qual)
+
+for spill in spill_dic.values():
+    spill.close()
+
+print(f"[{getDatetime()}] Reads spilled into {sum(spill.part_num for spill in spill_dic.values())} partitions.", flush=True)
+
+# Pass 3: collapse the partitions one by one, the representative reads are written into the file of each sample.
+comp_pool = ThreadPoolExecutor(thread_num)
+stat_dic = {}
+output_lis = []
+
+for bc in cluster_dic.keys():
+    out_name = os.path.join(out_dir, f"{sampleName(bc)}.{out_suffix}")
+    mol_size_dic = collections.Counter()
+
+    with bgzf_MASseq.BGZFWriter(out_name, comp_level, comp_pool) as out_handle:
+        for read_ID, seq, qual, read_num in spill_dic[bc].molecules():
+            out_handle.write(f"@{read_ID}\n{seq}\n+\n{qual}\n")
+            mol_size_dic[read_num] += 1
+
+    read_num = sum(cluster_dic[bc].counts.values())
+    mol_num = cluster_dic[bc].molecule_num
+    stat_dic[sampleName(bc)] = {
+        "reads": read_num,
+        "UMIs": len(cluster_dic[bc].counts),
+        "molecules": mol_num,
+        "duplicates": read_num - mol_num,
+        "duplicate_rate": round((read_num - mol_num) / max(read_num, 1), 6),
+        "reads_per_molecule": {str(size): mol_size_dic[size] for size in sorted(mol_size_dic.keys())}
+    }
+    output_lis.append(out_name)
+
+    print(f"[{getDatetime()}] {sampleName(bc)}: {read_num} reads collapsed into {mol_num} molecules, duplicate rate {stat_dic[sampleName(bc)]['duplicate_rate']:.2%}.", flush=True)
+
+comp_pool.shutdown()
+shutil.rmtree(spill_dir, ignore_errors=True)
+
+print(f"[{getDatetime()}] Totally cost: {time.time() - start_time:.1f}s.")
+
+
+# Dump statistic information into a .json file.
+with open(json_name, "w") as jf:
+    json.dump(stat_dic, jf, indent=4)
+
+print(f"[{getDatetime()}] Json file: {json_name}.")
+
+dedup_man.complete(output_lis + [json_name], stat_dic)
+print(f"[{getDatetime()}] Manifest: {manifest_name}.")
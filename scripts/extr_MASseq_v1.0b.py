@@ -11,10 +11,16 @@ import sys
 import getopt
 import time
 import json
+import itertools
 
 # Third party packages:
 import pysam
 
+# Modules in the same directory:
+import metrics_MASseq
+import pbi_MASseq
+import pipeline_MASseq
+
 def getDatetime():
     return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
@@ -24,20 +30,30 @@ usage = """This is a script to extract sequences with its ID, quality informatio
 This script will generate a json file containing some statistic information about its running process in the working directory by default.
 
 General usage: 
-  python extr_MASseq_<version>.py [-p] [-h] [-o <output_directory>] [-f <output_filename>] [<PATH>/]<file_name>.bam
+  python extr_MASseq_<version>.py [-p] [-h] [-t <threads> | -w <workers>] [-o <output_directory>] [-f <output_filename>] [--metrics <prefix> [--metrics-interval <seconds>]] [<PATH>/]<file_name>.bam
 
 This script can either run within or without a standard project directory structure:
   -p    If this parameter is provided, this script will run in a "project mode" which needs a standard project directory structure;
+  -t    If this parameter is provided, a high-throughput extraction engine will be used, with the given number of threads to decompress the .bam file.
+        The pass number is read directly from the "np" tag of each read, thus the "otherPNcol" statistic is not counted in this mode;
+  -w    If this parameter is provided, the .bam file is cut into shards by its PacBio index "<file_name>.bam.pbi", and the shards are extracted by the given number of worker processes.
+        The output files are the same as the ones of "-t", in the same order. Without the .pbi file, the high-throughput extraction engine is used instead;
+  With a .pbi file, the total number of reads is known from the start, and the progress with the ETA is printed every minute.
 
 The fillowing parameters is needed when it is under a "standalone mode":
   -o    The PATH to which the output files will be created, leave it NULL to output them in current WD;
   -f    The name for output files, leave it null to use the default name.
 
+Metrics:
+  --metrics             Write snapshots of the metrics into "<prefix>.json" and "<prefix>.prom" (the Prometheus text format, for the textfile collector of "node_exporter") while running: 
+                        the statistics as counters, and the reads per second.
+  --metrics-interval    The minimum interval between two snapshots in seconds, default 10. A last snapshot is always written at the end.
+
 To view the usage information:
   -h    Print usage information and exit.
 """
 
-optlist, args = getopt.getopt(sys.argv[1:], 'hpo:f:')
+optlist, args = getopt.getopt(sys.argv[1:], 'hpt:w:o:f:', ['metrics=', 'metrics-interval='])
 optdict = dict(optlist)
 projWD = os.getcwd()
 
@@ -45,15 +61,33 @@ if ("-h" in sys.argv[1:]) or (len(sys.argv)==1):
     sys.stderr.write(usage)
     sys.exit()
 
+thread_num = 0
+if ("-t" in optdict.keys()) and optdict["-t"]:
+    thread_num = max(1, int(optdict["-t"]))
+
+worker_num = 0
+if ("-w" in optdict.keys()) and optdict["-w"]:
+    worker_num = max(1, int(optdict["-w"]))
+
+run_metrics = None
+if ("--metrics" in optdict.keys()) and optdict["--metrics"]:
+    metrics_interval = metrics_MASseq.SNAPSHOT_INTERVAL
+    if ("--metrics-interval" in optdict.keys()) and optdict["--metrics-interval"]:
+        metrics_interval = max(0.0, float(optdict["--metrics-interval"]))
+    run_metrics = metrics_MASseq.Metrics("extr", optdict["--metrics"], metrics_interval)
+
 # Load meta information the project.
 # Configuration for the "project" mode.
 if "-p" in optdict.keys():
     print(f"[{getDatetime()}] Will run in a 'project' mode, current WD: {projWD}")
     
-    for file_name in os.listdir("hifi_reads/"):
-        if file_name[-4:]==".bam":
-            bamf_name = f"{projWD}/hifi_reads/{file_name}"
-            break
+    bam_lis = sorted(file_name for file_name in os.listdir("hifi_reads/") if file_name[-4:]==".bam")
+    file_name = bam_lis[0]
+    bamf_name = f"{projWD}/hifi_reads/{file_name}"
+
+    # Only one .bam file is extracted into "css.fastq", several .bam files of a project are split by 'batch_MASseq_<version>.py' instead.
+    if len(bam_lis) > 1:
+        print(f"[{getDatetime()}] {len(bam_lis)} .bam files found in hifi_reads/, only the first one is processed. Please split them by 'batch_MASseq_<version>.py'.")
 
     print(f"[{getDatetime()}] BAM file {file_name} will be processed.")
 
@@ -90,6 +124,16 @@ else:
 
 print(f"[{getDatetime()}] {bamf_name} will be processed.")
 
+# The total number of reads is read from the header of the PacBio index, if there is one.
+total_reads = pbi_MASseq.indexReadNum(bamf_name)
+if total_reads is not None:
+    print(f"[{getDatetime()}] {total_reads} reads in the PacBio index {bamf_name}.pbi.")
+
+if worker_num and total_reads is None:
+    print(f"[{getDatetime()}] There isn't a PacBio index {bamf_name}.pbi, the high-throughput extraction engine will be used instead.")
+    thread_num = thread_num or worker_num
+    worker_num = 0
+
 # ==================================== Defining Functions ==================================== 
 # Loading meta information from a .json file.
 
@@ -114,12 +158,144 @@ def getPassIndex(bamf):
             return i
 
 
-# ==================================== Main loop ====================================
-pn_ind = getPassIndex(bamf_name)
-print(f"[{getDatetime()}] The default colunm index of 'pass number' is set on: {pn_ind}.")
+# Print the information of a single sequence entry, only the first "log_limit" entries and every "log_step"th entry of each kind will be printed.
+log_limit = 20
+log_step = 100000
+
+def limitedLog(kind_num, msg):
+    if (kind_num <= log_limit) or (kind_num % log_step == 0):
+        print(f"[{getDatetime()}] {msg} ({kind_num} entries of this kind so far)")
+
+
+# Extract a read by a typed lookup of its "np" tag, into the file of its kind. Return False if the read doesn't have pass number information.
+def extractQuery(query, gt3_write, lt3_write, err_write, stat_dic):
+    if not query.has_tag("np"):
+        err_write(f"{query.to_string()}\n")
+        stat_dic["noPN"] += 1
+        return False
+
+    pass_num = query.get_tag("np")
+
+    if pass_num>=3:
+        gt3_write(f"@{query.query_name}|{pass_num}\n{query.query_sequence}\n+\n{query.query_qualities_str}\n")
+        stat_dic["PNgt3"] += 1
+
+    else:
+        lt3_write(f"@{query.query_name}|{pass_num}\n{query.query_sequence}\n+\n{query.query_qualities_str}\n")
+        stat_dic["PNlt3"] += 1
+
+    return True
+
+
+# Extract the reads of a chunk, the records are returned as text to be written by the writer thread of the pipeline in the order of the chunks.
+# The messages of the reads without pass number information are returned as (kind, message) tuples, which are printed by the writer thread.
+def extractReads(query_iter):
+    gt3_lis, lt3_lis, err_lis = [], [], []
+    chunk_stat = {"PNgt3": 0, "PNlt3": 0, "otherPNcol": 0, "noPN": 0}
+    log_lis = []
+
+    for query in query_iter:
+        if not extractQuery(query, gt3_lis.append, lt3_lis.append, err_lis.append, chunk_stat):
+            log_lis.append(("noPN", f"Sequence entry '{query.query_name}' doesn't have pass number information."))
+
+    return "".join(gt3_lis), "".join(lt3_lis), "".join(err_lis), chunk_stat, log_lis
+
+
+# Extract the reads of a shard in a worker process.
+def extractShard(shard):
+    return extractReads(pbi_MASseq.readShard(bamf_name, shard))
+
+
+# Extract the reads of a chunk by converting every read into a dictionary, the pass number is looked up in the column "pn_ind" at first.
+def extractDictReads(chunk):
+    gt3_lis, lt3_lis, err_lis = [], [], []
+    chunk_stat = {"PNgt3": 0, "PNlt3": 0, "otherPNcol": 0, "noPN": 0}
+    log_lis = []
+
+    for query in chunk:
+        samq_dict = query.to_dict()
 
-gt3_fq = open(gt3_name, "w")
-lt3_fq = open(lt3_name, "w")
+        if samq_dict['tags'][pn_ind][:5] == "np:i:":
+            pass_num = int(samq_dict['tags'][pn_ind][5:])
+
+        else:
+            no_pn = True
+            for i in range(len(samq_dict['tags'])):
+                if samq_dict['tags'][i][:5] == "np:i:":
+                    pass_num = int(samq_dict['tags'][i][5:])
+                    no_pn = False
+
+                    chunk_stat["otherPNcol"] += 1
+                    log_lis.append(("otherPNcol", f"Sequence entry '{samq_dict['name']}' has its pass number information in column {i}."))
+                    break
+
+            if no_pn:
+                err_lis.append(f"{query.to_string()}\n")
+
+                chunk_stat["noPN"] += 1
+                log_lis.append(("noPN", f"Sequence entry '{samq_dict['name']}' doesn't have pass number information."))
+                continue
+
+        if pass_num>=3:
+            gt3_lis.append(f"@{samq_dict['name']}|{pass_num}\n{samq_dict['seq']}\n+\n{samq_dict['qual']}\n")
+            chunk_stat["PNgt3"] += 1
+
+        else:
+            lt3_lis.append(f"@{samq_dict['name']}|{pass_num}\n{samq_dict['seq']}\n+\n{samq_dict['qual']}\n")
+            chunk_stat["PNlt3"] += 1
+
+    return "".join(gt3_lis), "".join(lt3_lis), "".join(err_lis), chunk_stat, log_lis
+
+
+# Pack the reads into chunks.
+def chunkReads(query_iter, size):
+    while True:
+        chunk = list(itertools.islice(query_iter, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# The number of reads in a chunk, or in a shard of the sharded extraction.
+chunk_size = 1000
+
+
+# Write the results of a chunk, called by the writer thread of the pipeline. The progress and the metrics are updated here if they are due.
+def writeChunk(chunk_res):
+    gt3_text, lt3_text, err_text, chunk_stat, log_lis = chunk_res
+
+    gt3_fq.write(gt3_text)
+    lt3_fq.write(lt3_text)
+    err_sam.write(err_text)
+
+    for stat_key, msg in log_lis:
+        log_num[stat_key] += 1
+        limitedLog(log_num[stat_key], msg)
+    for stat_key in chunk_stat.keys():
+        stat_dic[stat_key] += chunk_stat[stat_key]
+
+    query_num = sum(stat_dic[stat_key] for stat_key in ("PNgt3", "PNlt3", "noPN"))
+    if progress_log:
+        progress_log.update(query_num)
+    if run_metrics and run_metrics.due():
+        snapshotMetrics(query_num)
+
+
+def snapshotMetrics(query_num):
+    run_metrics.setCounters(stat_dic)
+    run_metrics.counters["reads_done"] = query_num
+    run_metrics.gauge("reads_per_second", query_num / max(time.time() - run_metrics.start_time, 1e-9))
+    if total_reads is not None:
+        run_metrics.gauge("reads_total", total_reads)
+    for queue_name, queue_depth in extr_pipe.queueDepths().items():
+        run_metrics.gauge("queue_depth", queue_depth, queue=queue_name)
+    run_metrics.snapshot()
+
+
+# ==================================== Main loop ====================================
+# Output files are written through large buffers to reduce the number of write calls.
+gt3_fq = open(gt3_name, "w", buffering=pipeline_MASseq.WRITE_BUFFER)
+lt3_fq = open(lt3_name, "w", buffering=pipeline_MASseq.WRITE_BUFFER)
 err_sam = open(err_sam_name, "w")
 
 stat_dic = {
@@ -129,38 +305,45 @@ stat_dic = {
     "noPN": 0
 }
 
-for query in pysam.AlignmentFile(bamf_name, "rb", check_sq=False):
-    samq_dict = query.to_dict()
+# The numbers of the reads of each kind printed by "limitedLog".
+log_num = {"otherPNcol": 0, "noPN": 0}
 
-    if samq_dict['tags'][pn_ind][:5] == "np:i:":
-        pass_num = int(samq_dict['tags'][pn_ind][5:])
+progress_log = None
+if total_reads is not None:
+    progress_log = pbi_MASseq.ProgressLog(total_reads)
 
-    else:
-        no_pn = True
-        for i in range(len(samq_dict['tags'])):
-            if samq_dict['tags'][i][:5] == "np:i:":
-                pass_num = int(samq_dict['tags'][i][5:])
-                no_pn = False
+# The chunks are read by the reader thread of the pipeline, extracted in the main process (or by the worker processes), and written by its writer thread.
+# The sharded extraction: the .bam file is cut into shards by the virtual file offsets in its PacBio index, and each shard is read and extracted by a worker process on its own.
+if worker_num:
+    bam_shards = pbi_MASseq.bamShards(pbi_MASseq.loadIndex(bamf_name), chunk_size)
+    print(f"[{getDatetime()}] Sharded extraction enabled, {len(bam_shards)} shards of {chunk_size} reads are extracted by {worker_num} workers.")
 
-                print(f"[{getDatetime()}] Sequence entry '{samq_dict['name']}' has its pass number information in column {i}.")
-                stat_dic["otherPNcol"] += 1
-                break
+    extr_pipe = pipeline_MASseq.Pipeline(extractShard, writeChunk, worker_num)
+    extr_pipe.run(bam_shards)
 
-        if no_pn:
-            err_sam.write(f"{query.to_string()}\n")
+# The high-throughput extraction engine.
+# The .bam file is decompressed by htslib threads, and the pass number is read by a typed lookup of the "np" tag instead of converting every read into a dictionary.
+elif thread_num:
+    print(f"[{getDatetime()}] High-throughput extraction engine enabled, {thread_num} threads are used to decompress the .bam file.")
 
-            print(f"[{getDatetime()}] Sequence entry '{samq_dict['name']}' doesn't have pass number information.")
-            stat_dic["noPN"] += 1
-            continue
+    with pysam.AlignmentFile(bamf_name, "rb", check_sq=False, threads=thread_num) as bamf:
+        extr_pipe = pipeline_MASseq.Pipeline(extractReads, writeChunk)
+        extr_pipe.run(chunkReads(bamf, chunk_size))
 
-    if pass_num>=3:
-        gt3_fq.write(f"@{samq_dict['name']}|{pass_num}\n{samq_dict['seq']}\n+\n{samq_dict['qual']}\n")
-        stat_dic["PNgt3"] += 1
+else:
+    pn_ind = getPassIndex(bamf_name)
+    print(f"[{getDatetime()}] The default colunm index of 'pass number' is set on: {pn_ind}.")
 
-    else:
-        lt3_fq.write(f"@{samq_dict['name']}|{pass_num}\n{samq_dict['seq']}\n+\n{samq_dict['qual']}\n")
-        stat_dic["PNlt3"] += 1
+    with pysam.AlignmentFile(bamf_name, "rb", check_sq=False) as bamf:
+        extr_pipe = pipeline_MASseq.Pipeline(extractDictReads, writeChunk)
+        extr_pipe.run(chunkReads(bamf, chunk_size))
+
+query_num = sum(stat_dic[stat_key] for stat_key in ("PNgt3", "PNlt3", "noPN"))
+if run_metrics:
+    snapshotMetrics(query_num)
 
+if progress_log:
+    progress_log.update(query_num, force=True)
 
 gt3_fq.close()
 lt3_fq.close()
@@ -173,4 +356,7 @@ print(f"[{getDatetime()}] All sequences sucessfully extracted :-)\nResult file:
 with open(json_name, "w") as jf:
     json.dump(stat_dic, jf, indent=4)
 
-print(f"[{getDatetime()}] Json file: {json_name}.")
\ No newline at end of file
+print(f"[{getDatetime()}] Json file: {json_name}.")
+
+if run_metrics:
+    print(f"[{getDatetime()}] Metrics: {run_metrics.prefix}.json, {run_metrics.prefix}.prom.")
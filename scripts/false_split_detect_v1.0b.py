@@ -12,9 +12,19 @@ import sys
 import getopt
 import time
 import json
+import glob
 
-# Third party packages:
-import regex
+import_start = time.time()
+
+# Modules in the same directory:
+import config_MASseq
+import recaller_MASseq
+import manifest_MASseq
+import metrics_MASseq
+import reader_MASseq
+import segment_MASseq
+
+import_time = time.time() - import_start
 
 def getDatetime():
     return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
@@ -22,11 +32,13 @@ def getDatetime():
 # ==================================== User Interface & Parameter Parsing ==================================== 
 # Get the options provided by users in a dictionary.
 usage = """This is a script to detect potential false splits conducted by CCS reads splitting.
-When this script run in a "standalone" mode, its input files should be prepared manually. 
+When this script run in a "standalone" mode, its input files should be prepared manually, the entries do not need to be sorted. 
+The entries are indexed by their CCS reads at first, only the byte ranges of the entries of each CCS read are held in memory,
+then the false splits are detected CCS read by CCS read, and the results are written out as they are done.
 This script will generate a json file containing some statistic information about its running process in the working directory by default.
 
 General usage: 
-  python split_MASseq_<version>.py [-p] [-h] [-m <meta_information_file>] [-c <candidate_output_directory>] [-n <non_candidate_output_directory>] <file_name>
+  python false_split_detect_<version>.py [-p] [-h] [-m <meta_information_file>] [-c <candidate_output_directory>] [-n <non_candidate_output_directory>] [--rejoin] [--resume] [--metrics <prefix> [--metrics-interval <seconds>]] <file_name>
 
 This script can either run within or without a standard project directory structure:
   -p    If this parameter is provided, this script will run in a "project mode" which needs a standard project directory structure;
@@ -36,11 +48,23 @@ The fillowing parameters is need when it is under a "standalone mode":
   -c    The directory to store the file containing valid reads, leave it NULL to output them in current WD;
   -i    The directory to store the file containing invalid reads for recall, leave it NULL to output them in current WD;
 
+Rejoining false splits:
+  --rejoin    Rejoin the candidates into valid reads, the split signature cut off between the elements is filled back with the consensus split signature at the lowest quality. 
+              The rejoined reads are written into "valid/rejoined.tsv" under the "project mode", or "rejoined.tsv" in the candidate output directory under the "standalone mode".
+
+Resumable runs:
+  --resume    Skip this run if the outputs are up to date with its manifest, "manifest/false_split_detect.json" under the "project mode", or "false_split_detect.manifest.json" in the candidate output directory under the "standalone mode".
+
+Metrics:
+  --metrics             Write snapshots of the metrics into "<prefix>.json" and "<prefix>.prom" (the Prometheus text format, for the textfile collector of "node_exporter") while running: 
+                        the cases as counters, the latency histograms of the steps (read, false_split, barcode, umi, write), and the CCS reads per second. The steps are not timed without this option.
+  --metrics-interval    The minimum interval between two snapshots in seconds, default 10. A last snapshot is always written at the end.
+
 To view the usage information:
   -h    Print usage information and exit.
 """
 
-optlist, args = getopt.getopt(sys.argv[1:], 'phm:c:n:d:')
+optlist, args = getopt.getopt(sys.argv[1:], 'phm:c:n:d:', ['rejoin', 'resume', 'metrics=', 'metrics-interval='])
 optdict = dict(optlist)
 projWD = os.getcwd()
 
@@ -56,30 +80,41 @@ if ("-c" in optdict.keys()) and optdict["-c"]:
 if ("-n" in optdict.keys()) and optdict["-n"]:
     discard_dir = os.path.join(projWD, optdict["-n"])
 
+rejoin = "--rejoin" in optdict.keys()
+resume = "--resume" in optdict.keys()
+
+run_metrics = None
+if ("--metrics" in optdict.keys()) and optdict["--metrics"]:
+    metrics_interval = metrics_MASseq.SNAPSHOT_INTERVAL
+    if ("--metrics-interval" in optdict.keys()) and optdict["--metrics-interval"]:
+        metrics_interval = max(0.0, float(optdict["--metrics-interval"]))
+    run_metrics = metrics_MASseq.Metrics("false_split_detect", optdict["--metrics"], metrics_interval)
 
-# This script will read a sorted list of split reads. 
-# Users can either run corresponding commands in advance and run this script under the "standalone" mode,
+
+# This script will read lists of split reads, which are not necessarily sorted.
+# Users can either merge corresponding files in advance and run this script under the "standalone" mode,
 # or run this script under the "project" mode. 
 if "-p" in optdict.keys():  # Project mode
-    os.system(f"cat {candidate_dir}/*_true.tsv > {candidate_dir}/split.tsv")
-    os.system(f"sort -k 1,1 -T {candidate_dir}/ {candidate_dir}/split.tsv > {candidate_dir}/split.sorted.tsv")
-    print(f"[{getDatetime()}] Entries sorted, in directory: '{candidate_dir}'")
-
-    orig_lis = f"{candidate_dir}/split.sorted.tsv"
+    orig_lis = sorted(glob.glob(f"{candidate_dir}/*_true.tsv"))
+    print(f"[{getDatetime()}] {len(orig_lis)} files will be processed, in directory: '{candidate_dir}'")
 
     candidate_file_name = f"{candidate_dir}/candidate_list.tsv"
     candidate_tooShort_name = f"{candidate_dir}/candidate_tooShort.tsv"
     discarded_file_name = f"{discard_dir}/not_false_split_candidate.tsv"
     onecol_file_name = f"{discard_dir}/one_column.tsv"
+    rejoined_file_name = f"{projWD}/valid/rejoined.tsv"
+    manifest_name = f"{projWD}/manifest/false_split_detect.json"
 
 else:  # Standalone mode
-    orig_lis = args[0]
-    print(f"[{getDatetime()}] File: '{orig_lis}' will be processed.")
+    orig_lis = [args[0]]
+    print(f"[{getDatetime()}] File: '{args[0]}' will be processed.")
 
     candidate_file_name = os.path.join(projWD, candidate_dir, "candidate_list.tsv")
     candidate_tooShort_name = os.path.join(projWD, candidate_dir, "candidate_tooShort.tsv")
     discarded_file_name = os.path.join(projWD, discard_dir, "not_false_split_candidate.tsv")
     onecol_file_name = os.path.join(projWD, discard_dir, "one_column.tsv")
+    rejoined_file_name = os.path.join(projWD, candidate_dir, "rejoined.tsv")
+    manifest_name = os.path.join(projWD, candidate_dir, "false_split_detect.manifest.json")
 
 
 
@@ -90,145 +125,171 @@ if ("-m" in optdict.keys()) and optdict["-m"]:
 else:
     meta_json = f"{projWD}/proj_meta.json"
 
-with open(meta_json) as metaf:
-    meta_inf = json.load(metaf)
+# The barcode index and the UMI pattern are built from the meta information, and cached in "<meta_information_file>.bundle.pkl" for the following runs.
+meta_bundle, bundle_inf = config_MASseq.loadBundle(meta_json)
 
-pattern_basic = {}
-for i in meta_inf["UsedAdapter"]:
-   pattern_basic[i] = "(?e)(" + meta_inf["AdapterBC"][i] + "){e<=2}"
+# The steps are timed by wrapping the functions, before any of them is bound to a local name.
+if run_metrics:
+    metrics_MASseq.instrument(run_metrics, meta_bundle)
+    metrics_MASseq.instrumentSteps(run_metrics, vars(recaller_MASseq))
 
+meta_inf = meta_bundle.meta_inf
+bc_index = meta_bundle.bc_index
+umi_pattern = meta_bundle.umi_pattern
 
-# ================================= Defining Functions ====================================
-# The function to extract essential information from the given entry.
-def entryBasicInfExtr(entry):
-    entry_lis = entry.strip().split()[0].split("|")
-    return (entry_lis[0], int(entry_lis[2]), entry_lis[-1])
+print(f"[{getDatetime()}] Barcode index loaded, {len(bc_index.table)} sequences indexed, {bc_index.ambiguous_num} of them are ambiguous.")
+print(f"[{getDatetime()}] Startup time: {import_time:.3f}s for imports, {bundle_inf['time']:.3f}s for the pattern bundle ({bundle_inf['source']}).")
 
-# To find a intact BC in an entry.
-def adapterAssign4Recall(seq, pdic):
-    for bc in pdic.keys():
-        bc_hit = regex.search(pdic[bc], seq)
-        if bc_hit:
-            return (bc, bc_hit.span()[0])
+# The run is skipped if its inputs, the meta information and the options are the same as the finished run in the manifest.
+fsd_man = manifest_MASseq.StageManifest(manifest_name, "false_split_detect", orig_lis + [meta_json], {
+    "meta": manifest_MASseq.metaParams(meta_bundle),
+    "bundle_key": bundle_inf["key"],
+    "options": {"rejoin": rejoin}
+})
 
-    return None
-
-# Replace the 
-def adapterBCassign(entryID, adapterBC):
-    ent_lis = entryID.split("|")[:-1]
-    ent_lis.append(f"{adapterBC}_falseSplit")
-    return "|".join(ent_lis)
-
-def seqLength(seq_entry):
-    if len(seq_entry.strip().split())<3:
-        return 0
-    else: 
-        return len(seq_entry.strip().split()[1])
+if resume and fsd_man.isComplete():
+    print(f"[{getDatetime()}] The outputs are up to date with the manifest {manifest_name}, skipped :-)")
+    sys.exit()
 
-def candidateLenAssess(candidate_entry):
-    clen = 0
-    for i in candidate_entry:
-        clen += seqLength(i)
-    return clen>200
+fsd_man.begin()
 
 
 # ================================= Defining File Handles ====================================
-candidate_file = open(f"{candidate_dir}/candidate_list.tsv", "w")
-candidate_tooShort = open(f"{candidate_dir}/candidate_tooShort.tsv", "w")
-discarded_file = open(f"{discard_dir}/not_false_split_candidate.tsv", "w")
-onecol_file = open(f"{discard_dir}/one_column.tsv", "w")
+out_handle_dic = {
+    "fs_candidate": open(candidate_file_name, "w"),
+    "fs_tooShort": open(candidate_tooShort_name, "w"),
+    "fs_discarded": open(discarded_file_name, "w"),
+    "fs_onecol": open(onecol_file_name, "w")
+}
+
+if rejoin:
+    out_handle_dic["fs_rejoined"] = open(rejoined_file_name, "w")
 
 
 # ================================= Main loop ====================================
 # The main loop of the false split identification process.
+# The entries are grouped by their CCS reads, instead of sorting all of them, the rules are implemented in "recaller_MASseq.detectFalseSplit".
 # Queues will be established to evaluate which read is potentially false split. 
 # A valid queue should has its first element 5' end intact, its last element 3' end intact, other element no intact end.
 # All of the elements should come from the same CCS read, and their ID should be continuous.
 # When a queue encounters a element with a intact 5' end, this queue should be discarded.
-entry_lis = []
-case_stat = {
-    "Case 1":0, # Case 1：The queue encountered a element with an intact 5' end.
-    "Case 2":0, # Case 2：The "first" element of this queue doesn't have an intact 5' end.
-    "Case 3":0, # Case 3：This element only has an ID.
-    "Case 4":0, # Case 4：The queue encountered an element doesn't have a continuous ID.
-    "Case 5":0, # Case 5：Valid queue. 
-    "Case 6":0, # Case 6：Valid queue with the sum of its length. 
-    "Case 7":0  # Case 7：This element can be added into the current queue.
-}
+case_stat = dict.fromkeys(recaller_MASseq.FALSE_SPLIT_STATS, 0)
+# Case 1：The queue encountered a element with an intact 5' end.
+# Case 2：The "first" element of this queue doesn't have an intact 5' end.
+# Case 3：This element only has an ID.
+# Case 4：The queue encountered an element doesn't have a continuous ID, or its CCS read ended.
+# Case 5：Valid queue. 
+# Case 6：Valid queue with the sum of its length. 
+# Case 7：This element can be added into the current queue.
+# Rejoined: Valid queues rejoined into valid reads, only counted with "--rejoin".
 
-with open(orig_lis) as fil:
-    for entry in fil:
-        entry_inf = entryBasicInfExtr(entry)
+# The name of the CCS read of an entry, the same as the "ccs_id" of its segment: "<read_name>|<pass_number>|<split_index>|<suffix>\t<sequence>\t<quality>".
+def entryRead(line):
+    return line.split(b"\t", 1)[0].rpartition(b"|")[0].split(b"|", 1)[0]
 
-        if entry_inf[-1]=="noBC":
-            if len(entry_lis)!=0:
-                case_stat["Case 1"] += 1
-                for i in entry_lis:
-                    discarded_file.write(i)
 
-            entry_lis=[entry]
+# Index the entries of the input files by their CCS reads, as a list of [file index, start, end] byte ranges for each CCS read.
+# The entries of a CCS read are written together by the splitting and the recall steps, so most of the CCS reads have one range in each file,
+# and the entries of unsorted files are still grouped correctly, with more ranges.
+def indexReads(file_lis):
+    read_dic = {}
+    for file_ind, file_name in enumerate(file_lis):
+        offset = 0
+        last_read = None
+        with open(file_name, "rb") as fil:
+            for line in fil:
+                ccs_read = entryRead(line)
+                if ccs_read!=last_read:
+                    range_lis = read_dic.setdefault(ccs_read, [])
+                    range_lis.append([file_ind, offset, offset])
+                    last_read = ccs_read
 
-        else:
-            if len(entry_lis)==0:
-                case_stat["Case 2"] += 1
+                offset += len(line)
+                range_lis[-1][2] = offset
 
-                discarded_file.write(entry)
-                continue
+    return read_dic
 
-            entry_sp = entry.split()
 
-            if len(entry_sp)<3:
-                case_stat["Case 3"] += 1
+# Parse the entries of a CCS read into segments, from the byte ranges of the mapped input files.
+def readSegments(range_lis, map_lis):
+    seg_lis = []
+    for file_ind, start, end in range_lis:
+        line_lis = map_lis[file_ind][start: end].decode().split("\n")
+        seg_lis.extend(segment_MASseq.Segment.fromLine(line + "\n") for line in line_lis[:-1])
+        if line_lis[-1]:
+            seg_lis.append(segment_MASseq.Segment.fromLine(line_lis[-1]))
 
-                onecol_file.write(entry)
-                continue
+    return seg_lis
 
-            # Check if the entry ID is continuous.
-            last_inf = entryBasicInfExtr(entry_lis[-1])
 
-            if (entry_inf[0]!=last_inf[0]) or (entry_inf[1]-last_inf[1]!=1):
-                case_stat["Case 4"] += 1
-                discarded_file.write(entry)
+read_start = time.perf_counter()
+read_dic = indexReads(orig_lis)
+map_lis = [reader_MASseq.mapFile(orig_f) for orig_f in orig_lis]
 
-                if len(entry_lis)>0:
-                    for i in entry_lis:
-                        discarded_file.write(i)
-                continue
+print(f"[{getDatetime()}] Entries of {len(read_dic)} CCS reads indexed.")
 
-            resBCassign = adapterAssign4Recall(entry_sp[1], pattern_basic)
+if run_metrics:
+    run_metrics.observe("read", time.perf_counter() - read_start)
 
-            if resBCassign:
-                # case_stat["Case 5"] += 1
-                entry_lis.append(f"{adapterBCassign(entry.split()[0], resBCassign[0])}\t{entry.split()[1]}\t{entry.split()[-1]}\n")
 
-                if candidateLenAssess(entry_lis):
-                    case_stat["Case 5"] += 1
-                    for i in entry_lis:
-                        candidate_file.write(i)
-                else:
-                    case_stat["Case 6"] += 1
-                    for i in entry_lis:
-                        candidate_tooShort.write(i)
-                
-                entry_lis = []
+# The cases are set as counters and a snapshot is written if it is due, which is checked every "metrics_step" CCS reads.
+metrics_step = 10000
 
-            else:
-                case_stat["Case 7"] += 1
-                entry_lis.append(entry)
+def snapshotMetrics(read_num):
+    run_metrics.setCounters(case_stat)
+    run_metrics.counters["reads_done"] = read_num
+    run_metrics.gauge("reads_per_second", read_num / max(time.time() - run_metrics.start_time, 1e-9))
+    run_metrics.snapshot()
 
-for i in entry_lis:
-    discarded_file.write(i)
 
-candidate_file.close()
-candidate_tooShort.close()
-discarded_file.close()
-onecol_file.close()
+# The results are written out every "flush_step" CCS reads, so only the segments of these CCS reads are held in memory.
+flush_step = 1000
+
+# The segments, including the rejoined reads, are formatted into lines only here.
+def flushResults(res_dic):
+    write_start = time.perf_counter()
+
+    for out_key in out_handle_dic.keys():
+        if out_key in recaller_MASseq.SEGMENT_OUTPUTS:
+            out_handle_dic[out_key].writelines(segment_MASseq.segmentLines(res_dic[out_key]))
+        else:
+            out_handle_dic[out_key].writelines(res_dic[out_key])
+        res_dic[out_key].clear()
+
+    if run_metrics:
+        run_metrics.observe("write", time.perf_counter() - write_start)
+
+
+res_dic = {key: [] for key in recaller_MASseq.FALSE_SPLIT_OUTPUTS}
+
+for read_num, range_lis in enumerate(read_dic.values(), 1):
+    recaller_MASseq.detectFalseSplit(readSegments(range_lis, map_lis), meta_bundle, res_dic, case_stat, rejoin)
+
+    if read_num % flush_step == 0:
+        flushResults(res_dic)
+
+    if run_metrics and (read_num % metrics_step == 0) and run_metrics.due():
+        snapshotMetrics(read_num)
+
+flushResults(res_dic)
+
+for out_handle in out_handle_dic.values():
+    out_handle.close()
 
 
 # Dump statistic information into a .json file.
 print(f"[{getDatetime()}] False split identify process done.")
 
+if not rejoin:
+    del case_stat["Rejoined"]
+
 with open(f"{projWD}/false_split_detect_cases.json", "w") as jf:
     json.dump(case_stat, jf, indent=4)
 
-print(f"[{getDatetime()}] Json file: {projWD}/false_split_detect_cases.json.")
\ No newline at end of file
+print(f"[{getDatetime()}] Json file: {projWD}/false_split_detect_cases.json.")
+
+fsd_man.complete([out_handle.name for out_handle in out_handle_dic.values()] + [f"{projWD}/false_split_detect_cases.json"], case_stat)
+
+if run_metrics:
+    snapshotMetrics(len(read_dic))
+    print(f"[{getDatetime()}] Metrics: {run_metrics.prefix}.json, {run_metrics.prefix}.prom.")
@@ -0,0 +1,147 @@
+# Author: JIA Zheng
+# This is the module to record what a stage of the splitting workflow has done in a manifest file, so that a rerun of the workflow can skip the finished stages.
+# A manifest contains the fingerprints of the input files, the parameters of the stage, the output files and the statistic information.
+# A long stage (e.g. 'split_MASseq_<version>.py') also saves checkpoints into its manifest while running, so that a rerun continues from the last checkpoint.
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import os
+import json
+import time
+import hashlib
+
+
+# A manifest written by another version is never trusted.
+MANIFEST_VERSION = "1.0b"
+
+# Only the head and the tail of an input file are hashed, together with its size, since hashing the whole .bam file of a cell takes minutes.
+FINGERPRINT_BYTES = 1024**2
+
+# The minimum interval between two checkpoints in seconds.
+CHECKPOINT_INTERVAL = 60
+
+
+# ================================= Defining Functions ====================================
+def getDatetime():
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+
+# The fingerprint of an input file: its size and the sha256 of its first and last "FINGERPRINT_BYTES" bytes.
+def fileFingerprint(file_name):
+    file_size = os.path.getsize(file_name)
+    fp_hash = hashlib.sha256()
+
+    with open(file_name, "rb") as f:
+        fp_hash.update(f.read(FINGERPRINT_BYTES))
+        f.seek(max(FINGERPRINT_BYTES, file_size - FINGERPRINT_BYTES))
+        fp_hash.update(f.read())
+
+    return {"size": file_size, "sha256": fp_hash.hexdigest()}
+
+
+# The parameters of a stage taken from the meta information, only the used barcodes are included.
+def metaParams(bundle):
+    return {
+        "UsedAdapter": bundle.used_bc,
+        "AdapterBC": {bc: bundle.meta_inf["AdapterBC"][bc] for bc in bundle.used_bc},
+        "Adapter2Sample": bundle.sample_dic
+    }
+
+
+# Open an output text file, or continue writing it from "offset" (in bytes) with the content after it truncated.
+def openOutput(file_name, offset=None, buffering=-1):
+    if offset is None:
+        return open(file_name, "w", buffering=buffering)
+
+    os.truncate(file_name, offset)
+    return open(file_name, "a", buffering=buffering)
+
+
+# ================================= Stage Manifest ====================================
+class StageManifest:
+    """
+    The manifest of a stage, stored as a .json file. The manifest of the last run is loaded only if its inputs and parameters are the same as the current ones.
+
+    Attributes:
+      file_name (str): the manifest file.
+      stage (str): the name of the stage, e.g. "split".
+      inputs (dict): the input files as keys and their fingerprints as values.
+      params (dict): the parameters of the stage, which should be serializable by "json".
+      record (dict): the manifest of the last run, None if there isn't a usable one.
+    """
+
+    def __init__(self, file_name, stage, input_files, params):
+        self.file_name = file_name
+        self.stage = stage
+        self.inputs = {in_file: fileFingerprint(in_file) for in_file in input_files}
+        self.params = json.loads(json.dumps(params))
+        self.record = None
+        self._ckpt_time = time.time()
+
+        try:
+            with open(file_name) as mf:
+                record = json.load(mf)
+        except (OSError, ValueError):
+            return
+
+        if (record.get("version"), record.get("stage"), record.get("inputs"), record.get("params"))==(MANIFEST_VERSION, stage, self.inputs, self.params):
+            self.record = record
+
+    # Whether the last run was finished and its output files are not changed since then.
+    def isComplete(self):
+        if (not self.record) or self.record["status"]!="complete":
+            return False
+
+        for out_file, out_size in self.record["outputs"].items():
+            if (not os.path.exists(out_file)) or os.path.getsize(out_file)!=out_size:
+                return False
+
+        return True
+
+    # The last checkpoint of an unfinished run: {"chunks": <chunks_done>, "offsets": {<output_file>: <size>}, "stats": <statistic_information>}.
+    # Return None if there isn't a checkpoint, or any output file is shorter than its size at the checkpoint.
+    def resumePoint(self):
+        if (not self.record) or self.record["status"]!="running" or (not self.record.get("checkpoint")):
+            return None
+
+        ckpt = self.record["checkpoint"]
+        for out_file, offset in ckpt["offsets"].items():
+            if (not os.path.exists(out_file)) or os.path.getsize(out_file)<offset:
+                return None
+
+        return ckpt
+
+    # Mark the stage as running, the checkpoint of the last run is dropped.
+    def begin(self):
+        self._dump("running", checkpoint=None)
+
+    def checkpointDue(self):
+        return time.time() - self._ckpt_time >= CHECKPOINT_INTERVAL
+
+    # "offsets" are the sizes of the output files after the first "chunk_num" chunks are written, and flushed.
+    def saveCheckpoint(self, chunk_num, offsets, stats):
+        self._ckpt_time = time.time()
+        self._dump("running", checkpoint={"chunks": chunk_num, "offsets": offsets, "stats": stats})
+
+    def complete(self, output_files, stats):
+        self._dump("complete", outputs={out_file: os.path.getsize(out_file) for out_file in output_files}, stats=stats)
+
+    # The manifest is written into a temporary file at first, so that a crash never leaves a broken manifest.
+    def _dump(self, status, **content):
+        record = {
+            "stage": self.stage,
+            "version": MANIFEST_VERSION,
+            "status": status,
+            "time": getDatetime(),
+            "inputs": self.inputs,
+            "params": self.params
+        }
+        record.update(content)
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.file_name)), exist_ok=True)
+        tmp_name = f"{self.file_name}.{os.getpid()}.tmp"
+        with open(tmp_name, "w") as mf:
+            json.dump(record, mf, indent=4)
+        os.replace(tmp_name, self.file_name)
+
+        self.record = record
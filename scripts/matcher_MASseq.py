@@ -0,0 +1,364 @@
+# Author: JIA Zheng
+# This is the module containing the signature matchers shared by the MAS-PAIso-seq(2) splitting scripts.
+# It is imported by the scripts in the same directory, and is not supposed to be run directly.
+# Current version: 1.0-beta
+
+# Third party packages:
+import regex
+
+
+# ================================= Signature Sequences ====================================
+# "SigF" is the signature sequence of the 5' end of a transcript, "SigRc" is the common sequence of the 3' adapters.
+# Their complementary sequences are used to tell the orientation of a CCS read.
+SigF = "TCTACACGACGCTCTTCCGATCT"
+SigF_comp = "AGATCGGAAGAGCGTCGTGTAGA"
+SigRc = "CTCTGCGTTGATACCACTGCTTA"
+SigRc_comp = "TAAGCAGTGGTATCAACGCAGAG"
+
+# The sequence CCS reads are split upon, which is "SigRc" with a few more bases of the 3' adapter.
+SplitSig = "GTACTCTGCGTTGATACCACTGCTTA"
+
+
+# ================================= Bit-parallel Matcher ====================================
+class MyersPattern:
+    """
+    An approximate matcher of a fixed pattern (no longer than 64 nt) based on the bit-vector algorithm of Myers (1999), in the form of Hyyro (2003).
+
+    The bit-vector scan finds the end position of the first hit with no more than "max_err" edits in one pass over the sequence without backtracking.
+    The span of a hit is then decided by the "(?e)(<pattern>){e<=max_err}" regex pattern within a window of (len(pattern) + 3 * max_err) bases around the first hit end,
+    so that the spans are the same as the ones returned by "regex.search" and "regex.finditer" over the whole sequence.
+    As "regex", an "endpos" beyond the end of the sequence is the end of the sequence, e.g. the first 50 nt of a shorter split read are the whole read.
+
+    Arg:
+      sig (str): the pattern sequence.
+      max_err (int): the maximum number of edits allowed in a hit.
+    """
+
+    def __init__(self, sig, max_err):
+        if len(sig) > 64:
+            raise ValueError(f"Pattern '{sig}' is longer than 64 nt.")
+
+        self.sig = sig
+        self.max_err = max_err
+        self.pattern = regex.compile(f"(?e)({sig}){{e<={max_err}}}")
+
+        # The bit mask of each base, the i-th bit is set if the i-th base of the pattern is this base. "N" and other characters match nothing.
+        self.peq = {}
+        for i, b in enumerate(sig):
+            self.peq[b] = self.peq.get(b, 0) | (1 << i)
+
+        self.all_mask = (1 << len(sig)) - 1
+        self.high_bit = 1 << (len(sig) - 1)
+
+    def firstEnd(self, seq, pos=0, endpos=None):
+        """
+        Return the end position of the first hit in seq[pos:endpos], or -1.
+        """
+        endpos = len(seq) if endpos is None else min(endpos, len(seq))
+
+        peq = self.peq
+        all_mask = self.all_mask
+        high_bit = self.high_bit
+        max_err = self.max_err
+
+        pv = all_mask
+        mv = 0
+        score = len(self.sig)
+
+        for j in range(pos, endpos):
+            eq = peq.get(seq[j], 0)
+            xv = eq | mv
+            xh = (((eq & pv) + pv) ^ pv) | eq
+            ph = mv | (~(xh | pv) & all_mask)
+            mh = pv & xh
+
+            if ph & high_bit:
+                score += 1
+            elif mh & high_bit:
+                score -= 1
+                if score <= max_err:
+                    return j + 1
+
+            # A hit can start at any position of the sequence, thus no carry is shifted into the horizontal deltas.
+            ph = (ph << 1) & all_mask
+            mh = (mh << 1) & all_mask
+            pv = mh | (~(xv | ph) & all_mask)
+            mv = ph & xv
+
+        return -1
+
+    def search(self, seq, pos=0, endpos=None):
+        """
+        Return the first hit in seq[pos:endpos] as a regex match object, or None.
+        """
+        endpos = len(seq) if endpos is None else min(endpos, len(seq))
+
+        hit_end = self.firstEnd(seq, pos, endpos)
+        if hit_end == -1:
+            return None
+
+        # The first hit can neither start before (hit_end - len(sig) - max_err), nor end after (hit_end + 2 * max_err).
+        win_start = max(pos, hit_end - len(self.sig) - self.max_err)
+        win_end = min(endpos, hit_end + 2*self.max_err)
+        return self.pattern.search(seq, win_start, win_end)
+
+    def finditer(self, seq, pos=0, endpos=None):
+        """
+        Iterate over the non-overlapping hits in seq[pos:endpos], same as "regex.finditer".
+        """
+        endpos = len(seq) if endpos is None else min(endpos, len(seq))
+
+        while pos < endpos:
+            hit = self.search(seq, pos, endpos)
+            if not hit:
+                return
+            yield hit
+            pos = max(hit.end(), pos + 1)
+
+
+# ================================= Anchor Patterns ====================================
+class AnchorPattern:
+    """
+    A fuzzy signature pattern with an index of exact k-mer seeds to locate its candidate windows.
+
+    The signature is cut into (max_err + 1) non-overlapping seeds. Any hit with no more than "max_err" edits must contain at least one of the seeds exactly,
+    so the fuzzy pattern only needs to be verified in the windows around the seed hits, and returns the same spans as a full-length search.
+    The windows are verified by a "MyersPattern" of the signature.
+
+    Arg:
+      sig (str): the signature sequence.
+      max_err (int): the maximum number of edits allowed in a hit.
+    """
+
+    def __init__(self, sig, max_err):
+        self.sig = sig
+        self.max_err = max_err
+        self.matcher = MyersPattern(sig, max_err)
+
+        seed_len = len(sig) // (max_err + 1)
+        self.seeds = []
+        for i in range(max_err + 1):
+            seed_end = len(sig) if i == max_err else (i + 1) * seed_len
+            self.seeds.append((sig[i*seed_len: seed_end], i*seed_len))
+
+    def windows(self, seq):
+        """
+        Locate the candidate windows of the pattern in a sequence.
+
+        Return: a sorted list of merged (start, end) windows, an empty list if no seed was found.
+        """
+        hit_lis = []
+        for seed, offset in self.seeds:
+            ind = seq.find(seed)
+            while ind != -1:
+                hit_lis.append(ind - offset)
+                ind = seq.find(seed, ind + 1)
+
+        if not hit_lis:
+            return []
+
+        hit_lis.sort()
+        pad = self.max_err
+        win_lis = []
+        for hit in hit_lis:
+            win_start = max(0, hit - pad)
+            win_end = min(len(seq), hit + len(self.sig) + pad)
+            if win_lis and win_start <= win_lis[-1][1]:
+                win_lis[-1][1] = max(win_lis[-1][1], win_end)
+            else:
+                win_lis.append([win_start, win_end])
+
+        return win_lis
+
+    def search(self, seq, win_lis=None):
+        """
+        Return the first hit of the pattern in the sequence, or None.
+        The pattern is only verified in the given windows, the windows will be located if they are not provided.
+        """
+        if win_lis is None:
+            win_lis = self.windows(seq)
+
+        for win_start, win_end in win_lis:
+            hit = self.matcher.search(seq, win_start, win_end)
+            if hit:
+                return hit
+
+        return None
+
+    def finditer(self, seq, win_lis=None):
+        """
+        Iterate over the hits of the pattern in the sequence, same as "regex.finditer".
+        """
+        if win_lis is None:
+            win_lis = self.windows(seq)
+
+        for win_start, win_end in win_lis:
+            yield from self.matcher.finditer(seq, win_start, win_end)
+
+
+# ================================= Signature Matchers ====================================
+# The matchers of the signature sequences shared by the splitting scripts.
+sigF_anchor = AnchorPattern(SigF, 2)
+sigRc_anchor = AnchorPattern(SigRc, 2)
+sigF_comp_anchor = AnchorPattern(SigF_comp, 2)
+sigRc_comp_anchor = AnchorPattern(SigRc_comp, 2)
+split_anchor = AnchorPattern(SplitSig, 3)
+
+# "SigF" without its first base, which is searched in the first 50 nt of a split read to check whether its 5' end is intact.
+sigF_5end_matcher = MyersPattern(SigF[1:], 2)
+
+
+def detectOrientation(seq):
+    """
+    Detect the signature sequences of both orientations in a CCS read.
+
+    Return: (fwd_det, bwd_det), fwd_det is True if both "SigF" and "SigRc" are found, bwd_det is True if both of their complementary sequences are found.
+    """
+    orient_anchors = (sigF_anchor, sigRc_anchor, sigF_comp_anchor, sigRc_comp_anchor)
+    win_lis = [anchor.windows(seq) for anchor in orient_anchors]
+
+    fwd_det = bool(sigF_anchor.search(seq, win_lis[0])) and bool(sigRc_anchor.search(seq, win_lis[1]))
+    bwd_det = bool(sigF_comp_anchor.search(seq, win_lis[2])) and bool(sigRc_comp_anchor.search(seq, win_lis[3]))
+
+    return (fwd_det, bwd_det)
+
+
+# ================================= Barcode Index ====================================
+# To get all the sequences within the given edit distance of a sequence.
+def editNeighborhood(seq, max_err, alphabet="ACGTN"):
+    """
+    Enumerate the sequences within "max_err" edits (substitutions, insertions and deletions) of a sequence.
+
+    Return: a dictionary with the neighbor sequences as keys and their edit distances to the given sequence as values.
+    """
+    nb_dic = {seq: 0}
+    frontier = [seq]
+
+    for dist in range(1, max_err + 1):
+        next_frontier = []
+        for nb in frontier:
+            for i in range(len(nb) + 1):
+                edit_lis = [nb[:i] + b + nb[i:] for b in alphabet]
+                if i < len(nb):
+                    edit_lis.append(nb[:i] + nb[i+1:])
+                    edit_lis.extend(nb[:i] + b + nb[i+1:] for b in alphabet if b != nb[i])
+
+                for edited in edit_lis:
+                    if edited not in nb_dic:
+                        nb_dic[edited] = dist
+                        next_frontier.append(edited)
+        frontier = next_frontier
+
+    return nb_dic
+
+
+class BarcodeIndex:
+    """
+    The index of all the sequences within "max_err" edits of the used 3' adapter barcodes, to assign barcodes by dictionary lookups.
+
+    A sequence within the same (smallest) edit distance of more than one barcode is flagged as ambiguous, and will not be assigned to any barcode.
+    The barcode of a sequence is the one of its first (leftmost) barcode region: the positions are looked up from the left, and at the first one with any hit,
+    the hits starting within 2 * "max_err" bases are compared, the one with the smallest edit distance wins, then the one starting first.
+    Unlike trying the barcodes one after another (the first one with a hit anywhere wins), the result doesn't depend on the order of the barcodes,
+    and a region equally close to two barcodes is not assigned.
+
+    Arg:
+      bc_dic (dict): the barcode IDs as keys and their sequences as values, e.g. the "AdapterBC" of the used adapters.
+      max_err (int): the maximum number of edits allowed in a barcode hit.
+    """
+
+    def __init__(self, bc_dic, max_err=2):
+        self.bc_dic = dict(bc_dic)
+        self.max_err = max_err
+
+        # Neighbor sequence: (barcode ID, edit distance), the barcode ID is None for ambiguous neighbors.
+        self.table = {}
+        for bc, bc_seq in self.bc_dic.items():
+            for nb, dist in editNeighborhood(bc_seq, max_err).items():
+                if nb not in self.table or dist < self.table[nb][1]:
+                    self.table[nb] = (bc, dist)
+                elif dist == self.table[nb][1] and self.table[nb][0] != bc:
+                    self.table[nb] = (None, dist)
+
+        self.ambiguous_num = sum(1 for bc, dist in self.table.values() if bc is None)
+        self.lengths = sorted({len(nb) for nb in self.table})
+        self.anchors = [AnchorPattern(bc_seq, max_err) for bc_seq in self.bc_dic.values()]
+
+    def hitsAt(self, seq, start, end=None):
+        """
+        Look up the sequences starting at a position, return a list of (edit distance, start, barcode ID) hits.
+        """
+        if end is None:
+            end = len(seq)
+
+        hit_lis = []
+        for nb_len in self.lengths:
+            if start + nb_len > end:
+                break
+            nb_hit = self.table.get(seq[start: start + nb_len])
+            if nb_hit:
+                hit_lis.append((nb_hit[1], start, nb_hit[0]))
+
+        return hit_lis
+
+    def bestHit(self, hit_lis):
+        """
+        Choose the hit with the smallest edit distance and the smallest start position, return (barcode ID, start) or None.
+        """
+        if not hit_lis:
+            return None
+
+        best = min(hit_lis)
+        if best[-1] is None:
+            return None
+
+        # Different barcodes with the same smallest edit distance.
+        for hit in hit_lis:
+            if hit[0] == best[0] and hit[-1] != best[-1]:
+                return None
+
+        return (best[-1], best[1])
+
+    def regionHit(self, seq, hit_lis, end):
+        """
+        Choose the barcode of the region starting at the first position with any hit ("hit_lis"), return (barcode ID, start) or None.
+        A better hit of the same region starts no more than 2 * "max_err" bases later, so these positions are looked up as well.
+        """
+        start = hit_lis[0][1]
+        for later in range(start + 1, min(end, start + 2*self.max_err + 1)):
+            hit_lis.extend(self.hitsAt(seq, later, end))
+
+        return self.bestHit(hit_lis)
+
+    def assignTail(self, seq, tail_len=25):
+        """
+        Assign the barcode in the last "tail_len" bases of a sequence, return (barcode ID, start position relative to the end of the tail) or None.
+        """
+        tail = seq[-tail_len:]
+        for start in range(len(tail)):
+            hit_lis = self.hitsAt(tail, start)
+            if hit_lis:
+                bc_hit = self.regionHit(tail, hit_lis, len(tail))
+                return (bc_hit[0], bc_hit[1] - tail_len) if bc_hit else None
+
+        return None
+
+    def assignRead(self, seq):
+        """
+        Assign the barcode in a whole sequence, return (barcode ID, start position) or None.
+        Only the windows around the exact seeds of the barcodes are looked up, the first (leftmost) barcode region is chosen the same as "assignTail".
+        """
+        win_lis = []
+        for win_start, win_end in sorted(win for anchor in self.anchors for win in anchor.windows(seq)):
+            if win_lis and win_start <= win_lis[-1][1]:
+                win_lis[-1][1] = max(win_lis[-1][1], win_end)
+            else:
+                win_lis.append([win_start, win_end])
+
+        for win_start, win_end in win_lis:
+            for start in range(win_start, win_end):
+                hit_lis = self.hitsAt(seq, start, win_end)
+                if hit_lis:
+                    return self.regionHit(seq, hit_lis, win_end)
+
+        return None
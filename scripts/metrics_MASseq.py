@@ -0,0 +1,230 @@
+# Author: JIA Zheng
+# This is the module to collect the metrics of a running script: counters, gauges, and latency histograms of the steps on the hot path.
+# Snapshots are written periodically into a .json file and a Prometheus text file, which can be scraped by the textfile collector of "node_exporter".
+# The steps are timed by wrapping the functions doing them, so nothing is timed (or slowed down) unless the metrics are enabled.
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import os
+import json
+import time
+import bisect
+
+# Modules in the same directory:
+import matcher_MASseq
+
+
+# The upper bounds of the latency buckets in seconds, from 1 microsecond to 10 seconds.
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The minimum interval between two snapshots in seconds.
+SNAPSHOT_INTERVAL = 10
+
+# The functions of the scripts and "recaller_MASseq" timed as steps, with the names of the steps.
+STEP_FUNCTIONS = {
+    "splitPrim": "split",
+    "checkIntactSigF": "sigf",
+    "detectFalseSplit": "false_split"
+}
+
+
+# ================================= Histogram ====================================
+class Histogram:
+    """
+    A latency histogram with the buckets in "LATENCY_BUCKETS", the last bucket counts the values larger than all the bounds.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, state):
+        for i, bucket_num in enumerate(state["counts"]):
+            self.counts[i] += bucket_num
+        self.sum += state["sum"]
+        self.count += state["count"]
+
+    def state(self):
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+# A wrapper of a compiled pattern, whose "split" method is timed.
+class TimedPattern:
+    def __init__(self, pattern, run_metrics, step):
+        self.pattern = pattern
+        self.run_metrics = run_metrics
+        self.step = step
+
+    def split(self, *split_args, **split_kwargs):
+        start_time = time.perf_counter()
+        split_res = self.pattern.split(*split_args, **split_kwargs)
+        self.run_metrics.observe(self.step, time.perf_counter() - start_time)
+        return split_res
+
+
+# ================================= Metrics ====================================
+class Metrics:
+    """
+    The metrics of a script. Worker processes collect their own metrics and send them to the main process by "drain" and "merge".
+
+    Attributes:
+      script (str): the name of the script, used as the "script" label of every metric.
+      prefix (str): the snapshots are written into "<prefix>.json" and "<prefix>.prom".
+      interval (float): the minimum interval between two snapshots in seconds.
+      counters (dict): the counter names as keys and the counts as values.
+      histograms (dict): the step names as keys and their "Histogram" as values.
+      gauges (dict): (name, labels) as keys and the values as values, labels are tuples of (label_name, label_value).
+    """
+
+    def __init__(self, script, prefix, interval=SNAPSHOT_INTERVAL):
+        self.script = script
+        self.prefix = prefix
+        self.interval = interval
+
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+        self.start_time = time.time()
+        self._snap_time = self.start_time
+        self._worker_dic = {}
+
+    def observe(self, step, seconds):
+        if step not in self.histograms:
+            self.histograms[step] = Histogram()
+        self.histograms[step].observe(seconds)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    # Set the counters to the totals in a statistic dictionary, nested dictionaries (e.g. "Sample_reads") are flattened as "<key>.<sub_key>".
+    def setCounters(self, stat_dic, key_prefix=""):
+        for stat_key, stat_value in stat_dic.items():
+            if isinstance(stat_value, dict):
+                self.setCounters(stat_value, f"{key_prefix}{stat_key}.")
+            elif isinstance(stat_value, (int, float)):
+                self.counters[f"{key_prefix}{stat_key}"] = stat_value
+
+    def gauge(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    # Wrap a function, so that each call of it is timed as "step".
+    def timed(self, step, func):
+        def timedFunc(*func_args, **func_kwargs):
+            start_time = time.perf_counter()
+            func_res = func(*func_args, **func_kwargs)
+            self.observe(step, time.perf_counter() - start_time)
+            return func_res
+
+        return timedFunc
+
+    # Return the counters and the histograms collected since the last call, and reset them. Used by worker processes.
+    def drain(self):
+        state = {
+            "counters": self.counters,
+            "histograms": {step: hist.state() for step, hist in self.histograms.items()}
+        }
+        self.counters = {}
+        self.histograms = {}
+
+        return state
+
+    def merge(self, state):
+        for name, value in state["counters"].items():
+            self.count(name, value)
+        for step, hist_state in state["histograms"].items():
+            if step not in self.histograms:
+                self.histograms[step] = Histogram()
+            self.histograms[step].merge(hist_state)
+
+    # Record a chunk done by a worker, the reads per second of each worker are computed by the time it spent on its chunks.
+    def workerChunk(self, worker, read_num, seconds):
+        worker_inf = self._worker_dic.setdefault(str(worker), [0, 0.0])
+        worker_inf[0] += read_num
+        worker_inf[1] += seconds
+
+        self.gauge("worker_reads_per_second", worker_inf[0] / max(worker_inf[1], 1e-9), worker=str(worker))
+        self.gauge("worker_reads", worker_inf[0], worker=str(worker))
+
+    def due(self):
+        return time.time() - self._snap_time >= self.interval
+
+    # Write a snapshot into the .json and the .prom files, each file is written into a temporary file at first, then renamed.
+    # The metrics are copied before they are written, since the reading thread of a process pool may add a metric meanwhile.
+    def snapshot(self):
+        self._snap_time = time.time()
+        self.gauge("uptime_seconds", self._snap_time - self.start_time)
+
+        json_dic = {
+            "script": self.script,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self._snap_time)),
+            "counters": dict(self.counters),
+            "gauges": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in list(self.gauges.items())],
+            "histograms": {step: dict(hist.state(), buckets=list(LATENCY_BUCKETS)) for step, hist in list(self.histograms.items())}
+        }
+
+        writeAtomic(f"{self.prefix}.json", json.dumps(json_dic, indent=4))
+        writeAtomic(f"{self.prefix}.prom", self.promText())
+
+    # The metrics in the Prometheus text format, all the metric names start with "masseq_".
+    def promText(self):
+        script_label = f'script="{self.script}"'
+        line_lis = []
+
+        line_lis.append("# HELP masseq_events_total The statistics of the script, e.g. the numbers of reads of each kind.")
+        line_lis.append("# TYPE masseq_events_total counter")
+        for name, value in sorted(dict(self.counters).items()):
+            line_lis.append(f'masseq_events_total{{{script_label},event="{name}"}} {value}')
+
+        gauge_dic = dict(self.gauges)
+        for name in sorted(set(gauge_key[0] for gauge_key in gauge_dic)):
+            line_lis.append(f"# TYPE masseq_{name} gauge")
+            for (gauge_name, labels), value in sorted(gauge_dic.items()):
+                if gauge_name==name:
+                    label_str = "".join(f',{label_name}="{label_value}"' for label_name, label_value in labels)
+                    line_lis.append(f"masseq_{name}{{{script_label}{label_str}}} {value}")
+
+        line_lis.append("# HELP masseq_step_seconds The time cost of each call of a step.")
+        line_lis.append("# TYPE masseq_step_seconds histogram")
+        for step, hist in sorted(dict(self.histograms).items()):
+            step_label = f'{script_label},step="{step}"'
+            cum_num = 0
+            for bound, bucket_num in zip(LATENCY_BUCKETS, hist.counts):
+                cum_num += bucket_num
+                line_lis.append(f'masseq_step_seconds_bucket{{{step_label},le="{bound:g}"}} {cum_num}')
+            line_lis.append(f'masseq_step_seconds_bucket{{{step_label},le="+Inf"}} {hist.count}')
+            line_lis.append(f"masseq_step_seconds_sum{{{step_label}}} {hist.sum}")
+            line_lis.append(f"masseq_step_seconds_count{{{step_label}}} {hist.count}")
+
+        return "\n".join(line_lis) + "\n"
+
+
+# ================================= Defining Functions ====================================
+def writeAtomic(file_name, text):
+    tmp_name = f"{file_name}.{os.getpid()}.tmp"
+    with open(tmp_name, "w") as f:
+        f.write(text)
+    os.replace(tmp_name, file_name)
+
+
+# Time the steps of the pattern bundle on the hot path: the orientation detection, the barcode assignment and the UMI parsing.
+# The scripts and "recaller_MASseq" call them through the bundle and "matcher_MASseq", so they are timed wherever they are called.
+def instrument(run_metrics, bundle):
+    matcher_MASseq.detectOrientation = run_metrics.timed("orientation", matcher_MASseq.detectOrientation)
+
+    bundle.bc_index.assignTail = run_metrics.timed("barcode", bundle.bc_index.assignTail)
+    bundle.bc_index.assignRead = run_metrics.timed("barcode", bundle.bc_index.assignRead)
+    bundle.umi_pattern = TimedPattern(bundle.umi_pattern, run_metrics, "umi")
+
+
+# Time the functions in "STEP_FUNCTIONS" of a namespace, e.g. "globals()" of a script or "vars(recaller_MASseq)".
+def instrumentSteps(run_metrics, namespace):
+    for func_name, step in STEP_FUNCTIONS.items():
+        if func_name in namespace:
+            namespace[func_name] = run_metrics.timed(step, namespace[func_name])
@@ -0,0 +1,147 @@
+# Author: JIA Zheng
+# This is the module to read the PacBio index (.pbi) of a .bam file, and to cut the .bam file into shards of reads by the virtual file offsets in it.
+# Each shard is read by seeking to the offset of its first read, so the shards can be read by independent worker processes instead of one reader.
+# The number of reads in the index also gives the progress and the ETA of a run from the start.
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import os
+import sys
+import time
+import array
+import struct
+import itertools
+
+# Third party packages:
+import pysam
+
+
+# The header of a .pbi file: magic, version, flags, number of reads, 18 reserved bytes.
+PBI_HEADER = struct.Struct("<4sIHI18x")
+PBI_MAGIC = b"PBI\x01"
+PBI_VERSION = 0x030001
+
+# The minimum interval between two progress lines in seconds.
+PROGRESS_INTERVAL = 60
+
+
+# ================================= Defining Functions ====================================
+def getDatetime():
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+
+# Read an array of "read_num" little-endian numbers from a .pbi file.
+def readColumn(pbi_handle, typecode, read_num):
+    column = array.array(typecode)
+    column.frombytes(pbi_handle.read(column.itemsize * read_num))
+
+    if len(column)!=read_num:
+        raise ValueError(f"Truncated .pbi file: {os.fsdecode(pbi_handle.name)}")
+    if sys.byteorder=="big":
+        column.byteswap()
+
+    return column
+
+
+# Read the header of the .pbi file of a .bam file, return the number of reads, or None if there isn't a "<bam_file>.pbi".
+def indexReadNum(bam_name):
+    if not os.path.exists(f"{bam_name}.pbi"):
+        return None
+
+    with pysam.BGZFile(f"{bam_name}.pbi", "rb") as pbi_handle:
+        magic, version, flags, read_num = PBI_HEADER.unpack(pbi_handle.read(PBI_HEADER.size))
+
+    if magic!=PBI_MAGIC:
+        raise ValueError(f"Not a PacBio index file: {bam_name}.pbi")
+
+    return read_num
+
+
+# Load the hole numbers and the virtual file offsets of the reads from the "BasicData" section of a .pbi file.
+# Return None if there isn't a "<bam_file>.pbi".
+def loadIndex(bam_name):
+    read_num = indexReadNum(bam_name)
+    if read_num is None:
+        return None
+
+    with pysam.BGZFile(f"{bam_name}.pbi", "rb") as pbi_handle:
+        pbi_handle.read(PBI_HEADER.size)
+
+        # rgId, qStart and qEnd are not used.
+        readColumn(pbi_handle, "i", read_num * 3)
+        hole_numbers = readColumn(pbi_handle, "i", read_num)
+        # readQual and ctxtFlag are not used.
+        readColumn(pbi_handle, "f", read_num)
+        readColumn(pbi_handle, "B", read_num)
+        file_offsets = readColumn(pbi_handle, "q", read_num)
+
+    return {"reads": read_num, "holes": hole_numbers, "offsets": file_offsets}
+
+
+# Write a .pbi file with the "BasicData" section only, the read groups, query positions, read qualities and flags are left empty.
+def writeIndex(bam_name, hole_numbers, file_offsets):
+    read_num = len(file_offsets)
+
+    columns = [array.array("i", [-1] * read_num * 3), array.array("i", hole_numbers), array.array("f", [0.0] * read_num),
+               array.array("B", [0] * read_num), array.array("q", file_offsets)]
+    if sys.byteorder=="big":
+        for column in columns:
+            column.byteswap()
+
+    with pysam.BGZFile(f"{bam_name}.pbi", "wb") as pbi_handle:
+        pbi_handle.write(PBI_HEADER.pack(PBI_MAGIC, PBI_VERSION, 0, read_num))
+        for column in columns:
+            pbi_handle.write(column.tobytes())
+
+
+# Cut the reads of an index into shards of "shard_size" reads.
+# A shard is (first_read, virtual_file_offset, read_number, hole_number), where the hole number of the first read is used to check the offset.
+def bamShards(pbi_index, shard_size):
+    return [(i, pbi_index["offsets"][i], min(shard_size, pbi_index["reads"] - i), pbi_index["holes"][i]) for i in range(0, pbi_index["reads"], shard_size)]
+
+
+# Read the reads of a shard, by seeking to the offset of its first read.
+# The hole number of the first read is checked against the index if its name is "<movie>/<hole_number>/<...>", a stale index raises a "ValueError".
+def readShard(bam_name, shard):
+    with pysam.AlignmentFile(bam_name, "rb", check_sq=False) as bamf:
+        bamf.seek(shard[1])
+
+        for i, query in enumerate(itertools.islice(bamf, shard[2])):
+            if i==0:
+                name_lis = query.query_name.split("/")
+                if len(name_lis)>=3 and name_lis[1].isdigit() and int(name_lis[1])!=shard[3]:
+                    raise ValueError(f"The index {bam_name}.pbi doesn't match the .bam file: read {shard[0]} is '{query.query_name}', but hole number {shard[3]} is expected.")
+
+            yield query
+
+
+# ================================= Progress Log ====================================
+class ProgressLog:
+    """
+    Print the progress of a run with its ETA, at most once every "interval" seconds.
+
+    Attributes:
+      total (int): the total number of reads, e.g. from the .pbi file.
+      start_done (int): the number of reads done before this run, e.g. before the checkpoint it continues from.
+    """
+
+    def __init__(self, total, start_done=0, interval=PROGRESS_INTERVAL):
+        self.total = total
+        self.start_done = start_done
+        self.interval = interval
+        self.start_time = time.time()
+        self._log_time = self.start_time
+
+    def update(self, done, force=False):
+        curr_time = time.time()
+        if (not force) and curr_time - self._log_time < self.interval:
+            return
+
+        self._log_time = curr_time
+        read_speed = (done - self.start_done) / max(curr_time - self.start_time, 1e-9)
+        eta = "--:--:--"
+        if read_speed>0:
+            eta_sec = int((self.total - done) / read_speed)
+            eta = f"{eta_sec // 3600:02d}:{eta_sec % 3600 // 60:02d}:{eta_sec % 60:02d}"
+
+        print(f"[{getDatetime()}] Progress: {done}/{self.total} reads ({done / max(self.total, 1) * 100:.1f}%), {read_speed:.1f} reads/s, ETA {eta}.", flush=True)
@@ -0,0 +1,156 @@
+# Author: JIA Zheng
+# This is the module to run a script as a pipeline of three stages: a reader thread reading chunks of the input, the computing stage (in the main process, or a pool of worker processes),
+# and a writer thread writing the results of the chunks out, in the same order as the input. The stages are connected by bounded queues,
+# so a slow stage blocks the ones before it, instead of chunks piling up in the memory.
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import time
+import queue
+import threading
+import collections
+import multiprocessing
+
+
+# The number of chunks each queue holds for each worker, at least 2 chunks are held.
+QUEUE_CHUNKS = 2
+
+# The buffer size of the output files, a chunk is written by a few large writes instead of one write for each line.
+WRITE_BUFFER = 4 * 1024**2
+
+# The end of the chunks in a queue.
+_END = object()
+
+
+# ================================= Pipeline ====================================
+class Pipeline:
+    """
+    Read, compute and write chunks at the same time. The reading and the writing release the GIL while they wait for the files, so they overlap with the computing.
+
+    Attributes:
+      compute (function): compute the result of a chunk. With worker processes, it should be a function of the "__main__" module, which is inherited by "fork".
+      write (function): write the result of a chunk, called by the writer thread in the order of the chunks. Statistics and checkpoints should be updated here, since nothing else writes the outputs.
+      worker_num (int): the number of worker processes, the chunks are computed in the main process if it is 1.
+      depth (int): the number of chunks each queue holds, and the number of chunks sent to the workers at a time.
+      pool_init (tuple): the initializer of the worker processes and its arguments, e.g. (workerInit, (time.time(),)).
+      run_metrics (metrics_MASseq.Metrics): if provided, the time the writer waits for the next result and the time it writes a result are timed as the "wait" and "write" steps.
+    """
+
+    def __init__(self, compute, write, worker_num=1, depth=None, pool_init=None, run_metrics=None):
+        self.compute = compute
+        self.write = write
+        self.worker_num = worker_num
+        self.depth = depth or QUEUE_CHUNKS * max(1, worker_num)
+        self.pool_init = pool_init
+        self.run_metrics = run_metrics
+
+        self._in_queue = queue.Queue(self.depth)
+        self._out_queue = queue.Queue(self.depth)
+        self._pending = collections.deque()
+        self._stop = False
+        self._error = None
+
+    # The numbers of chunks waiting to be computed, being computed by the workers, and waiting to be written.
+    def queueDepths(self):
+        return {"read": self._in_queue.qsize(), "compute": len(self._pending), "write": self._out_queue.qsize()}
+
+    # Run the chunks through the pipeline, return when all the results are written. An exception raised by any stage is raised here.
+    def run(self, chunk_iter):
+        # The pool is forked before the threads are started, a forked thread would never run.
+        pool = None
+        if self.worker_num > 1:
+            init_func, init_args = self.pool_init or (None, ())
+            pool = multiprocessing.get_context("fork").Pool(self.worker_num, initializer=init_func, initargs=init_args)
+
+        reader = threading.Thread(target=self._read, args=(chunk_iter,), daemon=True)
+        writer = threading.Thread(target=self._writeResults, daemon=True)
+        reader.start()
+        writer.start()
+
+        try:
+            for chunk_res in (self._computeChunks(pool) if pool else self._computeChunksHere()):
+                if self._error:
+                    break
+                self._out_queue.put(chunk_res)
+
+        except BaseException as err:
+            self._error = self._error or err
+
+        finally:
+            # The reader may wait for a slot in the queue, which is freed here until it stops.
+            self._stop = True
+            while reader.is_alive():
+                try:
+                    self._in_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+            self._out_queue.put(_END)
+            writer.join()
+
+            if pool:
+                if self._error:
+                    pool.terminate()
+                else:
+                    pool.close()
+                pool.join()
+
+        if self._error:
+            raise self._error
+
+    def _read(self, chunk_iter):
+        try:
+            for chunk in chunk_iter:
+                if self._stop:
+                    return
+                self._in_queue.put(chunk)
+
+        except BaseException as err:
+            self._error = self._error or err
+
+        finally:
+            self._in_queue.put(_END)
+
+    def _computeChunksHere(self):
+        while True:
+            chunk = self._in_queue.get()
+            if chunk is _END:
+                return
+            yield self.compute(chunk)
+
+    # At most "depth" chunks are sent to the workers at a time, and their results are taken in the order they were sent.
+    def _computeChunks(self, pool):
+        while True:
+            chunk = self._in_queue.get()
+            if chunk is _END:
+                break
+
+            self._pending.append(pool.apply_async(self.compute, (chunk,)))
+            if len(self._pending) >= self.depth:
+                yield self._pending.popleft().get()
+
+        while self._pending:
+            yield self._pending.popleft().get()
+
+    # After an exception, the results are still taken from the queue but not written, so that the computing stage never waits for the writer.
+    def _writeResults(self):
+        wait_start = time.perf_counter()
+
+        while True:
+            chunk_res = self._out_queue.get()
+            if chunk_res is _END:
+                return
+            if self._error:
+                continue
+
+            try:
+                write_start = time.perf_counter()
+                self.write(chunk_res)
+
+                if self.run_metrics:
+                    self.run_metrics.observe("wait", write_start - wait_start)
+                    self.run_metrics.observe("write", time.perf_counter() - write_start)
+                    wait_start = time.perf_counter()
+
+            except BaseException as err:
+                self._error = self._error or err
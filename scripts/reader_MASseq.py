@@ -0,0 +1,107 @@
+# Author: JIA Zheng
+# This is the module to cut the .tsv and FastQ files of the splitting workflow into ranges of lines, e.g. the tasks of a work queue, and read the entries of a range through a memory map.
+# The mapped range is cut into blocks of whole lines, each block is decoded and split into the fields of its entries at once.
+# A whole .tsv file is read by the scripts with a plain line by line file iterator instead, which is as fast or faster.
+# Only ASCII text is expected, e.g. the files written by 'split_MASseq_<version>.py' and 'recall_MASseq_<version>.py'.
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import os
+import sys
+import mmap
+import itertools
+
+
+# The size of a block of lines in bytes, a block is extended to the end of its last line.
+# Small blocks stay in the CPU cache while they are decoded and split, larger ones were slower.
+BLOCK_SIZE = 256 * 1024
+
+
+# ================================= Defining Functions ====================================
+# Map a file into memory for reading, an empty file can not be mapped and is returned as an empty bytes object.
+# The map stays valid after the file is closed.
+def mapFile(file_name):
+    with open(file_name, "rb") as f:
+        if os.fstat(f.fileno()).st_size==0:
+            return b""
+
+        file_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if hasattr(file_map, "madvise"):
+        file_map.madvise(mmap.MADV_SEQUENTIAL)
+
+    return file_map
+
+
+# Cut a mapped file (or the bytes from "start" to "end" of it) into blocks of whole lines, each block is decoded as a string.
+def lineBlocks(file_name, block_size=BLOCK_SIZE, start=0, end=None):
+    file_map = mapFile(file_name)
+    file_end = len(file_map) if end is None else min(end, len(file_map))
+    block_start = start
+
+    while block_start < file_end:
+        block_end = min(file_map.find(b"\n", min(block_start + block_size, file_end) - 1) + 1 or file_end, file_end)
+        yield file_map[block_start: block_end].decode("ascii")
+        block_start = block_end
+
+
+# Cut a file into ranges of "line_num" lines, as (start, end) in bytes, e.g. the chunks of a work queue.
+# The line breaks are counted by blocks, only the block where a range ends is searched line by line.
+def lineRanges(file_name, line_num):
+    file_map = mapFile(file_name)
+    range_lis = []
+    range_start = 0
+    block_start = 0
+    line_left = line_num
+
+    while block_start < len(file_map):
+        block_end = min(block_start + BLOCK_SIZE, len(file_map))
+        block_lines = file_map[block_start: block_end].count(b"\n")
+
+        if block_lines < line_left:
+            line_left -= block_lines
+            block_start = block_end
+            continue
+
+        for _ in range(line_left):
+            block_start = file_map.find(b"\n", block_start, block_end) + 1
+        range_lis.append((range_start, block_start))
+        range_start = block_start
+        line_left = line_num
+
+    if range_start < len(file_map):
+        range_lis.append((range_start, len(file_map)))
+
+    return range_lis
+
+
+# Read the entries of a range of a .tsv file, from the byte "start" to "end" of it, as tuples of their fields, the line breaks are removed.
+# A block is split into lines, and each line into its own fields by "map" (looping in C), so a line with more or less than three fields,
+# e.g. a line of only an ID, is an entry of its own instead of being mixed up with the fields of the lines next to it.
+def tsvEntries(file_name, start=0, end=None):
+    for block in lineBlocks(file_name, start=start, end=end):
+        yield from map(tuple, map(str.split, block.rstrip("\n").split("\n"), itertools.repeat("\t")))
+
+
+# The line of an entry in a .tsv file.
+def entryLine(entry):
+    return "\t".join(entry) + "\n"
+
+
+# Read the entries of a FastQ file with 4 lines for each entry (or the bytes from "start" to "end" of it) as (ID, sequence, quality) tuples.
+# The ID is the name of an entry before the first space, as the one read by "pysam.FastxFile". An entry without a name is skipped with a warning.
+def fastqEntries(file_name, start=0, end=None):
+    line_lis = []
+
+    for block in lineBlocks(file_name, start=start, end=end):
+        line_lis.extend(block.rstrip("\n").split("\n"))
+        entry_num = len(line_lis) // 4
+
+        for i in range(0, entry_num * 4, 4):
+            name_lis = line_lis[i][1:].split(maxsplit=1)
+            if not name_lis:
+                sys.stderr.write(f"An entry without a name in {file_name} is skipped: '{line_lis[i]}'.\n")
+                continue
+
+            yield (name_lis[0], line_lis[i + 1], line_lis[i + 3])
+        del line_lis[:entry_num * 4]
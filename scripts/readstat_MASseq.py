@@ -0,0 +1,145 @@
+# Author: JIA Zheng
+# This is the module to collect the statistics of the valid reads of each sample, while they are split, recalled or converted.
+# The statistics of a chunk are collected by the worker process splitting it, and merged by the main process, so no extra pass over the valid reads is needed.
+# The statistics of several runs (e.g. the split and the recall of a project, or several SMRT cells) are merged from their .json files.
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import json
+import collections
+
+
+# The width of the bins of the length histograms.
+LENGTH_BIN = 100
+
+# The step recalling a valid read, by the output key it is collected under in "recaller_MASseq.collectValid".
+TIER_KEYS = {
+    "BC_assigned": "split",
+    "err_valid": "err_recalled",
+    "deg_valid": "deg_recalled",
+    "noBC_valid": "noBC_recalled",
+    "fs_rejoined": "rejoined"
+}
+
+# The histograms of each sample.
+HISTOGRAMS = ("length", "pass_number", "UMI_length", "tiers")
+
+
+# ================================= Defining Functions ====================================
+# The keys of a histogram in a .json file are strings, the numeric ones are turned back into integers.
+def histKey(key):
+    return int(key) if isinstance(key, str) and key.isdigit() else key
+
+
+# A histogram for a .json file, sorted by its numeric keys.
+def sortedHist(hist):
+    return {str(key): hist[key] for key in sorted(hist.keys(), key=lambda key: (isinstance(key, str), key))}
+
+
+# ================================= Read Statistics ====================================
+class ReadStats:
+    """
+    The statistics of the valid reads of each barcode, and the number of valid reads (segments) from each CCS read, which can be merged with the ones of other chunks or runs.
+    The pass number and the UMI of a valid read are taken from its segment, or parsed from its ID "<read_name>|<pass_number>|<split_index>|<barcode>|<UMI>" by "addID".
+
+    Attributes:
+      samples (dict): the barcode IDs as keys, and their statistics as values: the numbers of reads and bases, and the histograms in "HISTOGRAMS" as "collections.Counter".
+      segments (collections.Counter): the numbers of valid reads from a CCS read as keys, and the numbers of CCS reads as values. Only counted by the split.
+      read_num (int): the number of valid reads.
+      names (dict): the barcode IDs as keys and the sample names as values, taken from the merged statistics.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.segments = collections.Counter()
+        self.read_num = 0
+        self.names = {}
+
+    def _sample(self, bc):
+        samp_stat = self.samples.get(bc)
+        if samp_stat is None:
+            samp_stat = {"reads": 0, "bases": 0}
+            samp_stat.update((hist_name, collections.Counter()) for hist_name in HISTOGRAMS)
+            self.samples[bc] = samp_stat
+
+        return samp_stat
+
+    # Count a valid read, "tier" is the step it is found by, one of the values of "TIER_KEYS".
+    def add(self, bc, pass_num, umi, seq_len, tier=None):
+        samp_stat = self._sample(bc)
+
+        samp_stat["reads"] += 1
+        samp_stat["bases"] += seq_len
+        samp_stat["length"][seq_len // LENGTH_BIN * LENGTH_BIN] += 1
+        samp_stat["pass_number"][histKey(pass_num) if pass_num is not None else "NA"] += 1
+        samp_stat["UMI_length"][len(umi)] += 1
+        if tier:
+            samp_stat["tiers"][tier] += 1
+
+        self.read_num += 1
+
+    # Count a valid read read from a file, by its ID.
+    def addID(self, bc, read_ID, seq_len, tier=None):
+        id_lis = read_ID.split("|")
+        self.add(bc, id_lis[-4], id_lis[-1], seq_len, tier)
+
+    # Count a CCS read with "seg_num" valid reads split from it.
+    def addCCS(self, seg_num):
+        self.segments[seg_num] += 1
+
+    # The number of valid reads of a barcode.
+    def reads(self, bc):
+        return self.samples[bc]["reads"] if bc in self.samples else 0
+
+    # The statistics for a .json file, or to be sent to the main process. The samples are named by "sample_dic" if it is provided, else by the merged statistics.
+    def state(self, sample_dic=None):
+        samp_dic = {}
+        for bc in sorted(self.samples.keys()):
+            samp_stat = self.samples[bc]
+            samp_dic[bc] = {
+                "sample": (sample_dic or self.names).get(bc, bc),
+                "reads": samp_stat["reads"],
+                "bases": samp_stat["bases"],
+                "mean_length": round(samp_stat["bases"] / max(samp_stat["reads"], 1), 1)
+            }
+            samp_dic[bc].update((hist_name, sortedHist(samp_stat[hist_name])) for hist_name in HISTOGRAMS)
+
+        ccs_num = sum(self.segments.values())
+        return {
+            "samples": samp_dic,
+            "CCS_reads": ccs_num,
+            "segments_per_CCS": sortedHist(self.segments),
+            "mean_segments_per_CCS": round(sum(seg_num * num for seg_num, num in self.segments.items()) / max(ccs_num, 1), 3)
+        }
+
+    def merge(self, state):
+        for bc, samp_state in state["samples"].items():
+            samp_stat = self._sample(bc)
+            self.names[bc] = samp_state["sample"]
+            samp_stat["reads"] += samp_state["reads"]
+            samp_stat["bases"] += samp_state["bases"]
+            for hist_name in HISTOGRAMS:
+                for key, num in samp_state[hist_name].items():
+                    samp_stat[hist_name][histKey(key)] += num
+
+            self.read_num += samp_state["reads"]
+
+        for seg_num, num in state["segments_per_CCS"].items():
+            self.segments[histKey(seg_num)] += num
+
+    def dump(self, json_name, sample_dic=None):
+        with open(json_name, "w") as jf:
+            json.dump(self.state(sample_dic), jf, indent=4)
+
+
+# Merge the statistics in several .json files, e.g. the ones of the split and the recall of a project. A missing file is left out.
+def mergeFiles(file_lis):
+    read_stats = ReadStats()
+    for json_name in file_lis:
+        try:
+            with open(json_name) as jf:
+                read_stats.merge(json.load(jf))
+        except FileNotFoundError:
+            continue
+
+    return read_stats
@@ -10,9 +10,26 @@ import sys
 import getopt
 import time
 import json
-
-# Third party packages:
-import regex
+import glob
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import_start = time.time()
+
+# Modules in the same directory:
+import config_MASseq
+import recaller_MASseq
+import bgzf_MASseq
+import ubam_MASseq
+import manifest_MASseq
+import reader_MASseq
+import pipeline_MASseq
+import metrics_MASseq
+import readstat_MASseq
+import segment_MASseq
+import workqueue_MASseq
+
+import_time = time.time() - import_start
 
 def getDatetime():
     return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
@@ -22,11 +39,12 @@ def getDatetime():
 usage = """This is a script to recall 'invalid' reads excluded from the split process with a slightly loosed filtering standard. 
 This script will automatically detect <file_name>.err.tsv, <file_name>.deg.tsv, <file_name>.noBC.tsv in the given directory. 
 These files are generated by the 'split_MASseq_<version>.py' script. 
-If your job is run with a ParaFly multi-thread protocol, it is suggested that you would better merge the according files at first to avoid creating too many files.
+Under the "project mode", the files in "invalid/" are read one by one, there is no need to merge them at first.
 This script will generate a json file containing some statistic information about its running process in the working directory by default.
 
 General usage: 
-  python recall_MASseq_<version>.py [-p] [-h] [-m <meta_information_file>] [-r <recall_files_directory>] [-v <valid_output_directory>] [-d <discarded_output_directory>] [<file_name>]
+  python recall_MASseq_<version>.py [-p] [-h] [-m <meta_information_file>] [-r <recall_files_directory>] [-v <valid_output_directory>] [-d <discarded_output_directory>] [--workers <N>] [--demux fastq.gz|fastq | --ubam] [--resume] [--metrics <prefix> [--metrics-interval <seconds>]] [--queue <queue_directory> [--lease-timeout <seconds>]] [<file_name>]
+  python recall_MASseq_<version>.py --queue-worker <queue_directory>
 
 This script can either run within or without a standard project directory structure:
   -p    If this parameter is provided, this script will run in a "project mode" which needs a standard project directory structure;
@@ -37,14 +55,68 @@ The fillowing parameters is need when it is under a "standalone mode":
   -v    The directory to create files to store the recalled results, leave it NULL to create them in current WD;
   -d    The directory to create files to store the discarded results, leave it NULL to create them in current WD;
 
+Multi-process recalling:
+  --workers       The number of worker processes used to recall reads, default 1;
+  --chunk-size    The number of reads sent to a worker at a time, default 2000.
+  The three recall steps are chained in memory: the leftovers of Step 1 are passed to Step 2 and Step 3 directly, and the leftovers of Step 2 to Step 3. 
+  Only the final valid, discarded and false split candidate files are written.
+
+Per-sample output:
+  --demux            "fastq.gz" or "fastq". Recalled reads are written into a file of their sample directly, named after "Adapter2Sample" in the meta information, instead of the "*_valid.tsv" files.
+                     The files are "split_result/<sample_name>.recalled.<fastq.gz|fastq>" under the "project mode", or "<file_name>.<sample_name>.recalled.<fastq.gz|fastq>" in the valid output directory under the "standalone mode".
+  --demux-threads    The number of threads used to compress the "fastq.gz" files or the .bam file, default 4.
+  --ubam             Write recalled reads into an unaligned .bam file instead, "valid/recalled.bam" under the "project mode", or "<file_name>.recalled.bam" in the valid output directory under the "standalone mode". 
+                     The tags are the same as the ones written by 'split_MASseq_<version>.py'.
+
+Resumable runs:
+  --resume           Skip this run if the outputs are up to date with its manifest, "manifest/recall.json" under the "project mode", or "<file_name>.recall.manifest.json" in the valid output directory under the "standalone mode".
+
+Metrics:
+  --metrics             Write snapshots of the metrics into "<prefix>.json" and "<prefix>.prom" (the Prometheus text format, for the textfile collector of "node_exporter") while running, 
+                        the same metrics as the ones of 'split_MASseq_<version>.py'. The steps are not timed without this option.
+  --metrics-interval    The minimum interval between two snapshots in seconds, default 10. A last snapshot is always written at the end.
+
+Multi-node recalling:
+  --queue            Run as the coordinator of a work queue in <queue_directory>, which should be on a file system shared by all the machines. 
+                     The ranges of "--chunk-size" entries of the files to recall are published as tasks, which are processed by the coordinator (with its "--workers") and by any number of workers. 
+                     The coordinator writes the results in the order of the tasks, as the outputs of a single run.
+  --queue-worker     Run as a worker of the work queue in <queue_directory>, on any machine, with the options and in the working directory of its coordinator. 
+                     It waits for the coordinator to publish the tasks, claims and processes them one by one, and exits when all the tasks are done.
+  --lease-timeout    A task claimed by a worker is claimed again by others, if its worker doesn't renew its lease within this time in seconds (default 120), or the worker on the same machine is dead.
+
 To view the usage information:
   -h    Print usage information and exit.
 
 * This script is suggested to run on a Linux/UNIX device. Although running this script is possible on a Windows/DOS device, some code will still need to be modified.
 """
 
-optlist, args = getopt.getopt(sys.argv[1:], 'phr:v:d:m:')
+opt_spec = ('phr:v:d:m:', ['workers=', 'chunk-size=', 'demux=', 'demux-threads=', 'ubam', 'resume', 'metrics=', 'metrics-interval=', 'queue=', 'queue-worker=', 'lease-timeout='])
+optlist, args = getopt.getopt(sys.argv[1:], *opt_spec)
 optdict = dict(optlist)
+
+# A worker of a work queue runs with the command line of its coordinator in its working directory, which are published in the queue.
+work_queue = None
+queue_worker = "--queue-worker" in optdict.keys()
+
+if queue_worker:
+    work_queue = workqueue_MASseq.WorkQueue(optdict["--queue-worker"])
+    print(f"[{getDatetime()}] Will run as a worker of the work queue {work_queue.queue_dir}, as {work_queue.owner}.")
+
+    queue_inf = work_queue.waitPublished()
+    if queue_inf["stage"]!="recall":
+        sys.stderr.write(f"The work queue {work_queue.queue_dir} is published by the '{queue_inf['stage']}' stage, not 'recall' :-(\n")
+        sys.exit()
+
+    os.chdir(queue_inf["cwd"])
+    optlist, args = getopt.getopt(queue_inf["argv"], *opt_spec)
+    optdict = dict(optlist)
+
+elif ("--queue" in optdict.keys()) and optdict["--queue"]:
+    work_queue = workqueue_MASseq.WorkQueue(optdict["--queue"])
+
+if work_queue and ("--lease-timeout" in optdict.keys()) and optdict["--lease-timeout"]:
+    work_queue.lease_timeout = max(1.0, float(optdict["--lease-timeout"]))
+
 projWD = os.getcwd()
 
 if ("-h" in sys.argv[1:]) or (len(sys.argv)==1):
@@ -56,6 +128,40 @@ valid_dir = projWD
 discard_dir = projWD
 merged_file = ""
 
+worker_num = 1
+chunk_size = 2000
+
+if ("--workers" in optdict.keys()) and optdict["--workers"]:
+    worker_num = max(1, int(optdict["--workers"]))
+if ("--chunk-size" in optdict.keys()) and optdict["--chunk-size"]:
+    chunk_size = max(1, int(optdict["--chunk-size"]))
+
+demux_fmt = None
+demux_threads = 4
+
+if ("--demux" in optdict.keys()) and optdict["--demux"]:
+    demux_fmt = optdict["--demux"]
+    if demux_fmt not in ("fastq.gz", "fastq"):
+        sys.stderr.write(f"Unknown '--demux' format: '{demux_fmt}', it should be 'fastq.gz' or 'fastq' :-(\n")
+        sys.exit()
+if ("--demux-threads" in optdict.keys()) and optdict["--demux-threads"]:
+    demux_threads = max(1, int(optdict["--demux-threads"]))
+
+ubam = "--ubam" in optdict.keys()
+if ubam and demux_fmt:
+    sys.stderr.write("'--ubam' and '--demux' can not be used together :-(\n")
+    sys.exit()
+
+resume = "--resume" in optdict.keys()
+
+run_metrics = None
+
+if ("--metrics" in optdict.keys()) and optdict["--metrics"]:
+    metrics_interval = metrics_MASseq.SNAPSHOT_INTERVAL
+    if ("--metrics-interval" in optdict.keys()) and optdict["--metrics-interval"]:
+        metrics_interval = max(0.0, float(optdict["--metrics-interval"]))
+    run_metrics = metrics_MASseq.Metrics("recall", optdict["--metrics"], metrics_interval)
+
 if ("-r" in optdict.keys()) and optdict["-r"]:
     recall_dir = os.path.join(projWD, optdict["-r"])
 if ("-v" in optdict.keys()) and optdict["-v"]:
@@ -68,48 +174,42 @@ if len(args):
 if "-p" in optdict.keys():
     print(f"[{getDatetime()}] Will run in a 'project' mode, project WD: {projWD}")
 
-    # Merging the reads that were excluded in upstream splitting processes.
-    # If you want to run this script on a Windows/DOS device, please disable the following 'file merge' code and merge these files on yourself.
-    os.system(f"cat {projWD}/invalid/*.err.tsv > {projWD}/recall/err.tsv")
-    os.system(f"cat {projWD}/invalid/*.deg.tsv > {projWD}/recall/deg.tsv")
-    os.system(f"cat {projWD}/invalid/*.noBC.tsv > {projWD}/recall/noBC.tsv")
+    # The reads excluded in upstream splitting processes are read from "invalid/" directly.
+    err_rec = sorted(glob.glob(f"{projWD}/invalid/*.err.tsv"))
+    deg_rec = sorted(glob.glob(f"{projWD}/invalid/*.deg.tsv"))
+    nobc_rec = sorted(glob.glob(f"{projWD}/invalid/*.noBC.tsv"))
 
-    print(f"[{getDatetime()}] Files merged.")
-
-    err_rec = f"{projWD}/recall/err.tsv"
-    deg_rec = f"{projWD}/recall/deg.tsv"
-    nobc_rec = f"{projWD}/recall/noBC.tsv"
+    print(f"[{getDatetime()}] {len(err_rec)} .err.tsv, {len(deg_rec)} .deg.tsv and {len(nobc_rec)} .noBC.tsv files found.")
 
     err_discard_file = f"{projWD}/discard/err_discarded.tsv"
-    err_deg_file = f"{projWD}/recall/err_deg.tsv"
-    err_noBC_file = f"{projWD}/recall/err_noBC.tsv"
     err_noUMI_file = f"{projWD}/discard/err_noUMI.tsv"
     err_bca_file = f"{projWD}/valid/err_valid.tsv"
 
     deg_file_name = f"{projWD}/recall/false_split/deg_true.tsv"
-    deg_noBC_file = f"{projWD}/recall/deg_noBC.tsv"
     deg_noUMI_file = f"{projWD}/discard/deg_noUMI.tsv"
     deg_bca_file = f"{projWD}/valid/deg_valid.tsv"
 
     nobc_file_name = f"{projWD}/recall/false_split/noBC_true.tsv"
-    nobc_noUMI_file = f"{projWD}/discard/deg_noUMI.tsv"
+    nobc_noUMI_file = f"{projWD}/discard/noBC_noUMI.tsv"
     nobc_bca_file = f"{projWD}/valid/noBC_valid.tsv"
 
+    demux_prefix = f"{projWD}/split_result/"
+    ubam_name = f"{projWD}/valid/recalled.bam"
+    sample_json_name = f"{projWD}/valid/recalled.sample_stat.json"
+    manifest_name = f"{projWD}/manifest/recall.json"
+
 else:
     print(f"[{getDatetime()}] Will run in a 'standalone' mode, current WD: {projWD}")
 
-    err_rec = os.path.join(projWD, recall_dir, f"{merged_file}err.tsv")
-    deg_rec = os.path.join(projWD, recall_dir, f"{merged_file}deg.tsv")
-    nobc_rec = os.path.join(projWD, recall_dir, f"{merged_file}noBC.tsv")
+    err_rec = [os.path.join(projWD, recall_dir, f"{merged_file}err.tsv")]
+    deg_rec = [os.path.join(projWD, recall_dir, f"{merged_file}deg.tsv")]
+    nobc_rec = [os.path.join(projWD, recall_dir, f"{merged_file}noBC.tsv")]
 
     err_discard_file = os.path.join(projWD, discard_dir, f"{merged_file}err_discarded.tsv")
-    err_deg_file = os.path.join(projWD, recall_dir, f"{merged_file}err_deg.tsv")
-    err_noBC_file = os.path.join(projWD, recall_dir, f"{merged_file}err_noBC.tsv")
     err_noUMI_file = os.path.join(projWD, discard_dir, f"{merged_file}err_noUMI.tsv")
     err_bca_file = os.path.join(projWD, valid_dir, f"{merged_file}err_valid.tsv")
 
     deg_file_name = os.path.join(projWD, recall_dir, f"{merged_file}deg_true.tsv")
-    deg_noBC_file = os.path.join(projWD, recall_dir, f"{merged_file}deg_noBC.tsv")
     deg_noUMI_file = os.path.join(projWD, discard_dir, f"{merged_file}deg_noUMI.tsv")
     deg_bca_file = os.path.join(projWD, valid_dir, f"{merged_file}deg_valid.tsv")
 
@@ -117,6 +217,11 @@ else:
     nobc_noUMI_file = os.path.join(projWD, discard_dir, f"{merged_file}noBC_noUMI.tsv")
     nobc_bca_file = os.path.join(projWD, valid_dir, f"{merged_file}noBC_valid.tsv")
 
+    demux_prefix = os.path.join(projWD, valid_dir, merged_file)
+    ubam_name = os.path.join(projWD, valid_dir, f"{merged_file}recalled.bam")
+    sample_json_name = os.path.join(projWD, valid_dir, f"{merged_file}recalled.sample_stat.json")
+    manifest_name = os.path.join(projWD, valid_dir, f"{merged_file}recall.manifest.json")
+
 # ================================ Basic Information Loading ====================================
 # Loading meta information from a .json file.
 if ("-m" in optdict.keys()) and optdict["-m"]:
@@ -124,293 +229,320 @@ if ("-m" in optdict.keys()) and optdict["-m"]:
 else:
     meta_json = f"{projWD}/proj_meta.json"
 
-with open(meta_json) as metaf:
-    meta_inf = json.load(metaf)
+# The barcode index and the UMI pattern are built from the meta information, and cached in "<meta_information_file>.bundle.pkl" for the following runs.
+meta_bundle, bundle_inf = config_MASseq.loadBundle(meta_json)
 
-pattern_basic = {}
-for i in meta_inf["UsedAdapter"]:
-   pattern_basic[i] = "(?e)(" + meta_inf["AdapterBC"][i] + "){e<=2}"
+# The steps are timed by wrapping the functions, before any of them is bound to a local name.
+if run_metrics:
+    metrics_MASseq.instrument(run_metrics, meta_bundle)
+    metrics_MASseq.instrumentSteps(run_metrics, vars(recaller_MASseq))
+
+meta_inf = meta_bundle.meta_inf
+bc_index = meta_bundle.bc_index
+umi_pattern = meta_bundle.umi_pattern
+
+print(f"[{getDatetime()}] Barcode index loaded, {len(bc_index.table)} sequences indexed, {bc_index.ambiguous_num} of them are ambiguous.")
+print(f"[{getDatetime()}] Startup time: {import_time:.3f}s for imports, {bundle_inf['time']:.3f}s for the pattern bundle ({bundle_inf['source']}).")
 
 projWD = os.getcwd()
 
 print(f"[{getDatetime()}] Meta information loaded, current WD: {projWD}")
 
+# The run is skipped if its inputs, the meta information and the options are the same as the finished run in the manifest.
+recall_man = manifest_MASseq.StageManifest(manifest_name, "recall", err_rec + deg_rec + nobc_rec + [meta_json], {
+    "meta": manifest_MASseq.metaParams(meta_bundle),
+    "bundle_key": bundle_inf["key"],
+    "options": {"demux": demux_fmt, "ubam": ubam}
+})
+
+# A worker of a work queue doesn't write any output, nor the manifest.
+if resume and (not queue_worker) and recall_man.isComplete():
+    print(f"[{getDatetime()}] The outputs are up to date with the manifest {manifest_name}, skipped :-)")
+    # No task is published, so that the workers waiting for this queue exit.
+    if work_queue:
+        work_queue.publish("recall", sys.argv[1:], projWD, [])
+    sys.exit()
+
+if not queue_worker:
+    recall_man.begin()
+
 stat_dict = {
     "err_recalled": 0, 
     "deg_recalled": 0, 
     "noBC_recalled": 0
 }
 
-
-# ================================= Defining Functions ====================================
-# Commonly used functions are defined here.
-
-# To get the complementary sequence of a given sequence. 
-def seqComp(s):
-	compDict = {'G':'C','C':'G','T':'A','A':'T','N':'N','-':'-'}
-	return ''.join([compDict[x] for x in s])[::-1]
-
-# Determine whether the read is positive or negative, to enable a unified workflow. 
-# If positive, return its original sequence, else, return its complementary sequence.
-def seqSigFWD(orig_seq, orig_qual):
-    # Forward signature sequence, and the complementary sequence of reverse signature;
-    fwd_det = bool(regex.search("(?e)(TCTACACGACGCTCTTCCGATCT){e<=2}", orig_seq)) and bool(regex.search("(?e)(CTCTGCGTTGATACCACTGCTTA){e<=2}", orig_seq))
-    # Vice versa.
-    bwd_det = bool(regex.search("(?e)(AGATCGGAAGAGCGTCGTGTAGA){e<=2}", orig_seq)) and bool(regex.search("(?e)(TAAGCAGTGGTATCAACGCAGAG){e<=2}", orig_seq))
-
-    if fwd_det and (not bwd_det):
-        return (orig_seq, orig_qual)
-
-    elif (not fwd_det) and bwd_det:
-        return (seqComp(orig_seq), orig_qual[::-1])
-    
-    else:
-        return None
-
-# Split the original reads with the complementary sequence of the signature sequence of the MAS primer (Reverse).
-def splitPrim(fq_ID, fq_seq, fq_qual):
-    ind_lis = [0]
-    res_lis = []
-
-    for hit in regex.finditer("(?e)(GTACTCTGCGTTGATACCACTGCTTA){e<=3}", fq_seq):
-        ind_lis.extend(hit.span())
-
-    for i in range(len(ind_lis)//2):
-        res_lis.append((f"{fq_ID}|{i}", fq_seq[ind_lis[i*2]: ind_lis[i*2+1]], fq_qual[ind_lis[i*2]: ind_lis[i*2+1]]))
-
-    return res_lis
-
-# The function to check whether the "SigF" sequence in the split reads is intact or not.
-def checkIntactSigF(sp_tup):
-    sigf_hit = regex.search("(?e)(CTACACGACGCTCTTCCGATCT){e<=2}", sp_tup[1][:50])
-    
-    if sigf_hit:
-        return (sp_tup[0], sp_tup[1][sigf_hit.span()[-1]:], sp_tup[-1][sigf_hit.span()[-1]:])
-    else:
-        return False
-    
-# The function to assign the 3'adapter BC for a given sequence. 
-def adapterAssign(seq, pdic):
-    for bc in pdic.keys():
-        bc_hit = regex.search(pdic[bc], seq[-25:])
-        if bc_hit:
-            return (bc, bc_hit.span()[0]-25)
-
-    return None
+# The statistics of the recalled reads of each sample are merged from the ones of the chunks, and dumped into "recalled.sample_stat.json".
+read_stats = readstat_MASseq.ReadStats()
 
 
-# ================================= Recall Step 1 ====================================
-# To recall the reads that cannot be splitted in upstream processes.
-
-# Vote and split.
-def seqVoteNSplit(rec_id, rec_seq, rec_qual):
-    sigrc_num = 0
-    sigr_num = 0
-
-    # Pattern used here is SigRc
-    for i in regex.finditer("(?e)(CTCTGCGTTGATACCACTGCTTA){e<=2}", rec_seq):
-        sigrc_num += 1
-
-    for i in regex.finditer("(?e)(TAAGCAGTGGTATCAACGCAGAG){e<=2}", rec_seq):
-        sigr_num += 1
+# ================================= Defining File Handles ====================================
+# Step 1: the reads that cannot be splitted in upstream processes.
+# Step 2: the reads without intact 5' end.
+# Step 3: the reads without barcodes in its 3' end.
+# The reads recalled by each step are kept in their own files, the leftovers of a step are passed to the following steps in memory.
+# The output files are written through large buffers, by the writer thread of the pipeline. There isn't any output file for a worker of a work queue.
+def openOutput(file_name):
+    if queue_worker:
+        return None
 
-    if sigr_num > sigrc_num:
-        rec_seq = seqComp(rec_seq)
-        rec_qual = rec_qual[::-1]
+    return open(file_name, "w", buffering=pipeline_MASseq.WRITE_BUFFER)
 
-    return splitPrim(rec_id, rec_seq, rec_qual)
 
-# classify the split reads.
-# Since the code used here is too long to embed them into the main loop, they are packed into a function.
-def splitReadsAssign(entry, bc_pattern, deg, nobc, noumi, bca):
-    rec_num = 0
-    ch_res = checkIntactSigF(entry)
+out_handle_dic = {
+    "err_discarded": openOutput(err_discard_file),  # These reads are discarded and won't be recalled since there aren't any available recall tools.
+    "err_noUMI": openOutput(err_noUMI_file),
+    "err_valid": None,
+    "deg_true": openOutput(deg_file_name),
+    "deg_noUMI": openOutput(deg_noUMI_file),
+    "deg_valid": None,
+    "noBC_true": openOutput(nobc_file_name),
+    "noBC_noUMI": openOutput(nobc_noUMI_file),
+    "noBC_valid": None
+}
 
-    if ch_res:
-        saa_res = adapterAssign(ch_res[1], bc_pattern)
+# Recalled reads are either written into the "*_valid.tsv" files, into the files of their samples, or into an unaligned .bam file.
+if demux_fmt or ubam:
+    for out_key in ["err_valid", "deg_valid", "noBC_valid"]:
+        del out_handle_dic[out_key]
 
-        if saa_res:
-            bca_ID = f"{ch_res[0]}|{saa_res[0]}"
-            bca_seq = ch_res[1][:saa_res[-1]]
-            bca_qual = ch_res[-1][:saa_res[-1]]
+if demux_fmt and not queue_worker:
+    demux_pool = ThreadPoolExecutor(demux_threads) if demux_fmt=="fastq.gz" else None
+    demux_handle_dic = {}
+    for bc in meta_bundle.used_bc:
+        demux_handle_dic[bc] = bgzf_MASseq.openSink(f"{demux_prefix}{meta_bundle.sample_dic[bc]}.recalled.{demux_fmt}", demux_fmt, 6, demux_pool)
+elif ubam and not queue_worker:
+    ubam_writer = ubam_MASseq.UBAMWriter(ubam_name, meta_bundle, demux_threads, "recall_MASseq")
+elif not (demux_fmt or ubam):
+    out_handle_dic["err_valid"] = openOutput(err_bca_file)
+    out_handle_dic["deg_valid"] = openOutput(deg_bca_file)
+    out_handle_dic["noBC_valid"] = openOutput(nobc_bca_file)
 
-            matchUMI = regex.split("(^[ATCG]{8,12})(ATGGG){s<=1}", bca_seq, 1)
 
-            if len(matchUMI)==4:
-                out_ID = f"{bca_ID}|{matchUMI[1]}"
-                out_seq = matchUMI[-1]
-                out_qual = bca_qual[-len(out_seq):]
+# ================================= Defining Functions ====================================
+# Read the entries to recall as (step, entry) tuples, in the order of the recall steps.
+# The files are read line by line, an entry is a list of the fields of its line.
+def recallEntries():
+    for step, rec_files in (("err", err_rec), ("deg", deg_rec), ("noBC", nobc_rec)):
+        for rec_f in rec_files:
+            with open(rec_f) as rec_fil:
+                for line in rec_fil:
+                    yield (step, line.rstrip("\n").split("\t"))
+
+
+# Pack the (step, entry) tuples into chunks.
+def chunkEntries(entry_iter, size):
+    while True:
+        chunk = list(itertools.islice(entry_iter, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Recall a chunk of entries with the rules in "recaller_MASseq".
+# Output lines are collected by their output file instead of written directly, so that the chunk can be processed by a worker process.
+# The recalled reads are counted in the "read_stats" of the chunk.
+def recallChunk(chunk):
+    chunk_start = time.perf_counter()
+    res_dic = {key: [] for key in recaller_MASseq.RECALL_OUTPUTS}
+    res_dic["read_stats"] = readstat_MASseq.ReadStats()
+    if demux_fmt or ubam:
+        res_dic["demux"] = {bc: [] for bc in meta_bundle.used_bc}
+    chunk_stat = dict.fromkeys(recaller_MASseq.RECALL_STATS, 0)
+
+    for step, rec_entry in chunk:
+        # Entries with an empty sequence can not be recalled.
+        if len(rec_entry)!=3 or not (rec_entry[1] and rec_entry[2]):
+            if step=="err":
+                res_dic["err_discarded"].append(reader_MASseq.entryLine(rec_entry))
+            else:
+                res_dic[f"{step}_true"].append(segment_MASseq.Segment.fromLine(reader_MASseq.entryLine(rec_entry)))
+            continue
 
-                bca.write(f"{out_ID}\t{out_seq}\t{out_qual}\n")
-                rec_num = 1
+        # The "|Error", "|Degraded" and "|noBC" suffixes are removed from the IDs, which are parsed into segments.
+        seg = segment_MASseq.Segment.fromID(rec_entry[0].rsplit("|", 1)[0], rec_entry[1], rec_entry[2])
 
-            else:
-                noumi.write(f"{bca_ID}|noUMI\t{bca_seq}\t{bca_qual}\n")
-        
+        if step=="err":
+            recaller_MASseq.recallErr(seg, meta_bundle, res_dic, chunk_stat)
+        elif step=="deg":
+            recaller_MASseq.recallDeg(seg, meta_bundle, res_dic, chunk_stat)
         else:
-            nobc.write(f"{ch_res[0]}|noBC\t{ch_res[1]}\t{ch_res[-1]}\n")
-
-    else:
-        deg.write(f"{entry[0]}|Degraded\t{entry[1]}\t{entry[-1]}\n")
+            recaller_MASseq.recallNoBC(seg, meta_bundle, res_dic, chunk_stat)
 
-    return rec_num
+    # The metrics of the chunk are sent back together with its results, as the metrics of a worker process are not shared.
+    chunk_metrics = None
+    if run_metrics:
+        chunk_metrics = run_metrics.drain()
+        chunk_metrics["worker"] = (os.getpid(), len(chunk), time.perf_counter() - chunk_start)
 
-# These reads are discarded and won't be recalled since there aren't any available recall tools.
-err_discard = open(err_discard_file, "w")
+    return (res_dic, chunk_stat, chunk_metrics)
 
-err_deg = open(err_deg_file, "w")
-err_noBC = open(err_noBC_file, "w")
-err_noUMI = open(err_noUMI_file, "w")
-err_bca = open(err_bca_file, "w")
 
-# The main loop to split the reads that can't be split before.
-for qstr in open(f"{projWD}/recall/err.tsv"):
-    qlis = qstr.strip().split()
-    qseq = qlis[1]
-    
-    fwd_det = bool(regex.search("(?e)(TCTACACGACGCTCTTCCGATCT){e<=2}", qseq)) and bool(regex.search("(?e)(CTCTGCGTTGATACCACTGCTTA){e<=2}", qseq))
-    bwd_det = bool(regex.search("(?e)(AGATCGGAAGAGCGTCGTGTAGA){e<=2}", qseq)) and bool(regex.search("(?e)(TAAGCAGTGGTATCAACGCAGAG){e<=2}", qseq))
-    
-    if (fwd_det or bwd_det):
-        new_id = f"{qlis[0].split("|")[0]}|{qlis[0].split("|")[1]}"
-        split_res = seqVoteNSplit(new_id, qseq, qlis[-1])
-        for entry in split_res:
-            stat_dict["err_recalled"] += splitReadsAssign(entry, pattern_basic, err_deg, err_noBC, err_noUMI, err_bca)
-    else:
-        err_discard.write(qstr)
+# The tasks of the work queue are the ranges of "size" entries of the files to recall, in the order of the recall steps.
+def recallTasks(size):
+    task_lis = []
+    for step, rec_files in (("err", err_rec), ("deg", deg_rec), ("noBC", nobc_rec)):
+        for rec_f in rec_files:
+            task_lis.extend({"step": step, "file": rec_f, "range": line_range} for line_range in reader_MASseq.lineRanges(rec_f, size))
 
+    return task_lis
 
-err_discard.close()
-err_deg.close()
-err_noBC.close()
-err_noUMI.close()
-err_bca.close()
 
-print(f"[{getDatetime()}] Step 1 done, {stat_dict["err_recalled"]} reads recalled.")
+# Recall the entries of a task of the work queue.
+def recallTask(task):
+    return recallChunk([(task["step"], entry) for entry in reader_MASseq.tsvEntries(task["file"], *task["range"])])
 
 
-# ================================= Recall Step 2 ====================================
-# To recall the reads without intact 5' end. 
+# The results of a task for the coordinator, the task is recalled here unless it is claimed by a worker, whose results are waited for.
+def collectTask(task_id):
+    return work_queue.collect(task_id, recallTask)
 
-# Since the code used here is too long to embed them into the main loop, they are packed into a function.
-def sigfRecalledReadsAssign(entry, bc_pattern, nobc, noumi, bca):
-    rec_ind = 0
-    saa_res = adapterAssign(entry[1], bc_pattern)
 
-    if saa_res:
-        bca_ID = f"{entry[0]}|{saa_res[0]}"
-        bca_seq = entry[1][:saa_res[-1]]
-        bca_qual = entry[-1][:saa_res[-1]]
+# Time the reading of each chunk as the "read" step, the chunks are read by the reader thread of the pipeline.
+def timedChunks(chunk_iter):
+    while True:
+        read_start = time.perf_counter()
+        chunk = next(chunk_iter, None)
+        if chunk is None:
+            return
 
-        matchUMI = regex.split("(^[ATCG]{8,12})(ATGGG){s<=1}", bca_seq, 1)
+        run_metrics.observe("read", time.perf_counter() - read_start)
+        run_metrics.count("chunks_read")
+        yield chunk
 
-        if len(matchUMI)==4:
-            out_ID = f"{bca_ID}|{matchUMI[1]}"
-            out_seq = matchUMI[-1]
-            out_qual = bca_qual[-len(out_seq):]
 
-            bca.write(f"{out_ID}\t{out_seq}\t{out_qual}\n")
-            rec_ind = 1
+# Merge the metrics of a chunk, and write a snapshot if it is due.
+def reportMetrics(chunk_metrics):
+    run_metrics.merge(chunk_metrics)
+    run_metrics.workerChunk(*chunk_metrics["worker"])
+    run_metrics.count("chunks_done")
+    run_metrics.count("reads_done", chunk_metrics["worker"][1])
 
-        else:
-            noumi.write(f"{bca_ID}|noUMI\t{bca_seq}\t{bca_qual}\n")
-        
-    else:
-        nobc.write(f"{entry[0]}|noBC\t{entry[1]}\t{entry[-1]}\n")
-    
-    return rec_ind
+    if run_metrics.due():
+        snapshotMetrics()
 
-# Defining file handles
-deg_file = open(deg_file_name, "w")
 
-deg_noBC = open(deg_noBC_file, "w")
-deg_noUMI = open(deg_noUMI_file, "w")
-deg_bca = open(deg_bca_file, "w")
+# The gauges are updated right before a snapshot, the queue depths of the chunks are the ones of the stages of the pipeline.
+def snapshotMetrics():
+    run_metrics.setCounters(stat_dict)
+    for queue_name, queue_depth in recall_pipe.queueDepths().items():
+        run_metrics.gauge("queue_depth", queue_depth, queue=queue_name)
+    if demux_fmt=="fastq.gz":
+        run_metrics.gauge("queue_depth", sum(demux_handle.pending_blocks for demux_handle in demux_handle_dic.values()), queue="bgzf_blocks")
+    run_metrics.gauge("reads_per_second", run_metrics.counters.get("reads_done", 0) / max(time.time() - run_metrics.start_time, 1e-9))
+    run_metrics.snapshot()
 
-for deg_f in [deg_rec, err_deg_file]:
-    with open(deg_f) as degf:
-        for line in degf:
-            if len(line.split())!=3:
-                deg_file.write(line)
-                continue
 
-            sp_tup = line.strip().split()
-            sigf_hit = regex.search("(?e)(TCTACACGACGCTCTTCCGATCT){e<=2}", sp_tup[1])
+# ================================= Work Queue Worker ====================================
+# The results of the tasks (including the metrics) are sent to the coordinator through the queue.
+if queue_worker:
+    task_num = work_queue.work(recallTask)
+    if work_queue.republished:
+        print(f"[{getDatetime()}] {task_num} tasks done by {work_queue.owner}, the work queue is published again, restarting.", flush=True)
+        os.execv(sys.executable, [sys.executable] + sys.argv)
 
-            if sigf_hit:
-                rec_entry = ("|".join(sp_tup[0].split("|")[:-1]), sp_tup[1][sigf_hit.span()[-1]:], sp_tup[-1][sigf_hit.span()[-1]:])
-                stat_dict["deg_recalled"] += sigfRecalledReadsAssign(rec_entry, pattern_basic, deg_noBC, deg_noUMI, deg_bca)
-            else: 
-                deg_file.write(line)
+    print(f"[{getDatetime()}] {task_num} tasks done by {work_queue.owner}, all the tasks of the work queue are done :-)")
+    sys.exit()
 
-deg_noBC.close()
-deg_noUMI.close()
-deg_bca.close()
-deg_file.close()
 
-print(f"[{getDatetime()}] Step 2 done, {stat_dict["deg_recalled"]} reads recalled.")
+# ================================= Main loop ====================================
+# Write the results of a chunk, called by the writer thread of the pipeline in the order of the chunks.
+def writeChunk(chunk_res):
+    global task_written
+    res_dic, chunk_stat, chunk_metrics = chunk_res
 
-# ================================= Recall Step 3 ====================================
-# To recall the reads without barcodes in its 3' end. 
-def adapterAssign4Recall(seq, pdic):
-    for bc in pdic.keys():
-        bc_hit = regex.search(pdic[bc], seq)
-        if bc_hit:
-            return (bc, bc_hit.span()[0])
+    # The recalled reads and the leftovers of the recall rules are collected as segments, which are formatted into lines (or records) here.
+    for out_key in out_handle_dic.keys():
+        if out_key in recaller_MASseq.SEGMENT_OUTPUTS:
+            out_handle_dic[out_key].writelines(segment_MASseq.segmentLines(res_dic[out_key]))
+        else:
+            out_handle_dic[out_key].writelines(res_dic[out_key])
+    for stat_key in chunk_stat.keys():
+        stat_dict[stat_key] += chunk_stat[stat_key]
+    read_stats.merge(res_dic["read_stats"].state())
+    if demux_fmt:
+        for bc, rec_lis in res_dic["demux"].items():
+            demux_handle_dic[bc].writelines(segment_MASseq.fastqRecords(rec_lis))
+    elif ubam:
+        for bc, rec_lis in res_dic["demux"].items():
+            ubam_writer.writeRecords(bc, rec_lis)
+
+    if run_metrics:
+        reportMetrics(chunk_metrics)
+
+    # The results of a task are removed from the work queue once they are written.
+    if work_queue:
+        task_written += 1
+        work_queue.markWritten(task_written)
+
+
+# The chunks are read by the reader thread of the pipeline, recalled in the main process or in a "fork" process pool, and written by its writer thread in the same order as the input.
+# With a work queue, the chunks are published as tasks at first, and the results of the tasks are collected in their order.
+if work_queue:
+    task_lis = recallTasks(chunk_size)
+    work_queue.publish("recall", sys.argv[1:], projWD, task_lis)
+    print(f"[{getDatetime()}] {len(task_lis)} tasks published to the work queue {work_queue.queue_dir}.")
+    task_written = 0
+    chunk_iter = iter(range(len(task_lis)))
+else:
+    chunk_iter = chunkEntries(recallEntries(), chunk_size)
+if run_metrics:
+    chunk_iter = timedChunks(chunk_iter)
 
-    return None
+recall_pipe = pipeline_MASseq.Pipeline(collectTask if work_queue else recallChunk, writeChunk, worker_num, run_metrics=run_metrics)
 
+if worker_num > 1:
+    print(f"[{getDatetime()}] Recalling reads with {worker_num} worker processes, {chunk_size} reads per chunk.")
 
-# Defining file handles
-nobc_file = open(nobc_file_name, "w")
+recall_pipe.run(chunk_iter)
 
-nobc_noUMI = open(nobc_noUMI_file, "w")
-nobc_bca = open(nobc_bca_file, "w")
+# The workers exit as soon as the queue is finished.
+if work_queue:
+    work_queue.markWritten(task_written, finished=True)
 
+output_lis = [out_handle.name for out_handle in out_handle_dic.values()]
 
-for nobc_f in [nobc_rec, err_noBC_file, deg_noBC_file]:
-    with open(nobc_f) as nobc:
-        for line in nobc:
-            ch_res_raw = line.strip().split()
+for out_handle in out_handle_dic.values():
+    out_handle.close()
 
-            if len(ch_res_raw)!=3:
-                nobc_file.write(line)
-                continue
+if demux_fmt:
+    for demux_handle in demux_handle_dic.values():
+        demux_handle.close()
+    if demux_pool:
+        demux_pool.shutdown()
 
-            ch_res = ("|".join(ch_res_raw[0].split("|")[:-1]), ch_res_raw[1], ch_res_raw[-1])
-            
-            saa_res = adapterAssign4Recall(ch_res[1], pattern_basic)
+    output_lis.extend(demux_handle.name for demux_handle in demux_handle_dic.values())
+    print(f"[{getDatetime()}] Recalled reads written into the files of their samples: {demux_prefix}<sample_name>.recalled.{demux_fmt}")
 
-            if saa_res:
-                bca_ID = f"{ch_res[0]}|{saa_res[0]}"
-                bca_seq = ch_res[1][:saa_res[-1]]
-                bca_qual = ch_res[-1][:saa_res[-1]]
+if ubam:
+    ubam_writer.close()
+    output_lis.append(ubam_name)
+    print(f"[{getDatetime()}] Recalled reads written into the unaligned .bam file: {ubam_name}")
 
-                matchUMI = regex.split("(^[ATCG]{8,12})(ATGGG){s<=1}", bca_seq, 1)
+if demux_fmt or ubam:
+    stat_dict["Sample_reads"] = {meta_bundle.sample_dic[bc]: read_stats.reads(bc) for bc in meta_bundle.used_bc}
 
-                if len(matchUMI)==4:
-                    out_ID = f"{bca_ID}|{matchUMI[1]}"
-                    out_seq = matchUMI[-1]
-                    out_qual = bca_qual[-len(out_seq):]
+print(f"[{getDatetime()}] Step 1 done, {stat_dict['err_recalled']} reads recalled.")
+print(f"[{getDatetime()}] Step 2 done, {stat_dict['deg_recalled']} reads recalled.")
+print(f"[{getDatetime()}] Step 3 done, {stat_dict['noBC_recalled']} reads recalled.")
 
-                    nobc_bca.write(f"{out_ID}\t{out_seq}\t{out_qual}\n")
-                    stat_dict["noBC_recalled"] += 1
 
-                else:
-                    nobc_noUMI.write(f"{bca_ID}|noUMI\t{bca_seq}\t{bca_qual}\n")
-        
-            else:
-                nobc_file.write(line)
+# Dump statistic information into a .json file.
+with open(f"{projWD}/recall_stat.json", "w") as jf:
+    json.dump(stat_dict, jf, indent=4)
 
-nobc_file.close()
-nobc_noUMI.close()
-nobc_bca.close()
+print(f"[{getDatetime()}] Json file: {projWD}/recall_stat.json.")
 
-print(f"[{getDatetime()}] Step 3 done, {stat_dict["noBC_recalled"]} reads recalled.")
+read_stats.dump(sample_json_name, meta_bundle.sample_dic)
+print(f"[{getDatetime()}] Statistics of the recalled reads of each sample: {sample_json_name}.")
 
+# The summary of the project is merged from the statistics of the split and the recall, which is updated by both of them.
+if "-p" in optdict.keys():
+    readstat_MASseq.mergeFiles(sorted(glob.glob(f"{projWD}/valid/*.sample_stat.json"))).dump(f"{projWD}/sample_summary.json", meta_bundle.sample_dic)
+    print(f"[{getDatetime()}] Summary of the project: {projWD}/sample_summary.json.")
 
-# Dump statistic information into a .json file.
-with open(f"{projWD}/recall_stat.json", "w") as jf:
-    json.dump(stat_dict, jf, indent=4)
+recall_man.complete(output_lis + [f"{projWD}/recall_stat.json", sample_json_name], stat_dict)
 
-print(f"[{getDatetime()}] Json file: {projWD}/recall_stat.json.")
\ No newline at end of file
+if run_metrics:
+    snapshotMetrics()
+    print(f"[{getDatetime()}] Metrics: {run_metrics.prefix}.json, {run_metrics.prefix}.prom.")
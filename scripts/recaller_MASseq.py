@@ -0,0 +1,268 @@
+# Author: JIA Zheng
+# This is the module containing the recall rules of 'recall_MASseq_<version>.py', applied to reads and split reads held in memory.
+# The rules are shared by 'split_MASseq_<version>.py', which can recall the invalid reads right after they are split instead of writing them out.
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import operator
+
+# Modules in the same directory:
+import matcher_MASseq
+import readstat_MASseq
+from segment_MASseq import Segment, Status
+
+
+# The output files of the recall rules, the lines of each file are collected in a list of "res_dic".
+# Recalled reads and reads without a UMI are kept apart by the step recalling them, as the output files of 'recall_MASseq_<version>.py' do.
+RECALL_OUTPUTS = ("err_valid", "deg_valid", "noBC_valid", "err_noUMI", "deg_noUMI", "noBC_noUMI", "err_discarded", "deg_true", "noBC_true")
+
+# The outputs collected as "segment_MASseq.Segment" instead of lines: the valid reads, and the leftovers as they are checked for false splits.
+# They are formatted into lines (or FastQ records, or .bam records) only when they are written out.
+SEGMENT_OUTPUTS = ("BC_assigned", "err_valid", "deg_valid", "noBC_valid", "fs_rejoined", "deg_true", "noBC_true", "fs_candidate", "fs_tooShort", "fs_discarded", "fs_onecol")
+
+# The statistic information of the recall rules, which is the same as the one dumped by 'recall_MASseq_<version>.py'.
+RECALL_STATS = ("err_recalled", "deg_recalled", "noBC_recalled")
+
+
+# ================================= Defining Functions ====================================
+# To get the complementary sequence of a given sequence.
+compTable = str.maketrans("GCTAN-", "CGATN-")
+
+def seqComp(s):
+    return s.translate(compTable)[::-1]
+
+
+# Split a CCS read (a "Segment" without a split index) with the complementary sequence of the signature sequence of the MAS primer (Reverse).
+def splitPrim(ccs):
+    ind_lis = [0]
+
+    for hit in matcher_MASseq.split_anchor.finditer(ccs.seq):
+        ind_lis.extend(hit.span())
+
+    return [ccs.child(i, ind_lis[i*2], ind_lis[i*2+1]) for i in range(len(ind_lis)//2)]
+
+
+# The function to check whether the "SigF" sequence in the split reads is intact or not.
+def checkIntactSigF(seg):
+    sigf_hit = matcher_MASseq.sigF_5end_matcher.search(seg.seq, 0, 50)
+
+    if sigf_hit:
+        return seg.cut(sigf_hit.span()[-1])
+    else:
+        return False
+
+
+# Vote the orientation of a CCS read by the number of "SigRc" sequences on both strands, and split it.
+def seqVoteNSplit(ccs):
+    sigrc_num = 0
+    sigr_num = 0
+
+    for i in matcher_MASseq.sigRc_anchor.finditer(ccs.seq):
+        sigrc_num += 1
+
+    for i in matcher_MASseq.sigRc_comp_anchor.finditer(ccs.seq):
+        sigr_num += 1
+
+    if sigr_num > sigrc_num:
+        ccs = Segment(ccs.ccs_id, ccs.pass_num, None, seqComp(ccs.seq), ccs.qual[::-1])
+
+    return splitPrim(ccs)
+
+
+# Collect a valid read (a "Segment" of "Status.VALID") into "res_dic", its ID is only formatted by the writer of its output.
+# If "res_dic" has a "demux" dictionary, the read is collected under its barcode, to be written into the file of its sample or an unaligned .bam file directly;
+# else it is collected under "out_key", to be written into a .tsv file.
+# If "res_dic" has a "read_stats" ("readstat_MASseq.ReadStats"), the read is counted in it as well.
+def collectValid(res_dic, out_key, val):
+    read_stats = res_dic.get("read_stats")
+    if read_stats is not None:
+        read_stats.add(val.bc, val.pass_num, val.umi, len(val.seq), readstat_MASseq.TIER_KEYS[out_key])
+
+    demux_dic = res_dic.get("demux")
+
+    if demux_dic is None:
+        res_dic[out_key].append(val)
+    else:
+        demux_dic[val.bc].append(val)
+
+
+# Cut the assigned barcode off a split read and split its UMI, "step" is one of "err", "deg" and "noBC".
+# Return 1 if the read is recalled as a valid read, else 0.
+def assignUMI(seg, saa_res, umi_pattern, res_dic, step):
+    bca_seq = seg.seq[:saa_res[-1]]
+
+    matchUMI = umi_pattern.split(bca_seq, 1)
+
+    if len(matchUMI)==4:
+        collectValid(res_dic, f"{step}_valid", seg.valid(saa_res[0], matchUMI[1], len(bca_seq) - len(matchUMI[-1]), len(bca_seq)))
+        return 1
+
+    else:
+        res_dic[f"{step}_noUMI"].append(f"{seg.ID}|{saa_res[0]}|noUMI\t{bca_seq}\t{seg.qual[:saa_res[-1]]}\n")
+        return 0
+
+
+# ================================= Recall Rules ====================================
+# Each rule takes a "segment_MASseq.Segment" (a CCS read for step 1, a split read for the others), and the pattern bundle from "config_MASseq".
+# Output lines are appended to "res_dic", recalled reads are counted in "rec_stat"; the leftovers of a rule are passed to the next rule directly.
+# The leftovers of the last rules are collected as segments with their status, to be checked for false splits without parsing them again.
+
+# Step 1: the reads that cannot be split, only the reads with signature sequences on both strands are recalled.
+def recallErr(ccs, bundle, res_dic, rec_stat):
+    fwd_det, bwd_det = matcher_MASseq.detectOrientation(ccs.seq)
+
+    if not (fwd_det or bwd_det):
+        res_dic["err_discarded"].append(ccs.line(Status.ERROR))
+        return
+
+    for seg in seqVoteNSplit(ccs):
+        ch_res = checkIntactSigF(seg)
+
+        if not ch_res:
+            recallDeg(seg, bundle, res_dic, rec_stat)
+            continue
+
+        saa_res = bundle.bc_index.assignTail(ch_res.seq, 25)
+
+        if saa_res:
+            rec_stat["err_recalled"] += assignUMI(ch_res, saa_res, bundle.umi_pattern, res_dic, "err")
+        else:
+            recallNoBC(ch_res, bundle, res_dic, rec_stat)
+
+
+# Step 2: the split reads without an intact 5' end, the "SigF" sequence is searched in the whole read.
+def recallDeg(seg, bundle, res_dic, rec_stat):
+    sigf_hit = matcher_MASseq.sigF_anchor.search(seg.seq) if seg.seq else None
+
+    if not sigf_hit:
+        seg.status = Status.DEGRADED
+        res_dic["deg_true"].append(seg)
+        return
+
+    rec_seg = seg.cut(sigf_hit.span()[-1])
+    saa_res = bundle.bc_index.assignTail(rec_seg.seq, 25)
+
+    if saa_res:
+        rec_stat["deg_recalled"] += assignUMI(rec_seg, saa_res, bundle.umi_pattern, res_dic, "deg")
+    else:
+        recallNoBC(rec_seg, bundle, res_dic, rec_stat)
+
+
+# Step 3: the split reads without a barcode in its 3' end, the barcode is searched in the whole read.
+def recallNoBC(seg, bundle, res_dic, rec_stat):
+    saa_res = bundle.bc_index.assignRead(seg.seq) if seg.seq else None
+
+    if saa_res:
+        rec_stat["noBC_recalled"] += assignUMI(seg, saa_res, bundle.umi_pattern, res_dic, "noBC")
+    else:
+        seg.status = Status.NO_BC
+        res_dic["noBC_true"].append(seg)
+
+
+# ================================= False Split Detection ====================================
+# A "false split" splits a transcript containing a "SigRc"-like sequence into an element with an intact 5' end but no barcode,
+# followed by elements without any intact end, and an element with a barcode somewhere in it.
+# The leftovers of the recall rules from the same CCS read are produced together, so they are checked right away, without sorting all of them.
+
+# The output files of the false split detection, as the ones created by 'false_split_detect_<version>.py'.
+FALSE_SPLIT_OUTPUTS = ("fs_candidate", "fs_tooShort", "fs_discarded", "fs_onecol", "fs_rejoined")
+
+# The same cases as 'false_split_detect_<version>.py', and the number of candidates rejoined into valid reads.
+FALSE_SPLIT_STATS = ("Case 1", "Case 2", "Case 3", "Case 4", "Case 5", "Case 6", "Case 7", "Rejoined")
+
+
+# The sort key of the segments of a CCS read, by their split indexes.
+splitIndex = operator.attrgetter("seq_num")
+
+
+# Rejoin a candidate queue of segments into one read, the split signature cut off between the elements is filled with "SplitSig" at the lowest quality.
+# The last element is cut at its barcode, "bc_hit" is the (barcode_ID, barcode_start) of it.
+# Return 1 if the rejoined read has a UMI pattern and is collected as a valid read, else 0.
+def rejoinCandidate(queue, bc_hit, umi_pattern, res_dic):
+    seq_lis = [seg.seq for seg in queue]
+    qual_lis = [seg.qual for seg in queue]
+    seq_lis[-1] = seq_lis[-1][:bc_hit[-1]]
+    qual_lis[-1] = qual_lis[-1][:bc_hit[-1]]
+
+    join_qual = "!" * len(matcher_MASseq.SplitSig)
+    rej_seq = matcher_MASseq.SplitSig.join(seq_lis)
+    rej_qual = join_qual.join(qual_lis)
+
+    matchUMI = umi_pattern.split(rej_seq, 1)
+
+    if len(matchUMI)!=4:
+        return 0
+
+    # The rejoined read starts in the first element and ends at the barcode of the last one, its split index covers all the elements.
+    out_start = len(rej_seq) - len(matchUMI[-1])
+    val = Segment(queue[0].ccs_id, queue[0].pass_num, queue[0].seq_num, rej_seq[out_start:], rej_qual[out_start:], queue[0].start + out_start, queue[-1].start + bc_hit[-1], Status.VALID)
+    val.bc = bc_hit[0]
+    val.umi = matchUMI[1]
+    val.join_num = len(queue)
+
+    collectValid(res_dic, "fs_rejoined", val)
+    return 1
+
+
+# Detect false splits in the leftover segments ("|Degraded" and "|noBC") of one CCS read, with the queue rules of 'false_split_detect_<version>.py'.
+# A queue starts with a "|noBC" element, continues with "|Degraded" elements with continuous split indexes, and ends with an element that has a barcode in it.
+# A queue still open when the CCS read ends is discarded as "Case 4"; with "rejoin", candidates longer than 200 nt are also rejoined into valid reads.
+# The length of a queue is summed up as its elements are appended.
+def detectFalseSplit(read_segs, bundle, res_dic, case_stat, rejoin=False):
+    queue = []
+    queue_len = 0
+
+    for seg in sorted(read_segs, key=splitIndex):
+        if seg.status is Status.NO_BC:
+            if queue:
+                case_stat["Case 1"] += 1
+                res_dic["fs_discarded"].extend(queue)
+
+            queue = [seg]
+            queue_len = len(seg.seq)
+            continue
+
+        if not queue:
+            case_stat["Case 2"] += 1
+            res_dic["fs_discarded"].append(seg)
+            continue
+
+        # An element without a sequence or its qualities.
+        if not (seg.seq and seg.qual):
+            case_stat["Case 3"] += 1
+            res_dic["fs_onecol"].append(seg)
+            continue
+
+        if seg.seq_num - queue[-1].seq_num!=1:
+            case_stat["Case 4"] += 1
+            res_dic["fs_discarded"].append(seg)
+            res_dic["fs_discarded"].extend(queue)
+            queue = []
+            continue
+
+        bc_hit = bundle.bc_index.assignRead(seg.seq)
+        queue.append(seg)
+        queue_len += len(seg.seq)
+
+        if not bc_hit:
+            case_stat["Case 7"] += 1
+            continue
+
+        # The ID of the last element is marked with its barcode.
+        seg.markFalseSplit(bc_hit[0])
+
+        if queue_len>200:
+            case_stat["Case 5"] += 1
+            res_dic["fs_candidate"].extend(queue)
+
+            if rejoin:
+                case_stat["Rejoined"] += rejoinCandidate(queue, bc_hit, bundle.umi_pattern, res_dic)
+        else:
+            case_stat["Case 6"] += 1
+            res_dic["fs_tooShort"].extend(queue)
+
+        queue = []
+
+    if queue:
+        case_stat["Case 4"] += 1
+        res_dic["fs_discarded"].extend(queue)
@@ -0,0 +1,163 @@
+# Author: JIA Zheng
+# This is the module of the record of a split read (segment) of a CCS read, shared by the splitting, the recall rules and the false split detection.
+# The ID of a segment "<read_name>|<pass_number>|<split_index>|<suffix>" is parsed only once, when the segment is created from a CCS read or read from a .tsv file,
+# and formatted again only when the segment is written out, instead of being rebuilt and split again at every step.
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import sys
+import enum
+
+
+# ================================= Segment Status ====================================
+class Status(enum.Enum):
+    """
+    The status of a segment, the value is the suffix of its ID in the .tsv files.
+    """
+    SPLIT = ""  # Not classified yet.
+    ERROR = "Error"  # The CCS read failed to split.
+    DEGRADED = "Degraded"  # Without an intact 5' end.
+    NO_BC = "noBC"  # Without a barcode.
+    NO_UMI = "noUMI"  # Without a UMI pattern.
+    FALSE_SPLIT = "falseSplit"  # The last element of a false split candidate, the suffix is "<barcode>_falseSplit".
+    VALID = "valid"  # A valid read, the suffix is "<barcode>|<UMI>".
+
+
+# The statuses parsed from the suffixes in the .tsv files of the invalid reads.
+STATUS_DIC = {status.value: status for status in Status if status.value and status is not Status.VALID}
+
+
+# ================================= Defining Functions ====================================
+# The numbers in an ID are kept as integers, the ones that are not numbers are kept as they are, so that the ID is formatted back the same.
+def idNum(field):
+    return int(field) if field.isascii() and field.isdigit() and (field=="0" or field[0]!="0") else field
+
+
+# ================================= Segment ====================================
+class Segment:
+    """
+    A segment of a CCS read, or a CCS read itself before it is split (its "seq_num" is None), or a valid read cut from a segment (its status is "Status.VALID").
+
+    Attributes:
+      ccs_id (str): the name of the CCS read, interned, so that the segments of a CCS read share one string.
+      pass_num (int): the pass number of the CCS read, None if the ID doesn't have one.
+      seq_num (int): the split index of the segment in the CCS read, None for a CCS read not split.
+      seq (str): the sequence of the segment.
+      qual (str): the base qualities of the segment.
+      start (int): the start of the segment in the (oriented) CCS read, or in itself if it is read from a file.
+      end (int): the end of the segment in the (oriented) CCS read.
+      status (Status): the status of the segment.
+      bc (str): the barcode ID of a valid read, or the one found in the last element of a false split candidate, None for the others.
+      umi (str): the UMI of a valid read, None for the others.
+      join_num (int): the number of split reads joined into a rejoined false split, from the split index "seq_num" on; 1 for the others.
+      raw (str): the line of an entry that can't be formatted back the same (e.g. one without a sequence), which is written out as it is; None for the others.
+    """
+
+    __slots__ = ("ccs_id", "pass_num", "seq_num", "seq", "qual", "start", "end", "status", "bc", "umi", "join_num", "raw")
+
+    def __init__(self, ccs_id, pass_num, seq_num, seq, qual, start=0, end=None, status=Status.SPLIT):
+        self.ccs_id = ccs_id
+        self.pass_num = pass_num
+        self.seq_num = seq_num
+        self.seq = seq
+        self.qual = qual
+        self.start = start
+        self.end = start + len(seq) if end is None else end
+        self.status = status
+        self.bc = None
+        self.umi = None
+        self.join_num = 1
+        self.raw = None
+
+    # Create a segment (or a CCS read) from its ID without the suffix: "<read_name>|<pass_number>[|<split_index>]".
+    @classmethod
+    def fromID(cls, read_ID, seq, qual):
+        id_lis = read_ID.split("|", 2)
+        return cls(sys.intern(id_lis[0]), idNum(id_lis[1]) if len(id_lis)>1 else None, idNum(id_lis[2]) if len(id_lis)>2 else None, seq, qual)
+
+    # Create a CCS read from its ID "<read_name>|<pass_number>", anything after the pass number is kept with it, as the split indexes are appended to the whole ID.
+    @classmethod
+    def fromReadID(cls, read_ID, seq, qual):
+        id_lis = read_ID.split("|", 1)
+        return cls(sys.intern(id_lis[0]), idNum(id_lis[1]) if len(id_lis)>1 else None, None, seq, qual)
+
+    # Create a segment from a line of a .tsv file "<read_name>|<pass_number>|<split_index>|<suffix>\t<sequence>\t<quality>".
+    @classmethod
+    def fromLine(cls, line):
+        field_lis = line.rstrip("\n").split("\t")
+        read_ID, _, suffix = field_lis[0].rpartition("|")
+
+        seg = cls.fromID(read_ID, *(field_lis[1:] if len(field_lis)==3 else ("", "")))
+        seg.status = STATUS_DIC.get(suffix)
+        if seg.status is None and suffix.endswith("_falseSplit"):
+            seg.status = Status.FALSE_SPLIT
+            seg.bc = suffix[:-11]
+
+        if len(field_lis)!=3 or seg.status is None or f"{seg.ID}|{seg.suffix}"!=field_lis[0]:
+            seg.raw = line
+
+        return seg
+
+    # The ID of the CCS read "<read_name>|<pass_number>".
+    @property
+    def read_ID(self):
+        return self.ccs_id if self.pass_num is None else f"{self.ccs_id}|{self.pass_num}"
+
+    # The ID of the segment without the suffix "<read_name>|<pass_number>|<split_index>", the split index of a rejoined false split is "<first>-<last>".
+    @property
+    def ID(self):
+        if self.seq_num is None:
+            return self.read_ID
+        if self.join_num > 1:
+            return f"{self.read_ID}|{self.seq_num}-{self.seq_num + self.join_num - 1}"
+        return f"{self.read_ID}|{self.seq_num}"
+
+    @property
+    def suffix(self):
+        if self.status is Status.VALID:
+            return f"{self.bc}|{self.umi}"
+        if self.status is Status.FALSE_SPLIT:
+            return f"{self.bc}_falseSplit"
+        return self.status.value
+
+    # The segment from "start" to "end" of this one (a CCS read is split into segments with their split indexes).
+    def child(self, seq_num, start, end):
+        return Segment(self.ccs_id, self.pass_num, seq_num, self.seq[start: end], self.qual[start: end], self.start + start, self.start + end)
+
+    # The rest of the segment after "start", e.g. after its 5' signature sequence.
+    def cut(self, start):
+        return Segment(self.ccs_id, self.pass_num, self.seq_num, self.seq[start:], self.qual[start:], self.start + start, self.end)
+
+    # The valid read from "start" to "end" of this segment, with its barcode and UMI.
+    def valid(self, bc, umi, start, end):
+        val = Segment(self.ccs_id, self.pass_num, self.seq_num, self.seq[start: end], self.qual[start: end], self.start + start, self.start + end, Status.VALID)
+        val.bc = bc
+        val.umi = umi
+        return val
+
+    # Mark the last element of a false split candidate with the barcode found in it.
+    def markFalseSplit(self, bc):
+        self.status = Status.FALSE_SPLIT
+        self.bc = bc
+        self.raw = None
+
+    # The line of the segment in a .tsv file, with the suffix of "status" or of its own status.
+    def line(self, status=None):
+        if self.raw is not None:
+            return self.raw
+
+        return f"{self.ID}|{status.value if status else self.suffix}\t{self.seq}\t{self.qual}\n"
+
+    # The FastQ record of the segment, e.g. of a valid read.
+    def fastq(self):
+        return f"@{self.ID}|{self.suffix}\n{self.seq}\n+\n{self.qual}\n"
+
+
+# Format the segments in a list into the lines of a .tsv file, at the output boundary.
+def segmentLines(seg_lis):
+    return [seg.line() for seg in seg_lis]
+
+
+# Format the segments in a list into FastQ records, at the output boundary.
+def fastqRecords(seg_lis):
+    return [seg.fastq() for seg in seg_lis]
@@ -0,0 +1,330 @@
+# 2026/10/17
+# Author: JIA Zheng
+# This is the script to simulate the CCS reads of a MAS-PAIso-seq(2) library, together with the ground truth of every split read.
+# The reads are built with the signature sequences in "matcher_MASseq" and the barcodes in the meta information, so the simulated library changes with them.
+# The simulated reads are used by 'benchmark_MASseq_<version>.py' to measure the throughput and the accuracy of the splitting workflow.
+# Current version: 1.0-beta
+
+# Load the necessary libraries.
+# Standard Python libraries:
+import os
+import sys
+import time
+import json
+import math
+import random
+import getopt
+
+# Third party packages:
+import pysam
+
+# Modules in the same directory:
+import matcher_MASseq
+import pbi_MASseq
+
+def getDatetime():
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+# ==================================== User Interface & Parameter Parsing ====================================
+# Get the options provided by users in a dictionary.
+usage = """This is a script to simulate the CCS reads of a MAS-PAIso-seq(2) library, with the ground truth of the split reads in a .tsv file.
+Each CCS read is an array of transcripts, which is built as:
+  <5' MAS primer> [<spacer> SigF <UMI> ATGGG <transcript> <poly(A) tail> <3' adapter barcode> <split signature>] x N <3' MAS primer>
+The split signature is the common sequence of the 3' adapters ("Adapter3GeneralSeq"), which contains the "SigRc" sequence.
+Sequencing errors are added to the whole CCS read afterwards, and a part of the CCS reads are reverse complemented.
+
+General usage:
+  python simulate_MASseq_<version>.py [-h] [-m <meta_information_file>] [-n <read_number>] [-s <seed>] [-o <output_prefix>] [--bam] [options]
+
+  -m    The file name with or without the PATH to a .json files cantains necessary meta information, leave it NULL to find a 'proj_meta.json' file in current WD;
+  -n    The number of CCS reads, default 10000;
+  -s    The seed of the random number generator, default 1. The same seed and options always give the same reads;
+  -o    The prefix of the output files, default "sim": "<output_prefix>.fastq" (or "<output_prefix>.bam"), "<output_prefix>.truth.tsv" and "<output_prefix>.sim.json";
+  --bam    Write the CCS reads into an unaligned .bam file with the pass numbers in the "np" tags, as a PacBio .bam file, instead of a .fastq file extracted by 'extr_MASseq_<version>.py'.
+           A PacBio index "<output_prefix>.bam.pbi" is written as well, with the hole numbers and the file offsets of the reads.
+
+The structure of the library:
+  --segments       The range of the number of transcripts in a CCS read, default "1-12";
+  --insert         The range of the transcript length, default "300-1500";
+  --polya          The range of the poly(A) tail length, default "0-100";
+  --reverse        The fraction of CCS reads sequenced on the reverse strand, default 0.5;
+  --low-pass       The fraction of CCS reads with a pass number less than 3, default 0.05.
+
+Defects of the transcripts:
+  --degraded       The fraction of transcripts without an intact 5' end (the "SigF" sequence is lost), default 0.05;
+  --no-bc          The fraction of transcripts without a correct barcode, default 0.05;
+  --false-split    The fraction of transcripts containing an internal split signature, which splits the transcript into two split reads, default 0.03;
+  --short          The fraction of transcripts lost with only their 3' adapters left (adapter dimers), which are split reads of a barcode only, default 0.01.
+
+Sequencing errors, the rates per base:
+  --sub            The substitution rate, default 0.005;
+  --ins            The insertion rate, default 0.003;
+  --del            The deletion rate, default 0.003.
+
+The ground truth file has a line for each transcript:
+  <CCS_read_name>  <pass_number>  <split_index>  <category>  <barcode_ID>  <UMI>  <transcript_length>  <strand>
+The category is "valid", "degraded", "noBC" or "false_split". The split index of a false split is "<n>-<n+1>", as the one of a rejoined false split.
+
+To view the usage information:
+  -h    Print usage information and exit.
+"""
+
+optlist, args = getopt.getopt(sys.argv[1:], 'hm:n:s:o:', ['bam', 'segments=', 'insert=', 'polya=', 'reverse=', 'low-pass=', 'degraded=', 'no-bc=', 'false-split=', 'short=', 'sub=', 'ins=', 'del='])
+optdict = dict(optlist)
+projWD = os.getcwd()
+
+if "-h" in optdict.keys():
+    sys.stderr.write(usage)
+    sys.exit()
+
+# Parse a range like "300-1500" into a tuple of integers.
+def parseRange(range_str):
+    range_lis = [int(i) for i in range_str.split("-")]
+    return (range_lis[0], range_lis[-1])
+
+sim_params = {
+    "reads": int(optdict.get("-n", 10000)),
+    "seed": int(optdict.get("-s", 1)),
+    "segments": parseRange(optdict.get("--segments", "1-12")),
+    "insert": parseRange(optdict.get("--insert", "300-1500")),
+    "polya": parseRange(optdict.get("--polya", "0-100")),
+    "reverse": float(optdict.get("--reverse", 0.5)),
+    "low_pass": float(optdict.get("--low-pass", 0.05)),
+    "degraded": float(optdict.get("--degraded", 0.05)),
+    "no_bc": float(optdict.get("--no-bc", 0.05)),
+    "false_split": float(optdict.get("--false-split", 0.03)),
+    "short": float(optdict.get("--short", 0.01)),
+    "sub": float(optdict.get("--sub", 0.005)),
+    "ins": float(optdict.get("--ins", 0.003)),
+    "del": float(optdict.get("--del", 0.003))
+}
+
+out_prefix = os.path.join(projWD, optdict.get("-o", "sim"))
+bam_output = "--bam" in optdict.keys()
+
+if ("-m" in optdict.keys()) and optdict["-m"]:
+    meta_json = os.path.join(projWD, optdict["-m"])
+else:
+    meta_json = f"{projWD}/proj_meta.json"
+
+with open(meta_json) as mf:
+    meta_inf = json.load(mf)
+
+used_bc = list(meta_inf["UsedAdapter"])
+bc_seq_dic = {bc: meta_inf["AdapterBC"][bc] for bc in used_bc}
+
+rand = random.Random(sim_params["seed"])
+
+
+# ================================= Defining Functions ====================================
+compTable = str.maketrans("GCTAN", "CGATN")
+
+def seqComp(s):
+    return s.translate(compTable)[::-1]
+
+
+# Random bases and qualities are translated from random bytes, which is much faster than choosing them one by one.
+BASE_TABLE = bytes(b"ACGT"[i % 4] for i in range(256))
+QUAL_TABLE = bytes(33 + 20 + i % 21 for i in range(256))
+
+def randomSeq(length):
+    return rand.randbytes(length).translate(BASE_TABLE).decode()
+
+
+# The qualities are from 20 to 40, nearly uniform.
+def randomQual(length):
+    return rand.randbytes(length).translate(QUAL_TABLE).decode()
+
+
+# Add substitutions, insertions and deletions to a sequence.
+# The distance to the next error is drawn from a geometric distribution, instead of drawing a random number for every base.
+def addErrors(seq):
+    sub_rate, ins_rate, del_rate = sim_params["sub"], sim_params["ins"], sim_params["del"]
+    err_rate = sub_rate + ins_rate + del_rate
+
+    if err_rate<=0:
+        return seq
+
+    log_keep = math.log(1 - min(err_rate, 0.999))
+    res_lis = []
+    last_pos = 0
+    err_pos = -1
+
+    while True:
+        err_pos += int(math.log(1 - rand.random()) / log_keep) + 1
+        if err_pos>=len(seq):
+            break
+
+        res_lis.append(seq[last_pos: err_pos])
+        err_p = rand.random() * err_rate
+
+        if err_p<sub_rate:
+            res_lis.append(rand.choice("ACGT".replace(seq[err_pos], "")))
+        elif err_p<sub_rate + ins_rate:
+            res_lis.append(seq[err_pos] + rand.choice("ACGT"))
+
+        last_pos = err_pos + 1
+
+    res_lis.append(seq[last_pos:])
+    return "".join(res_lis)
+
+
+# Build a transcript of a CCS read on the forward strand.
+# Return: (sequence, truth), truth is a dictionary of the ground truth of this transcript, without its split index.
+def buildSegment():
+    bc = rand.choice(used_bc)
+    umi = randomSeq(rand.randint(8, 12))
+    insert_len = rand.randint(*sim_params["insert"])
+    insert = randomSeq(insert_len) + "A" * rand.randint(*sim_params["polya"])
+
+    category = "valid"
+    seg_5end = randomSeq(rand.randint(0, 8)) + matcher_MASseq.SigF + umi + "ATGGG"
+    seg_3end = bc_seq_dic[bc] + matcher_MASseq.SplitSig
+
+    defect_p = rand.random()
+    short_p = sim_params["degraded"] + sim_params["no_bc"] + sim_params["false_split"]
+
+    # The 5' end is lost up to a random position after the "SigF" sequence.
+    if defect_p<sim_params["degraded"]:
+        category = "degraded"
+        seg_5end = (umi + "ATGGG")[rand.randint(0, len(umi) + 5):]
+        insert = insert[rand.randint(0, 30):]
+
+    # The barcode is replaced by a random sequence.
+    elif defect_p<sim_params["degraded"] + sim_params["no_bc"]:
+        category = "noBC"
+        seg_3end = randomSeq(len(bc_seq_dic[bc])) + matcher_MASseq.SplitSig
+
+    # The transcript contains the split signature, at least 100 nt from both of its ends.
+    elif defect_p<sim_params["degraded"] + sim_params["no_bc"] + sim_params["false_split"] and len(insert)>=200 + len(matcher_MASseq.SplitSig):
+        category = "false_split"
+        ins_pos = rand.randint(100, len(insert) - 100)
+        insert = insert[:ins_pos] + matcher_MASseq.SplitSig + insert[ins_pos:]
+
+    # Only the barcode is left between two split signatures, a split read shorter than the first 50 nt searched for the "SigF" sequence.
+    elif short_p<=defect_p<short_p + sim_params["short"]:
+        category = "degraded"
+        seg_5end = ""
+        insert = ""
+        insert_len = 0
+
+    truth = {
+        "category": category,
+        "barcode": bc if category!="noBC" else "noBC",
+        "UMI": umi if category!="degraded" else "",
+        "length": insert_len
+    }
+
+    return (seg_5end + insert + seg_3end, truth)
+
+
+# Build a CCS read, the transcripts are numbered by the split indexes they are expected to have.
+# Return: (name, pass_number, sequence, quality, truth_list).
+def buildRead(read_num):
+    read_name = f"m84000_260101_000000_s1/{read_num}/ccs"
+
+    if rand.random()<sim_params["low_pass"]:
+        pass_num = rand.randint(1, 2)
+    else:
+        pass_num = rand.randint(3, 40)
+
+    seg_lis = [randomSeq(rand.randint(20, 30))]
+    truth_lis = []
+    split_ind = 0
+
+    for i in range(rand.randint(*sim_params["segments"])):
+        seg_seq, truth = buildSegment()
+        seg_lis.append(seg_seq)
+
+        if truth["category"]=="false_split":
+            truth["split_index"] = f"{split_ind}-{split_ind + 1}"
+            split_ind += 2
+        else:
+            truth["split_index"] = str(split_ind)
+            split_ind += 1
+
+        truth_lis.append(truth)
+
+    seg_lis.append(randomSeq(rand.randint(20, 30)))
+    read_seq = addErrors("".join(seg_lis))
+
+    strand = "+"
+    if rand.random()<sim_params["reverse"]:
+        strand = "-"
+        read_seq = seqComp(read_seq)
+
+    for truth in truth_lis:
+        truth["strand"] = strand
+
+    read_qual = randomQual(len(read_seq))
+
+    return (read_name, pass_num, read_seq, read_qual, truth_lis)
+
+
+# ================================= Main loop ====================================
+print(f"[{getDatetime()}] Simulating {sim_params['reads']} CCS reads with seed {sim_params['seed']}, barcodes: {', '.join(used_bc)}.")
+
+if bam_output:
+    read_file = f"{out_prefix}.bam"
+    bam_header = pysam.AlignmentHeader.from_dict({"HD": {"VN": "1.6", "SO": "unknown"}})
+    read_handle = pysam.AlignmentFile(read_file, "wb", header=bam_header)
+    hole_lis = []
+    offset_lis = []
+else:
+    read_file = f"{out_prefix}.fastq"
+    read_handle = open(read_file, "w")
+
+truth_file = f"{out_prefix}.truth.tsv"
+truth_handle = open(truth_file, "w")
+truth_handle.write("#read_name\tpass_num\tsplit_index\tcategory\tbarcode_ID\tUMI\tinsert_len\tstrand\n")
+
+stat_dic = {
+    "reads": 0,
+    "bases": 0,
+    "low_pass_reads": 0,
+    "transcripts": dict.fromkeys(["valid", "degraded", "noBC", "false_split"], 0)
+}
+
+for read_num in range(sim_params["reads"]):
+    read_name, pass_num, read_seq, read_qual, truth_lis = buildRead(read_num)
+
+    if bam_output:
+        query = pysam.AlignedSegment(bam_header)
+        query.query_name = read_name
+        query.flag = 4
+        query.query_sequence = read_seq
+        query.query_qualities = pysam.qualitystring_to_array(read_qual)
+        query.set_tag("np", pass_num, "i")
+
+        hole_lis.append(read_num)
+        offset_lis.append(read_handle.tell())
+        read_handle.write(query)
+    else:
+        read_handle.write(f"@{read_name}|{pass_num}\n{read_seq}\n+\n{read_qual}\n")
+
+    for truth in truth_lis:
+        truth_handle.write(f"{read_name}\t{pass_num}\t{truth['split_index']}\t{truth['category']}\t{truth['barcode']}\t{truth['UMI']}\t{truth['length']}\t{truth['strand']}\n")
+        stat_dic["transcripts"][truth["category"]] += 1
+
+    stat_dic["reads"] += 1
+    stat_dic["bases"] += len(read_seq)
+    stat_dic["low_pass_reads"] += pass_num<3
+
+read_handle.close()
+truth_handle.close()
+
+if bam_output:
+    pbi_MASseq.writeIndex(read_file, hole_lis, offset_lis)
+    print(f"[{getDatetime()}] PacBio index written into {read_file}.pbi.")
+
+print(f"[{getDatetime()}] {stat_dic['reads']} CCS reads ({stat_dic['bases']} nt) written into {read_file}.")
+print(f"[{getDatetime()}] Ground truth of {sum(stat_dic['transcripts'].values())} transcripts written into {truth_file}.")
+
+
+# Dump the parameters and the statistic information into a .json file.
+json_name = f"{out_prefix}.sim.json"
+
+with open(json_name, "w") as jf:
+    json.dump({"params": sim_params, "meta": meta_json, "stats": stat_dic}, jf, indent=4)
+
+print(f"[{getDatetime()}] Json file: {json_name}.")
@@ -5,15 +5,37 @@
 
 # Load the necessary libraries.
 # Standard Python libraries:
+import io
 import os
 import sys
 import time
 import json
+import glob
 import getopt
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import_start = time.time()
 
 # Third party packages:
 import pysam
-import regex
+
+# Modules in the same directory:
+import matcher_MASseq
+import config_MASseq
+import recaller_MASseq
+import bgzf_MASseq
+import ubam_MASseq
+import manifest_MASseq
+import metrics_MASseq
+import pbi_MASseq
+import pipeline_MASseq
+import reader_MASseq
+import readstat_MASseq
+import segment_MASseq
+import workqueue_MASseq
+
+import_time = time.time() - import_start
 
 def getDatetime():
     return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
@@ -22,10 +44,13 @@ def getDatetime():
 # Get the options provided by users in a dictionary.
 usage = """This is the script to split MAS-ligated reads into "original transcripts" and validate split results. Valid results will output into a file with a ".BCassigned.tsv" extension. 
 Invalid results will output into different files with different extensions, ".err.tsv" for CCS reads failed to split, ".deg.tsv" for split results without a "SigF" sequence in its 5' end, ".noBC.tsv" for split results without a identifiable 3' adapter barcode, ".noUMI.tsv" for split results without a detectable UMI pattern right after the "SigF" sequence.
+The input can either be a .fastq file extracted by 'extr_MASseq_<version>.py', or the .bam file itself. A .bam file will be split directly without writing an intermediate .fastq file, CCS reads with a pass number less than 3 or without a pass number will be filtered out on the fly.
+If there is a PacBio index "<file_name>.bam.pbi" next to the .bam file, the total number of reads is known from the start, and the progress with the ETA is printed every minute.
 This script will generate a json file containing some statistic information about its running process in the working directory by default.
 
 General usage: 
-  python split_MASseq_<version>.py [-p] [-h] [-m <meta_information_file>] [-v <valid_output_directory>] [-i <invalid_output_directory>] [<PATH>/]<file_name>.fastq
+  python split_MASseq_<version>.py [-p] [-h] [-m <meta_information_file>] [-v <valid_output_directory>] [-i <invalid_output_directory>] [--workers <N>] [--inline-recall [--false-split] [--rejoin]] [--demux fastq.gz|fastq | --ubam] [--resume] [--metrics <prefix> [--metrics-interval <seconds>]] [--queue <queue_directory> [--lease-timeout <seconds>]] [<PATH>/]<file_name>.fastq|<file_name>.bam
+  python split_MASseq_<version>.py --queue-worker <queue_directory> [--queue-worker <queue_directory> ...]
 
 This script can either run within or without a standard project directory structure:
   -p    If this parameter is provided, this script will run in a "project mode" which needs a standard project directory structure;
@@ -35,26 +60,147 @@ The fillowing parameters is need when it is under a "standalone mode":
   -v    The directory to store the file containing valid reads, leave it NULL to output them in current WD;
   -i    The directory to store the file containing invalid reads for recall, leave it NULL to output them in current WD;
 
+Multi-process splitting:
+  --workers       The number of worker processes used to split CCS reads, default 1. The input file is read only once, and chunks of reads are split by a process pool;
+  --chunk-size    The number of CCS reads sent to a worker at a time, default 2000.
+  Results of all workers are merged into one set of output files, in the same order as the input reads.
+  With a .bam file and its PacBio index, the .bam file is cut into shards of "--chunk-size" reads by the file offsets in the index, and each worker reads its own shards, instead of one process reading all the reads.
+
+Inline recall:
+  --inline-recall    Apply the recall rules of 'recall_MASseq_<version>.py' to the reads failed to split, the split reads without an intact 5' end and the split reads without a barcode, right after they are split. 
+                     The ".err.tsv", ".deg.tsv" and ".noBC.tsv" files are not written, recalled reads are written into "<file_name>.recalled.tsv" in the valid output directory, 
+                     while only the reads that cannot be recalled are written out: "<file_name>.err_discarded.tsv", "<file_name>.recall_noUMI.tsv", and the false split candidates "<file_name>.deg_true.tsv", "<file_name>.noBC_true.tsv".
+                     Under the "project mode", the false split candidates are written into "recall/false_split/" for 'false_split_detect_<version>.py', the others into "discard/". 
+                     The recall statistics are dumped together with the split statistics. There is no need to run 'recall_MASseq_<version>.py' afterwards.
+  --false-split      Only with "--inline-recall". Detect false splits in the leftovers of each CCS read at once, as 'false_split_detect_<version>.py' does, instead of writing the ".deg_true.tsv" and ".noBC_true.tsv" files. 
+                     The results are written into "<file_name>.candidate_list.tsv", "<file_name>.candidate_tooShort.tsv", "<file_name>.not_false_split_candidate.tsv" and "<file_name>.one_column.tsv", 
+                     under the "project mode", the candidates are written into "recall/false_split/", the others into "discard/". The cases are counted in "<file_name>.false_split_cases.json".
+  --rejoin           Implies "--false-split". Rejoin the false split candidates into valid reads, which are written into "<file_name>.rejoined.tsv" in the valid output directory.
+
+Per-sample output:
+  --demux            "fastq.gz" or "fastq". Valid reads (including the recalled and rejoined ones) are written into a file of their sample directly, named after "Adapter2Sample" in the meta information, 
+                     instead of the ".BCassigned.tsv", ".recalled.tsv" and ".rejoined.tsv" files. There is no need to run 'convert_tsv2fqgz_<version>.py' afterwards.
+                     The files are "split_result/<sample_name>.<fastq.gz|fastq>" under the "project mode", or "<file_name>.<sample_name>.<fastq.gz|fastq>" in the valid output directory under the "standalone mode".
+  --demux-threads    The number of threads used to compress the "fastq.gz" files or the .bam file, default 4.
+  --ubam             Write valid reads into an unaligned .bam file instead, "valid/<file_name>.valid.bam" under the "project mode", or "<file_name>.valid.bam" in the valid output directory under the "standalone mode". 
+                     Each read is named "<CCS_read_name>/<split_index>", with the tags: RG (sample), BC (barcode sequence), bi (barcode ID), RX (UMI), np (pass number), si (split index), sn (number of joined split reads).
+
+Resumable runs:
+  --resume           Skip this run if the outputs are up to date with its manifest, or continue an unfinished run from its last checkpoint. 
+                     The manifest records the fingerprints of the input files, the parameters from the meta information and the options, the output files and the statistics.
+                     It is "manifest/split.<file_name>.json" under the "project mode", or "<file_name>.split.manifest.json" in the valid output directory under the "standalone mode". 
+                     A checkpoint is saved every minute while splitting, except with "--ubam", and the outputs are truncated to the checkpoint before continuing.
+
+Metrics:
+  --metrics             Write snapshots of the metrics into "<prefix>.json" and "<prefix>.prom" (the Prometheus text format, for the textfile collector of "node_exporter") while running. 
+                        The metrics are the statistics as counters, the latency histograms of the steps (orientation, split, sigf, barcode, umi, false_split, read, wait, write), 
+                        the reads per second of each worker and of the whole run, and the queue depths of the chunks and of the BGZF blocks. The steps are not timed without this option.
+  --metrics-interval    The minimum interval between two snapshots in seconds, default 10. A last snapshot is always written at the end.
+
+Multi-node splitting:
+  --queue            Run as the coordinator of a work queue in <queue_directory>, which should be on a file system shared by all the machines. 
+                     The chunks of reads are published as tasks: the shards of the .bam file by its PacBio index (which is needed), or the ranges of "--chunk-size" reads of the .fastq file. 
+                     The tasks are processed by the coordinator (with its "--workers") and by any number of workers, the coordinator writes the results in the order of the tasks, as the outputs of a single run.
+  --queue-worker     Run as a worker of the work queue in <queue_directory>, on any machine. A worker runs with the options and in the working directory of its coordinator, 
+                     so the files should have the same paths on all the machines. It waits for the coordinator to publish the tasks, claims and processes them one by one, and exits when all the tasks are done.
+                     With several work queues, e.g. the ones of the cells of 'batch_MASseq_<version>.py', the worker moves on to the next queue as soon as there isn't any task to claim in the current one.
+  --lease-timeout    A task claimed by a worker is claimed again by others, if its worker doesn't renew its lease within this time in seconds (default 120), or the worker on the same machine is dead.
+
 To view the usage information:
   -h    Print usage information and exit.
 """
 
-optlist, args = getopt.getopt(sys.argv[1:], 'phm:v:i:f:')
+opt_spec = ('phm:v:i:f:', ['workers=', 'chunk-size=', 'inline-recall', 'false-split', 'rejoin', 'demux=', 'demux-threads=', 'ubam', 'resume', 'metrics=', 'metrics-interval=', 'queue=', 'queue-worker=', 'lease-timeout='])
+optlist, args = getopt.getopt(sys.argv[1:], *opt_spec)
 optdict = dict(optlist)
+
+# A worker of a work queue runs with the command line of its coordinator in its working directory, which are published in the queue.
+work_queue = None
+queue_worker = "--queue-worker" in optdict.keys()
+
+if queue_worker:
+    queue_lis = [opt_value for opt_name, opt_value in optlist if opt_name=="--queue-worker"]
+    work_queue = workqueue_MASseq.WorkQueue(queue_lis[0])
+    print(f"[{getDatetime()}] Will run as a worker of the work queue {work_queue.queue_dir}, as {work_queue.owner}.")
+
+    queue_inf = work_queue.waitPublished()
+    if queue_inf["stage"]!="split":
+        sys.stderr.write(f"The work queue {work_queue.queue_dir} is published by the '{queue_inf['stage']}' stage, not 'split' :-(\n")
+        sys.exit()
+
+    os.chdir(queue_inf["cwd"])
+    optlist, args = getopt.getopt(queue_inf["argv"], *opt_spec)
+    optdict = dict(optlist)
+
+elif ("--queue" in optdict.keys()) and optdict["--queue"]:
+    work_queue = workqueue_MASseq.WorkQueue(optdict["--queue"])
+
+if work_queue and ("--lease-timeout" in optdict.keys()) and optdict["--lease-timeout"]:
+    work_queue.lease_timeout = max(1.0, float(optdict["--lease-timeout"]))
+
 projWD = os.getcwd()
 
 if ("-h" in sys.argv[1:]) or (len(sys.argv)==1):
     sys.stderr.write(usage)
     sys.exit()
 
+worker_num = 1
+chunk_size = 2000
+
+if ("--workers" in optdict.keys()) and optdict["--workers"]:
+    worker_num = max(1, int(optdict["--workers"]))
+if ("--chunk-size" in optdict.keys()) and optdict["--chunk-size"]:
+    chunk_size = max(1, int(optdict["--chunk-size"]))
+
+inline_recall = "--inline-recall" in optdict.keys()
+false_split = "--false-split" in optdict.keys()
+rejoin = "--rejoin" in optdict.keys()
+
+if (false_split or rejoin) and not inline_recall:
+    sys.stderr.write("'--false-split' and '--rejoin' only work with '--inline-recall' :-(\n")
+    sys.exit()
+
+false_split = false_split or rejoin
+
+demux_fmt = None
+demux_threads = 4
+
+if ("--demux" in optdict.keys()) and optdict["--demux"]:
+    demux_fmt = optdict["--demux"]
+    if demux_fmt not in ("fastq.gz", "fastq"):
+        sys.stderr.write(f"Unknown '--demux' format: '{demux_fmt}', it should be 'fastq.gz' or 'fastq' :-(\n")
+        sys.exit()
+if ("--demux-threads" in optdict.keys()) and optdict["--demux-threads"]:
+    demux_threads = max(1, int(optdict["--demux-threads"]))
+
+ubam = "--ubam" in optdict.keys()
+if ubam and demux_fmt:
+    sys.stderr.write("'--ubam' and '--demux' can not be used together :-(\n")
+    sys.exit()
+
+resume = "--resume" in optdict.keys()
+
+run_metrics = None
+
+if ("--metrics" in optdict.keys()) and optdict["--metrics"]:
+    metrics_interval = metrics_MASseq.SNAPSHOT_INTERVAL
+    if ("--metrics-interval" in optdict.keys()) and optdict["--metrics-interval"]:
+        metrics_interval = max(0.0, float(optdict["--metrics-interval"]))
+    run_metrics = metrics_MASseq.Metrics("split", optdict["--metrics"], metrics_interval)
+
+
+bam_input = False
 
 if len(args)==1:
     if args[0][-6:]==".fastq":
         fqf_name = os.path.basename(args[0][:-6])
+    elif args[0][-4:]==".bam":
+        fqf_name = os.path.basename(args[0][:-4])
+        bam_input = True
     else:
         fqf_name = os.path.basename(args[0])
 else:
-    sys.stderr.write("This version could only process one .fastq file for each run :-(\nIf you want multi-threads processing, please refer to our manual and try 'ParaFly'.")
+    sys.stderr.write("This version could only process one .fastq file for each run :-(\nIf you want multi-process splitting, please use the '--workers' parameter.")
     sys.exit()
 
 if '/' in fqf_name:
@@ -71,7 +217,10 @@ if ("-i" in optdict.keys()) and optdict["-i"]:
 
 if "-p" in optdict.keys():
     print(f"[{getDatetime()}] Will run in a standard project directory structure, current WD: {projWD}")
+    # Parts created by "fastq-splitter.pl" are stored in "fqsplit/", while a whole .fastq file is read from the project WD directly.
     fq_file = f"{projWD}/fqsplit/{args[0]}"
+    if not os.path.exists(fq_file):
+        fq_file = os.path.join(projWD, args[0])
     bca_file = f"{projWD}/valid/{fqf_name}.BCassigned.tsv"  # "BCA" for "BarCode Assigned".
 
     err_file = f"{projWD}/invalid/{fqf_name}.err.tsv"  # The sequence that failed to split.
@@ -80,6 +229,33 @@ if "-p" in optdict.keys():
     noUMI_file = f"{projWD}/invalid/{fqf_name}.noUMI.tsv"  # No UMI pattern was detected.
 
     json_name = f"{projWD}/valid/{fqf_name}.stat.json"
+    sample_json_name = f"{projWD}/valid/{fqf_name}.sample_stat.json"
+
+    # Only used when the .bam file is split directly, these files are the same as the ones created by 'extr_MASseq_<version>.py'.
+    lt3_name = f"{projWD}/discard/css_pass_lt3.fastq"
+    err_sam_name = f"{projWD}/recall/potential_err.sam"
+    pn_json_name = f"{projWD}/passnum_stat.json"
+
+    # Only used when the invalid reads are recalled inline.
+    recalled_file = f"{projWD}/valid/{fqf_name}.recalled.tsv"
+    err_discard_file = f"{projWD}/discard/{fqf_name}.err_discarded.tsv"
+    rec_noUMI_file = f"{projWD}/discard/{fqf_name}.recall_noUMI.tsv"
+    deg_true_file = f"{projWD}/recall/false_split/{fqf_name}.deg_true.tsv"
+    noBC_true_file = f"{projWD}/recall/false_split/{fqf_name}.noBC_true.tsv"
+
+    # Only used when the false splits are detected inline.
+    candidate_file = f"{projWD}/recall/false_split/{fqf_name}.candidate_list.tsv"
+    candidate_tooShort_file = f"{projWD}/recall/false_split/{fqf_name}.candidate_tooShort.tsv"
+    fs_discard_file = f"{projWD}/discard/{fqf_name}.not_false_split_candidate.tsv"
+    onecol_file = f"{projWD}/discard/{fqf_name}.one_column.tsv"
+    rejoined_file = f"{projWD}/valid/{fqf_name}.rejoined.tsv"
+    fs_json_name = f"{projWD}/valid/{fqf_name}.false_split_cases.json"
+
+    # Only used when the valid reads are written into the files of their samples.
+    demux_prefix = f"{projWD}/split_result/"
+    ubam_name = f"{projWD}/valid/{fqf_name}.valid.bam"
+
+    manifest_name = f"{projWD}/manifest/split.{fqf_name}.json"
 
 else:
     print(f"[{getDatetime()}] Will run in a standalone mode, current WD: {projWD}")
@@ -92,6 +268,29 @@ else:
     noUMI_file = os.path.join(projWD, invalid_dir, f"{fqf_name}.noUMI.tsv")
 
     json_name = os.path.join(projWD, valid_dir, f"{fqf_name}.stat.json")
+    sample_json_name = os.path.join(projWD, valid_dir, f"{fqf_name}.sample_stat.json")
+
+    lt3_name = os.path.join(projWD, invalid_dir, f"{fqf_name}_pass_lt3.fastq")
+    err_sam_name = os.path.join(projWD, invalid_dir, f"{fqf_name}_no_passnum.sam")
+    pn_json_name = os.path.join(projWD, valid_dir, f"{fqf_name}_passnum_stat.json")
+
+    recalled_file = os.path.join(projWD, valid_dir, f"{fqf_name}.recalled.tsv")
+    err_discard_file = os.path.join(projWD, invalid_dir, f"{fqf_name}.err_discarded.tsv")
+    rec_noUMI_file = os.path.join(projWD, invalid_dir, f"{fqf_name}.recall_noUMI.tsv")
+    deg_true_file = os.path.join(projWD, invalid_dir, f"{fqf_name}.deg_true.tsv")
+    noBC_true_file = os.path.join(projWD, invalid_dir, f"{fqf_name}.noBC_true.tsv")
+
+    candidate_file = os.path.join(projWD, invalid_dir, f"{fqf_name}.candidate_list.tsv")
+    candidate_tooShort_file = os.path.join(projWD, invalid_dir, f"{fqf_name}.candidate_tooShort.tsv")
+    fs_discard_file = os.path.join(projWD, invalid_dir, f"{fqf_name}.not_false_split_candidate.tsv")
+    onecol_file = os.path.join(projWD, invalid_dir, f"{fqf_name}.one_column.tsv")
+    rejoined_file = os.path.join(projWD, valid_dir, f"{fqf_name}.rejoined.tsv")
+    fs_json_name = os.path.join(projWD, valid_dir, f"{fqf_name}.false_split_cases.json")
+
+    demux_prefix = os.path.join(projWD, valid_dir, f"{fqf_name}.")
+    ubam_name = os.path.join(projWD, valid_dir, f"{fqf_name}.valid.bam")
+
+    manifest_name = os.path.join(projWD, valid_dir, f"{fqf_name}.split.manifest.json")
 
 
 # ================================ Basic Information ====================================
@@ -103,12 +302,78 @@ else:
 
 print(f"[{getDatetime()}] The meta-information file will be: {meta_json}")
 
-with open(meta_json) as metaf:
-    meta_inf = json.load(metaf)
+# The barcode index and the UMI pattern are built from the meta information, and cached in "<meta_information_file>.bundle.pkl" for the following runs.
+meta_bundle, bundle_inf = config_MASseq.loadBundle(meta_json)
+
+# The steps are timed by wrapping the functions, before any of them is bound to a local name.
+if run_metrics:
+    metrics_MASseq.instrument(run_metrics, meta_bundle)
+    metrics_MASseq.instrumentSteps(run_metrics, vars(recaller_MASseq))
 
-pattern_basic = {}
-for i in meta_inf["UsedAdapter"]:
-   pattern_basic[i] = "(?e)(" + meta_inf["AdapterBC"][i] + "){e<=2}"
+meta_inf = meta_bundle.meta_inf
+bc_index = meta_bundle.bc_index
+umi_pattern = meta_bundle.umi_pattern
+
+print(f"[{getDatetime()}] Barcode index loaded, {len(bc_index.table)} sequences indexed, {bc_index.ambiguous_num} of them are ambiguous.")
+print(f"[{getDatetime()}] Startup time: {import_time:.3f}s for imports, {bundle_inf['time']:.3f}s for the pattern bundle ({bundle_inf['source']}).")
+
+
+# The total number of reads is read from the header of the PacBio index, if there is one. The index is also needed to cut the .bam file into shards.
+total_reads = pbi_MASseq.indexReadNum(fq_file) if bam_input else None
+bam_shards = (total_reads is not None) and (worker_num > 1 or work_queue is not None)
+
+if work_queue and bam_input and total_reads is None:
+    sys.stderr.write(f"A PacBio index {fq_file}.pbi is needed to share a .bam file through a work queue :-(\n")
+    sys.exit()
+
+if total_reads is not None:
+    print(f"[{getDatetime()}] {total_reads} reads in the PacBio index {fq_file}.pbi.")
+
+
+# ================================ Run Manifest ====================================
+# The chunks are counted in the checkpoints, so the chunk size is a parameter of the run, while the number of workers is not.
+# A chunk is a shard of the .bam file when it is read by the workers, whose reads are not the same as the ones of a chunk read by the main process.
+split_man = manifest_MASseq.StageManifest(manifest_name, "split", [fq_file, meta_json], {
+    "meta": manifest_MASseq.metaParams(meta_bundle),
+    "bundle_key": bundle_inf["key"],
+    "options": {
+        "chunk_size": chunk_size,
+        "inline_recall": inline_recall,
+        "false_split": false_split,
+        "rejoin": rejoin,
+        "demux": demux_fmt,
+        "ubam": ubam,
+        "bam_shards": bam_shards
+    }
+})
+
+resume_point = None
+
+# A worker of a work queue doesn't write any output, nor the manifest.
+if resume and not queue_worker:
+    if split_man.isComplete():
+        print(f"[{getDatetime()}] The outputs are up to date with the manifest {manifest_name}, skipped :-)")
+        # No task is published, so that the workers waiting for this queue move on.
+        if work_queue:
+            work_queue.publish("split", sys.argv[1:], projWD, [])
+        sys.exit()
+
+    resume_point = split_man.resumePoint()
+
+if resume_point:
+    print(f"[{getDatetime()}] Continue from the checkpoint in {manifest_name}, {resume_point['chunks']} chunks were done.")
+elif not queue_worker:
+    split_man.begin()
+
+# The output files are truncated to their sizes at the checkpoint, or created.
+resume_offsets = resume_point["offsets"] if resume_point else {}
+
+# The output files are written through large buffers, by the writer thread of the pipeline. There isn't any output file for a worker of a work queue.
+def openOutput(file_name):
+    if queue_worker:
+        return None
+
+    return manifest_MASseq.openOutput(file_name, resume_offsets.get(file_name), pipeline_MASseq.WRITE_BUFFER)
 
 
 # ================================ Defining File Handles ====================================
@@ -130,78 +395,334 @@ for i in meta_inf["UsedAdapter"]:
 # └── scripts/
 #     ├── project_meta.json
 #     └── onestop.py
-fq_bca = open(bca_file, "w")
-
-fq_err = open(err_file, "w")  # The sequence that failed to split.
-fq_deg = open(deg_file, "w")  # The 5' signature sequence was not intact.
-fq_noBC = open(noBC_file, "w")  # No 3'adapter barcode sequence was detected.
-fq_noUMI = open(noUMI_file, "w")  # No UMI pattern was detected.
+fq_noUMI = openOutput(noUMI_file)  # No UMI pattern was detected.
+
+if inline_recall:
+    # The reads failed to split, without an intact 5' end or without a barcode are recalled at once, only their leftovers are written out.
+    # Reads recalled by different steps share one output file.
+    fq_rec = None if (demux_fmt or ubam) else openOutput(recalled_file)
+    fq_rec_noUMI = openOutput(rec_noUMI_file)
+
+    out_handle_dic = {
+        "BC_assigned": None,
+        "No_UMI": fq_noUMI,
+        "err_valid": fq_rec,
+        "deg_valid": fq_rec,
+        "noBC_valid": fq_rec,
+        "err_noUMI": fq_rec_noUMI,
+        "deg_noUMI": fq_rec_noUMI,
+        "noBC_noUMI": fq_rec_noUMI,
+        "err_discarded": openOutput(err_discard_file)
+    }
+
+    # The leftovers are either written out as they are, or checked for false splits.
+    if false_split:
+        out_handle_dic["fs_candidate"] = openOutput(candidate_file)
+        out_handle_dic["fs_tooShort"] = openOutput(candidate_tooShort_file)
+        out_handle_dic["fs_discarded"] = openOutput(fs_discard_file)
+        out_handle_dic["fs_onecol"] = openOutput(onecol_file)
+        if rejoin and not (demux_fmt or ubam):
+            out_handle_dic["fs_rejoined"] = openOutput(rejoined_file)
+    else:
+        out_handle_dic["deg_true"] = openOutput(deg_true_file)
+        out_handle_dic["noBC_true"] = openOutput(noBC_true_file)
+else:
+    out_handle_dic = {
+        "Split_failed": openOutput(err_file),  # The sequence that failed to split.
+        "5end_deg": openOutput(deg_file),  # The 5' signature sequence was not intact.
+        "No_BC": openOutput(noBC_file),  # No 3'adapter barcode sequence was detected.
+        "No_UMI": fq_noUMI,
+        "BC_assigned": None
+    }
+
+# Valid reads are either written into a .tsv file, into the files of their samples, or into an unaligned .bam file.
+if demux_fmt or ubam:
+    for out_key in ["BC_assigned", "err_valid", "deg_valid", "noBC_valid"]:
+        out_handle_dic.pop(out_key, None)
+
+if demux_fmt and not queue_worker:
+    demux_pool = ThreadPoolExecutor(demux_threads) if demux_fmt=="fastq.gz" else None
+    demux_handle_dic = {}
+    for bc in meta_bundle.used_bc:
+        demux_name = f"{demux_prefix}{meta_bundle.sample_dic[bc]}.{demux_fmt}"
+        demux_handle_dic[bc] = bgzf_MASseq.openSink(demux_name, demux_fmt, 6, demux_pool, resume_offsets.get(demux_name))
+elif ubam and not queue_worker:
+    ubam_writer = ubam_MASseq.UBAMWriter(ubam_name, meta_bundle, demux_threads, "split_MASseq")
+elif not (demux_fmt or ubam):
+    out_handle_dic["BC_assigned"] = openOutput(bca_file)
 
 
 # ================================= Defining Functions ====================================
 # Loading meta information from a .json file.
 
-# To get the complementary sequence of a given sequence. 
-def seqComp(s):
-	compDict = {'G':'C','C':'G','T':'A','A':'T','N':'N','-':'-'}
-	return ''.join([compDict[x] for x in s])[::-1]
-
-
 # Determine whether the read is positive or negative, to enable a unified workflow. 
 # If positive, return its original sequence, else, return its complementary sequence.
+# The signature sequences are searched by the bit-parallel matchers in "matcher_MASseq", only around their exact k-mer seeds.
 def seqSigFWD(orig_seq, orig_qual):
-    # Forward signature sequence, and the complementary sequence of reverse signature;
-    fwd_det = bool(regex.search("(?e)(TCTACACGACGCTCTTCCGATCT){e<=2}", orig_seq)) and bool(regex.search("(?e)(CTCTGCGTTGATACCACTGCTTA){e<=2}", orig_seq))
-    # Vice versa.
-    bwd_det = bool(regex.search("(?e)(AGATCGGAAGAGCGTCGTGTAGA){e<=2}", orig_seq)) and bool(regex.search("(?e)(TAAGCAGTGGTATCAACGCAGAG){e<=2}", orig_seq))
+    # Forward signature sequence, and the complementary sequence of reverse signature; vice versa.
+    fwd_det, bwd_det = matcher_MASseq.detectOrientation(orig_seq)
 
     if fwd_det and (not bwd_det):
         return (orig_seq, orig_qual)
 
     elif (not fwd_det) and bwd_det:
-        return (seqComp(orig_seq), orig_qual[::-1])
+        return (recaller_MASseq.seqComp(orig_seq), orig_qual[::-1])
     
     else:
         return None
     
 
-# Split the original reads with the complementary sequence of the signature sequence of the MAS primer (Reverse).
-def splitPrim(fq_ID, fq_seq, fq_qual):
-    ind_lis = [0]
-    res_lis = []
+# The function to assign the 3'adapter BC for a given sequence. 
+def adapterAssign(seq, bc_idx):
+    return bc_idx.assignTail(seq, 25)
+    
 
-    for hit in regex.finditer("(?e)(GTACTCTGCGTTGATACCACTGCTTA){e<=3}", fq_seq):
-        ind_lis.extend(hit.span())
+# Split and validate a CCS read, output lines are appended to "res_dic".
+# The read is split and the 5' ends are checked by "recaller_MASseq.splitPrim" and "recaller_MASseq.checkIntactSigF", the same functions the recall rules use.
+# With "--inline-recall", the invalid reads are passed to the recall rules in "recaller_MASseq" instead of being collected.
+def classifyRead(entry_ID, entry_seq, entry_qual, res_dic, chunk_stat):
+    lisP = seqSigFWD(entry_seq, entry_qual)
 
-    for i in range(len(ind_lis)//2):
-        res_lis.append((f"{fq_ID}|{i}", fq_seq[ind_lis[i*2]: ind_lis[i*2+1]], fq_qual[ind_lis[i*2]: ind_lis[i*2+1]]))
+    if lisP:
+        entry_seqP, entry_qualP = lisP
+    else:
+        chunk_stat["Split_failed"] += 1
+        if inline_recall:
+            recaller_MASseq.recallErr(segment_MASseq.Segment.fromID(entry_ID, entry_seq, entry_qual), meta_bundle, res_dic, chunk_stat)
+        else:
+            res_dic["Split_failed"].append(f"{entry_ID}|Error\t{entry_seq}\t{entry_qual}\n")
+        return
 
-    return res_lis
+    sp_lis = recaller_MASseq.splitPrim(segment_MASseq.Segment.fromReadID(entry_ID, entry_seqP, entry_qualP))
+    for seg in sp_lis:
+        ch_res = recaller_MASseq.checkIntactSigF(seg)
+        if ch_res:
+            saa_res = adapterAssign(ch_res.seq, bc_index)
 
+            if saa_res:
+                bca_seq = ch_res.seq[:saa_res[-1]]
 
-# The function to check whether the 5' end of the split reads is intact or not.
-def checkIntactSigF(sp_tup):
-    sigf_hit = regex.search("(?e)(CTACACGACGCTCTTCCGATCT){e<=2}", sp_tup[1][:50])
-    
-    if sigf_hit:
-        return (sp_tup[0], sp_tup[1][sigf_hit.span()[-1]:], sp_tup[-1][sigf_hit.span()[-1]:])
-    else:
-        return False
-    
+                matchUMI = umi_pattern.split(bca_seq, 1)
 
-# The function to assign the 3'adapter BC for a given sequence. 
-def adapterAssign(seq, pdic):
-    for bc in pdic.keys():
-        bc_hit = regex.search(pdic[bc], seq[-25:])
-        if bc_hit:
-            return (bc, bc_hit.span()[0]-25)
+                # The valid read is collected as a segment, its ID is formatted by the writer of its output.
+                if len(matchUMI)==4:
+                    recaller_MASseq.collectValid(res_dic, "BC_assigned", ch_res.valid(saa_res[0], matchUMI[1], len(bca_seq) - len(matchUMI[-1]), len(bca_seq)))
+                    chunk_stat["BC_assigned"] += 1
+
+                else:
+                    res_dic["No_UMI"].append(f"{ch_res.ID}|{saa_res[0]}|noUMI\t{bca_seq}\t{ch_res.qual[:saa_res[-1]]}\n")
+                    chunk_stat["No_UMI"] += 1
+
+            else:
+                chunk_stat["No_BC"] += 1
+                if inline_recall:
+                    recaller_MASseq.recallNoBC(ch_res, meta_bundle, res_dic, chunk_stat)
+                else:
+                    res_dic["No_BC"].append(ch_res.line(segment_MASseq.Status.NO_BC))
+
+        else:
+            chunk_stat["5end_deg"] += 1
+            if inline_recall:
+                recaller_MASseq.recallDeg(seg, meta_bundle, res_dic, chunk_stat)
+            else:
+                res_dic["5end_deg"].append(seg.line(segment_MASseq.Status.DEGRADED))
+
+
+# Split and validate a chunk of CCS reads.
+# Output lines are collected by their output file instead of written directly, so that the chunk can be processed by a worker process.
+# With "--false-split", the leftovers of the recall rules from each CCS read are checked for false splits as soon as the CCS read is classified.
+# The valid reads are counted in the "read_stats" of the chunk, together with the number of valid reads from each CCS read.
+def classifyChunk(chunk):
+    chunk_start = time.perf_counter()
+    res_dic = {key: [] for key in out_handle_dic.keys()}
+    chunk_reads = readstat_MASseq.ReadStats()
+    res_dic["read_stats"] = chunk_reads
+    if demux_fmt or ubam:
+        res_dic["demux"] = {bc: [] for bc in meta_bundle.used_bc}
+    chunk_stat = dict.fromkeys(["Split_failed", "5end_deg", "No_BC", "No_UMI", "BC_assigned"], 0)
+    if inline_recall:
+        chunk_stat.update(dict.fromkeys(recaller_MASseq.RECALL_STATS, 0))
+    if false_split:
+        res_dic["deg_true"] = []
+        res_dic["noBC_true"] = []
+        chunk_stat.update(dict.fromkeys(recaller_MASseq.FALSE_SPLIT_STATS, 0))
+
+    for entry_ID, entry_seq, entry_qual in chunk:
+        seg_start = chunk_reads.read_num
+        classifyRead(entry_ID, entry_seq, entry_qual, res_dic, chunk_stat)
+
+        if false_split and (res_dic["deg_true"] or res_dic["noBC_true"]):
+            recaller_MASseq.detectFalseSplit(res_dic["deg_true"] + res_dic["noBC_true"], meta_bundle, res_dic, chunk_stat, rejoin)
+            res_dic["deg_true"].clear()
+            res_dic["noBC_true"].clear()
+
+        chunk_reads.addCCS(chunk_reads.read_num - seg_start)
+
+    # The metrics of the chunk are sent back together with its results, as the metrics of a worker process are not shared.
+    chunk_metrics = None
+    if run_metrics:
+        chunk_metrics = run_metrics.drain()
+        chunk_metrics["worker"] = (os.getpid(), len(chunk), time.perf_counter() - chunk_start)
+
+    return (res_dic, chunk_stat, chunk_metrics)
+
+
+# Read the entries of a FastQ file as (ID, sequence, quality) tuples.
+def readsFromFastq(fq_path):
+    for entry in pysam.FastxFile(fq_path):
+        yield (entry.name, entry.sequence, entry.quality)
+
+
+# Read the CCS reads of a .bam file (or a shard of it) as (ID, sequence, quality) tuples, the pass number is appended to the ID as 'extr_MASseq_<version>.py' does.
+# Reads with a pass number less than 3 and reads without a pass number are filtered out here, and counted in "pn_stat".
+def readsFromBAM(query_iter, lt3_fq, err_sam, pn_stat):
+    for query in query_iter:
+        if not query.has_tag("np"):
+            err_sam.write(f"{query.to_string()}\n")
+
+            print(f"[{getDatetime()}] Sequence entry '{query.query_name}' doesn't have pass number information.")
+            pn_stat["noPN"] += 1
+            continue
+
+        pass_num = query.get_tag("np")
+
+        if pass_num>=3:
+            pn_stat["PNgt3"] += 1
+            yield (f"{query.query_name}|{pass_num}", query.query_sequence, query.query_qualities_str)
+
+        else:
+            lt3_fq.write(f"@{query.query_name}|{pass_num}\n{query.query_sequence}\n+\n{query.query_qualities_str}\n")
+            pn_stat["PNlt3"] += 1
+
+
+# Read and split a shard of the .bam file in a worker process.
+# The filtered reads and the pass number statistics of the shard are sent back together with its results, under the "bam" key.
+def classifyShard(shard):
+    lt3_buf = io.StringIO()
+    err_buf = io.StringIO()
+    shard_pn = dict.fromkeys(["PNgt3", "PNlt3", "noPN"], 0)
+
+    chunk = list(readsFromBAM(pbi_MASseq.readShard(fq_file, shard), lt3_buf, err_buf, shard_pn))
+    res_dic, chunk_stat, chunk_metrics = classifyChunk(chunk)
+    res_dic["bam"] = (lt3_buf.getvalue(), err_buf.getvalue(), shard_pn)
+
+    return (res_dic, chunk_stat, chunk_metrics)
+
+
+# Pack the (ID, sequence, quality) tuples into chunks.
+def chunkReads(read_iter, size):
+    while True:
+        chunk = list(itertools.islice(read_iter, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Time the reading of each chunk as the "read" step, the chunks are read by the reader thread of the pipeline.
+def timedChunks(chunk_iter):
+    while True:
+        read_start = time.perf_counter()
+        chunk = next(chunk_iter, None)
+        if chunk is None:
+            return
+
+        run_metrics.observe("read", time.perf_counter() - read_start)
+        run_metrics.count("chunks_read")
+        yield chunk
+
+
+# Merge the metrics of a chunk, and write a snapshot if it is due.
+def reportMetrics(chunk_metrics):
+    run_metrics.merge(chunk_metrics)
+    run_metrics.workerChunk(*chunk_metrics["worker"])
+    run_metrics.count("chunks_done")
+    run_metrics.count("reads_done", chunk_metrics["worker"][1])
+
+    if run_metrics.due():
+        snapshotMetrics()
+
+
+# The gauges are updated right before a snapshot, the queue depths of the chunks are the ones of the stages of the pipeline.
+def snapshotMetrics():
+    run_metrics.setCounters(stat_dic)
+    if bam_input:
+        run_metrics.setCounters(pn_stat_dic)
+    for queue_name, queue_depth in split_pipe.queueDepths().items():
+        run_metrics.gauge("queue_depth", queue_depth, queue=queue_name)
+    if demux_fmt=="fastq.gz":
+        run_metrics.gauge("queue_depth", sum(demux_handle.pending_blocks for demux_handle in demux_handle_dic.values()), queue="bgzf_blocks")
+    run_metrics.gauge("reads_per_second", run_metrics.counters.get("reads_done", 0) / max(time.time() - run_metrics.start_time, 1e-9))
+    if total_reads is not None:
+        run_metrics.gauge("reads_total", total_reads)
+    run_metrics.snapshot()
+
+
+# Flush the output files, and return their sizes, which are saved in a checkpoint.
+def flushOutputs():
+    offset_dic = {}
+    out_handles = set(out_handle_dic.values()) - {None}
+    if demux_fmt:
+        out_handles.update(demux_handle_dic.values())
+    if bam_shards:
+        out_handles.update([lt3_fq, err_sam])
+
+    for out_handle in out_handles:
+        out_handle.flush()
+        offset_dic[out_handle.name] = os.path.getsize(out_handle.name)
+
+    return offset_dic
+
+
+def workerInit(pool_start):
+    """
+    Report the startup time of a worker process. The pattern bundle is inherited from the main process by "fork", nothing is rebuilt here.
+    """
+    print(f"[{getDatetime()}] Worker {os.getpid()} started in {time.time() - pool_start:.3f}s.", flush=True)
+
+    # The metrics copied from the main process by "fork" are dropped, or they would be merged twice.
+    if run_metrics:
+        run_metrics.drain()
+
+
+# Split the reads of a task of the work queue: a shard of the .bam file, or a range of lines of the .fastq file.
+def classifyTask(task):
+    if "shard" in task:
+        return classifyShard(tuple(task["shard"]))
+
+    return classifyChunk(list(reader_MASseq.fastqEntries(fq_file, *task["range"])))
+
+
+# The results of a task for the coordinator, the task is processed here unless it is claimed by a worker, whose results are waited for.
+def collectTask(task_id):
+    return work_queue.collect(task_id, classifyTask)
+
+
+if run_metrics:
+    if not queue_worker:
+        print(f"[{getDatetime()}] Metrics will be written into {run_metrics.prefix}.json and {run_metrics.prefix}.prom every {run_metrics.interval:g}s.")
+
+
+# ================================= Work Queue Worker ====================================
+# The results of the tasks (including the metrics) are sent to the coordinator through the queue.
+# A worker of several queues restarts itself on the rest of them, as the options of each queue are different. It also restarts on a queue published again.
+if queue_worker:
+    task_num = work_queue.work(classifyTask, wait=len(queue_lis)==1)
+    sys.stdout.flush()
+
+    if work_queue.republished:
+        print(f"[{getDatetime()}] {task_num} tasks done by {work_queue.owner}, the work queue is published again, restarting.", flush=True)
+        os.execv(sys.executable, [sys.executable, sys.argv[0]] + [f"--queue-worker={queue_dir}" for queue_dir in queue_lis])
+    elif len(queue_lis) > 1:
+        print(f"[{getDatetime()}] {task_num} tasks done by {work_queue.owner}, moving on to the work queue {queue_lis[1]}.", flush=True)
+        os.execv(sys.executable, [sys.executable, sys.argv[0]] + [f"--queue-worker={queue_dir}" for queue_dir in queue_lis[1:]])
+
+    print(f"[{getDatetime()}] {task_num} tasks done by {work_queue.owner}, all the tasks of the work queue are done :-)")
+    sys.exit()
 
-    return None
-    
 
 # ================================= Main ====================================
-# Read the converted FastQ file using "pysam", and process by entry. 
-# fq_file_handle = pysam.FastxFile(fq_file)
+# Read the converted FastQ file using "pysam", and process by chunks of entries.
+# With more than one worker, chunks are split in a "fork" process pool, the results are written in the same order as the input.
 stat_dic = {
     "Split_failed": 0,  # CCS reads failed to split.
     "5end_deg": 0,  # Split reads without an intact 5' end.
@@ -210,64 +731,210 @@ stat_dic = {
     "BC_assigned": 0  # Valid split reads.
 }
 
-for entry in pysam.FastxFile(fq_file):
-    entry_ID = entry.name
-    entry_seq = entry.sequence
-    entry_qual = entry.quality
+# The statistics of the valid reads of each sample are merged from the ones of the chunks, and dumped into "<file_name>.sample_stat.json".
+read_stats = readstat_MASseq.ReadStats()
+
+# The recall statistics are the same as the ones in "recall_stat.json" created by 'recall_MASseq_<version>.py'.
+if inline_recall:
+    print(f"[{getDatetime()}] Invalid reads will be recalled inline.")
+    stat_dic.update(dict.fromkeys(recaller_MASseq.RECALL_STATS, 0))
+
+# The false split cases are the same as the ones in "false_split_detect_cases.json" created by 'false_split_detect_<version>.py', they are dumped into their own .json file.
+if false_split:
+    print(f"[{getDatetime()}] False splits will be detected inline{', and rejoined' if rejoin else ''}.")
+    stat_dic.update(dict.fromkeys(recaller_MASseq.FALSE_SPLIT_STATS, 0))
+
+# The statistics are restored from the checkpoint, while the files written by "readsFromBAM" are rewritten, since all the reads are read again.
+# When the .bam file is read by shards, the shards done before the checkpoint are not read again, so these files are continued from the checkpoint as well.
+chunk_num = 0
+
+if resume_point:
+    chunk_num = resume_point["chunks"]
+    stat_dic = resume_point["stats"]["split"]
+    if resume_point["stats"].get("samples"):
+        read_stats.merge(resume_point["stats"]["samples"])
+
+if bam_input:
+    print(f"[{getDatetime()}] Splitting CCS reads directly from the .bam file: {fq_file}")
+    pn_stat_dic = {
+        "PNgt3": 0,
+        "PNlt3": 0,
+        "noPN": 0
+    }
+
+    if bam_shards:
+        lt3_fq = openOutput(lt3_name)
+        err_sam = openOutput(err_sam_name)
+        if resume_point:
+            pn_stat_dic = resume_point["stats"]["pn"]
+    else:
+        lt3_fq = open(lt3_name, "w", buffering=pipeline_MASseq.WRITE_BUFFER)
+        err_sam = open(err_sam_name, "w", buffering=pipeline_MASseq.WRITE_BUFFER)
+        read_iter = readsFromBAM(pysam.AlignmentFile(fq_file, "rb", check_sq=False), lt3_fq, err_sam, pn_stat_dic)
+else:
+    read_iter = readsFromFastq(fq_file)
 
-    lisP = seqSigFWD(entry_seq, entry_qual)
+progress_log = None
+if total_reads is not None:
+    progress_log = pbi_MASseq.ProgressLog(total_reads, sum(pn_stat_dic.values()))
 
-    if lisP:
-        entry_seqP, entry_qualP = lisP
+# The chunks done before the checkpoint are read, but not split again, while the shards done before the checkpoint are skipped.
+# With a work queue, the chunks are published as tasks at first, and the results of the tasks are collected in their order.
+if work_queue:
+    if bam_shards:
+        task_lis = [{"shard": shard} for shard in pbi_MASseq.bamShards(pbi_MASseq.loadIndex(fq_file), chunk_size)]
     else:
-        fq_err.write(f"{entry_ID}|Error\t{entry_seq}\t{entry_qual}\n")
-        stat_dic["Split_failed"] += 1
-        continue
+        task_lis = [{"range": line_range} for line_range in reader_MASseq.lineRanges(fq_file, 4 * chunk_size)]
 
-    sp_lis = splitPrim(entry_ID, entry_seqP, entry_qualP)
-    for seq in sp_lis:
-        ch_res = checkIntactSigF(seq)
-        if ch_res:
-            saa_res = adapterAssign(ch_res[1], pattern_basic)
+    work_queue.publish("split", sys.argv[1:], projWD, task_lis, chunk_num)
+    print(f"[{getDatetime()}] {len(task_lis)} tasks published to the work queue {work_queue.queue_dir}, {chunk_num} of them were done.")
+    chunk_iter = iter(range(chunk_num, len(task_lis)))
+elif bam_shards:
+    chunk_iter = iter(pbi_MASseq.bamShards(pbi_MASseq.loadIndex(fq_file), chunk_size)[chunk_num:])
+else:
+    chunk_iter = itertools.islice(chunkReads(read_iter, chunk_size), chunk_num, None)
+if run_metrics:
+    chunk_iter = timedChunks(chunk_iter)
+
+# Write the results of a chunk, called by the writer thread of the pipeline in the order of the chunks.
+def writeChunk(chunk_res):
+    global chunk_num
+    res_dic, chunk_stat, chunk_metrics = chunk_res
+
+    # The valid reads and the leftovers of the recall rules are collected as segments, which are formatted into lines (or records) here.
+    for out_key in out_handle_dic.keys():
+        if out_key in recaller_MASseq.SEGMENT_OUTPUTS:
+            out_handle_dic[out_key].writelines(segment_MASseq.segmentLines(res_dic[out_key]))
+        else:
+            out_handle_dic[out_key].writelines(res_dic[out_key])
+    for stat_key in chunk_stat.keys():
+        stat_dic[stat_key] += chunk_stat[stat_key]
+    read_stats.merge(res_dic["read_stats"].state())
+    if demux_fmt:
+        for bc, rec_lis in res_dic["demux"].items():
+            demux_handle_dic[bc].writelines(segment_MASseq.fastqRecords(rec_lis))
+    elif ubam:
+        for bc, rec_lis in res_dic["demux"].items():
+            ubam_writer.writeRecords(bc, rec_lis)
+    if bam_shards:
+        lt3_fq.write(res_dic["bam"][0])
+        err_sam.write(res_dic["bam"][1])
+        for stat_key, stat_value in res_dic["bam"][2].items():
+            pn_stat_dic[stat_key] += stat_value
+
+    # An unaligned .bam file can not be continued, so no checkpoint is saved with "--ubam".
+    chunk_num += 1
+    if (not ubam) and split_man.checkpointDue():
+        split_man.saveCheckpoint(chunk_num, flushOutputs(), {"split": stat_dic, "samples": read_stats.state(), "pn": pn_stat_dic if bam_shards else None})
+        if work_queue:
+            work_queue.markWritten(chunk_num)
+    elif ubam and work_queue:
+        work_queue.markWritten(chunk_num)
+
+    # The reads of the .bam file are counted as they are read, which are a little ahead of the reads split.
+    if progress_log:
+        progress_log.update(sum(pn_stat_dic.values()))
+
+    if run_metrics:
+        reportMetrics(chunk_metrics)
+
+
+# The chunks are read by the reader thread of the pipeline, split in the main process or by the worker processes, and written by its writer thread.
+if work_queue:
+    chunk_func = collectTask
+elif bam_shards:
+    chunk_func = classifyShard
+else:
+    chunk_func = classifyChunk
 
-            if saa_res:
-                bca_ID = f"{ch_res[0]}|{saa_res[0]}"
-                bca_seq = ch_res[1][:saa_res[-1]]
-                bca_qual = ch_res[-1][:saa_res[-1]]
+split_pipe = pipeline_MASseq.Pipeline(chunk_func, writeChunk, worker_num, pool_init=(workerInit, (time.time(),)), run_metrics=run_metrics)
 
-                matchUMI = regex.split("(^[ATCG]{8,12})(ATGGG){s<=1}", bca_seq, 1)
+if worker_num > 1:
+    print(f"[{getDatetime()}] Splitting CCS reads with {worker_num} worker processes, {chunk_size} reads per chunk.")
+    if bam_shards:
+        print(f"[{getDatetime()}] The .bam file is read by shards in the worker processes.")
 
-                if len(matchUMI)==4:
-                    out_ID = f"{bca_ID}|{matchUMI[1]}"
-                    out_seq = matchUMI[-1]
-                    out_qual = bca_qual[-len(out_seq):]
+split_pipe.run(chunk_iter)
 
-                    fq_bca.write(f"{out_ID}\t{out_seq}\t{out_qual}\n")
-                    stat_dic["BC_assigned"] += 1
+# The workers exit as soon as the queue is finished.
+if work_queue:
+    work_queue.markWritten(chunk_num, finished=True)
 
-                else:
-                    fq_noUMI.write(f"{bca_ID}|noUMI\t{bca_seq}\t{bca_qual}\n")
-                    stat_dic["No_UMI"] += 1
-        
-            else:
-                fq_noBC.write(f"{ch_res[0]}|noBC\t{ch_res[1]}\t{ch_res[-1]}\n")
-                stat_dic["No_BC"] += 1
+output_lis = [out_handle.name for out_handle in set(out_handle_dic.values()) - {None}]
 
-        else:
-            fq_deg.write(f"{seq[0]}|Degraded\t{seq[1]}\t{seq[-1]}\n")
-            stat_dic["5end_deg"]
+for out_handle in set(out_handle_dic.values()) - {None}:
+    out_handle.close()
+
+if demux_fmt:
+    for demux_handle in demux_handle_dic.values():
+        demux_handle.close()
+    if demux_pool:
+        demux_pool.shutdown()
+
+    output_lis.extend(demux_handle.name for demux_handle in demux_handle_dic.values())
+    print(f"[{getDatetime()}] Valid reads written into the files of their samples: {demux_prefix}<sample_name>.{demux_fmt}")
 
-fq_bca.close()
-fq_err.close()
-fq_deg.close()
-fq_noBC.close()
-fq_noUMI.close()
+if ubam:
+    ubam_writer.close()
+    output_lis.append(ubam_name)
+    print(f"[{getDatetime()}] Valid reads written into the unaligned .bam file: {ubam_name}")
 
-print(f"[{getDatetime()}] All sequences sucessfully extracted :-)\nResult file: {bca_file}.")
+# The number of valid reads of each sample, the same as "sample_reads.stat" created by 'convert_tsv2fqgz_<version>.py'.
+if demux_fmt or ubam:
+    stat_dic["Sample_reads"] = {meta_bundle.sample_dic[bc]: read_stats.reads(bc) for bc in meta_bundle.used_bc}
+
+if progress_log:
+    progress_log.update(sum(pn_stat_dic.values()), force=True)
+
+if bam_input:
+    lt3_fq.close()
+    err_sam.close()
+
+    with open(pn_json_name, "w") as jf:
+        json.dump(pn_stat_dic, jf, indent=4)
+
+    output_lis.extend([lt3_name, err_sam_name, pn_json_name])
+
+    print(f"[{getDatetime()}] Pass number statistics: {pn_json_name}.")
+
+print(f"[{getDatetime()}] All sequences sucessfully extracted :-)\nResult file: {f'{demux_prefix}<sample_name>.{demux_fmt}' if demux_fmt else (ubam_name if ubam else bca_file)}.")
 
 
 # Dump statistic information into a .json file.
+if false_split:
+    fs_stat_dic = {key: stat_dic.pop(key) for key in recaller_MASseq.FALSE_SPLIT_STATS}
+    if not rejoin:
+        del fs_stat_dic["Rejoined"]
+
+    with open(fs_json_name, "w") as jf:
+        json.dump(fs_stat_dic, jf, indent=4)
+
+    output_lis.append(fs_json_name)
+
+    print(f"[{getDatetime()}] False split cases: {fs_json_name}.")
+
 with open(json_name, "w") as jf:
     json.dump(stat_dic, jf, indent=4)
 
-print(f"[{getDatetime()}] Json file: {json_name}.")
\ No newline at end of file
+print(f"[{getDatetime()}] Json file: {json_name}.")
+
+read_stats.dump(sample_json_name, meta_bundle.sample_dic)
+print(f"[{getDatetime()}] Statistics of the valid reads of each sample: {sample_json_name}, {read_stats.state()['mean_segments_per_CCS']} valid reads per CCS read.")
+
+# The summary of the project is merged from the statistics of the split and the recall, which is updated by both of them.
+if "-p" in optdict.keys():
+    readstat_MASseq.mergeFiles(sorted(glob.glob(f"{projWD}/valid/*.sample_stat.json"))).dump(f"{projWD}/sample_summary.json", meta_bundle.sample_dic)
+    print(f"[{getDatetime()}] Summary of the project: {projWD}/sample_summary.json.")
+
+# The manifest is completed at last, so that a run stopped before here is never skipped.
+output_lis.extend([json_name, sample_json_name])
+split_man.complete(output_lis, stat_dic)
+
+print(f"[{getDatetime()}] Manifest: {manifest_name}.")
+
+# The false split cases were moved out of "stat_dic" into their own .json file.
+if run_metrics:
+    if false_split:
+        run_metrics.setCounters(fs_stat_dic)
+    snapshotMetrics()
+    print(f"[{getDatetime()}] Metrics: {run_metrics.prefix}.json, {run_metrics.prefix}.prom.")
\ No newline at end of file
@@ -0,0 +1,76 @@
+# Author: JIA Zheng
+# This is the module to write valid reads into an unaligned .bam file, with their provenance stored in typed tags instead of the "|"-joined read ID.
+# The .bam file is compressed by "pysam" (htslib) with multiple threads, and can be used by long-read tools (e.g. "pbmm2", "minimap2" with "samtools fastq") directly.
+# Current version: 1.0-beta
+
+# Third party packages:
+import pysam
+
+
+# The tags of a valid read:
+#   RG:Z  the sample name, a read group is created for each sample;
+#   BC:Z  the sequence of the 3' adapter barcode;
+#   bi:Z  the ID of the 3' adapter barcode, e.g. "BC1";
+#   RX:Z  the UMI sequence;
+#   np:i  the pass number of the CCS read, as the one in PacBio .bam files;
+#   si:i  the index of the split read in its CCS read, the first one for a rejoined false split;
+#   sn:i  the number of split reads joined into this read, 1 unless it is a rejoined false split.
+# The read is named "<CCS_read_name>/<split_index>", e.g. "m84xxx/123/ccs/2" or "m84xxx/123/ccs/3-4" for a rejoined false split.
+
+
+# ================================= Unaligned BAM Writer ====================================
+class UBAMWriter:
+    """
+    The writer of an unaligned .bam file of valid reads, the records are the valid reads of each barcode as "segment_MASseq.Segment".
+    The tags are set from the fields of the segments directly, the "|"-joined ID of a valid read is never formatted.
+
+    Attributes:
+      read_num (int): the number of reads written.
+    """
+
+    def __init__(self, file_name, bundle, threads=4, program="split_MASseq"):
+        self.bc_seq_dic = {bc: bundle.meta_inf["AdapterBC"][bc] for bc in bundle.used_bc}
+        self.sample_dic = bundle.sample_dic
+        self.read_num = 0
+
+        rg_lis = []
+        for bc in bundle.used_bc:
+            rg_lis.append({"ID": bundle.sample_dic[bc], "SM": bundle.sample_dic[bc], "BC": self.bc_seq_dic[bc]})
+
+        self.header = pysam.AlignmentHeader.from_dict({
+            "HD": {"VN": "1.6", "SO": "unknown"},
+            "RG": rg_lis,
+            "PG": [{"ID": program, "PN": program, "VN": "1.0b"}]
+        })
+        self._handle = pysam.AlignmentFile(file_name, "wb", header=self.header, threads=threads)
+
+    def writeRecords(self, bc, seg_lis):
+        for val in seg_lis:
+            split_ind = f"{val.seq_num}-{val.seq_num + val.join_num - 1}" if val.join_num > 1 else val.seq_num
+
+            rec = pysam.AlignedSegment(self.header)
+            rec.query_name = f"{val.ccs_id}/{split_ind}"
+            rec.flag = 4
+            if val.seq:
+                rec.query_sequence = val.seq
+                rec.query_qualities = pysam.qualitystring_to_array(val.qual)
+
+            tag_lis = [
+                ("RG", self.sample_dic[bc], "Z"),
+                ("BC", self.bc_seq_dic[bc], "Z"),
+                ("bi", bc, "Z"),
+                ("RX", val.umi, "Z")
+            ]
+            if isinstance(val.pass_num, int):
+                tag_lis.append(("np", val.pass_num, "i"))
+
+            tag_lis.append(("si", int(val.seq_num), "i"))
+            tag_lis.append(("sn", val.join_num, "i"))
+
+            rec.set_tags(tag_lis)
+            self._handle.write(rec)
+
+        self.read_num += len(seg_lis)
+
+    def close(self):
+        self._handle.close()
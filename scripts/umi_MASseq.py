@@ -0,0 +1,110 @@
+# Author: JIA Zheng
+# This is the module to collapse the valid reads of a sample into molecules by their UMIs, for 'dedup_MASseq_<version>.py'.
+# The UMIs are clustered within one mismatch by looking up their Hamming neighbors in a hash table of the UMI counts, instead of comparing all the pairs of UMIs.
+# The reads of a sample are spilled into partition files by their molecules, so that only the reads of one partition are held in the memory at a time.
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import os
+import zlib
+
+
+# ================================= Defining Functions ====================================
+# To get the UMI of a valid read from its ID "<read_name>|<pass_number>|<split_index>|<barcode>|<UMI>".
+# Return: (barcode, UMI).
+def readUMI(read_ID):
+    id_lis = read_ID.rsplit("|", 2)
+    return (id_lis[-2], id_lis[-1])
+
+
+# To get all the sequences one substitution away from a UMI.
+def hammingNeighbors(umi, alphabet="ACGTN"):
+    return [umi[:i] + b + umi[i+1:] for i in range(len(umi)) for b in alphabet if b!=umi[i]]
+
+
+# The mean base quality of a read, the reads of a molecule with the best one is chosen as its representative.
+def meanQuality(qual):
+    return sum(qual.encode()) / max(len(qual), 1) - 33
+
+
+# ================================= UMI Clusters ====================================
+class UMIClusters:
+    """
+    Cluster the UMIs of a sample within one mismatch ("directional" clustering).
+    The UMIs are visited from the most abundant one, each unvisited UMI starts a molecule, which takes in its neighbors one mismatch away
+    with at most about half of its count (count <= (head_count + 1) / 2), and their neighbors in the same way.
+    A neighbor with a similar count is kept as a molecule of its own, as it is more likely to be another molecule than an error of the UMI.
+
+    Attributes:
+      counts (dict): the UMIs as keys and their numbers of reads as values.
+      heads (dict): the UMIs as keys and the UMIs of their molecules (the most abundant UMIs of the clusters) as values.
+      molecule_num (int): the number of molecules.
+    """
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.heads = {}
+
+        for umi in sorted(counts.keys(), key=lambda umi: (-counts[umi], umi)):
+            if umi in self.heads:
+                continue
+
+            self.heads[umi] = umi
+            queue = [umi]
+            while queue:
+                curr_umi = queue.pop()
+                for nb in hammingNeighbors(curr_umi):
+                    if nb in counts and nb not in self.heads and 2 * counts[nb] - 1 <= counts[curr_umi]:
+                        self.heads[nb] = umi
+                        queue.append(nb)
+
+        self.molecule_num = sum(1 for umi, head in self.heads.items() if umi==head)
+
+
+# ================================= Partition Spill Files ====================================
+class PartitionSpill:
+    """
+    Spill the reads of a sample into "part_num" partition files by their molecules, one line "<molecule_UMI>\t<ID>\t<sequence>\t<quality>" for each read.
+    All the reads of a molecule are in the same partition, which is chosen by the CRC32 of its UMI, so the partitions are the same in every run.
+
+    Attributes:
+      prefix (str): the prefix of the partition files "<prefix>.<N>.tsv".
+      part_num (int): the number of partitions.
+    """
+
+    def __init__(self, prefix, part_num):
+        self.prefix = prefix
+        self.part_num = part_num
+        self.file_names = [f"{prefix}.{i}.tsv" for i in range(part_num)]
+        self._handles = [open(file_name, "w", buffering=1024**2) for file_name in self.file_names]
+
+    def write(self, head, read_ID, seq, qual):
+        self._handles[zlib.crc32(head.encode()) % self.part_num].write(f"{head}\t{read_ID}\t{seq}\t{qual}\n")
+
+    def close(self):
+        for part_handle in self._handles:
+            part_handle.close()
+
+    # Collapse the reads of each partition into molecules, and remove the partition files.
+    # Yield: (ID, sequence, quality, number of reads) of the representative read of each molecule, in the order the molecules are first seen in each partition.
+    def molecules(self):
+        for file_name in self.file_names:
+            mol_dic = {}
+            with open(file_name) as part_handle:
+                for line in part_handle:
+                    head, read_ID, seq, qual = line.rstrip("\n").split("\t")
+                    read_qual = meanQuality(qual)
+
+                    mol = mol_dic.get(head)
+                    if mol is None:
+                        mol_dic[head] = [read_ID, seq, qual, 1, read_qual]
+                        continue
+
+                    # The read with the best mean quality is the representative, the longer one if they are the same.
+                    mol[3] += 1
+                    if (read_qual, len(seq)) > (mol[4], len(mol[1])):
+                        mol[0], mol[1], mol[2], mol[4] = read_ID, seq, qual, read_qual
+
+            os.remove(file_name)
+            for read_ID, seq, qual, read_num, read_qual in mol_dic.values():
+                yield (read_ID, seq, qual, read_num)
@@ -0,0 +1,323 @@
+# Author: JIA Zheng
+# This is the module to share the chunks of a stage between the machines of a cluster, through a work queue in a directory of a shared file system.
+# The coordinator (the run writing the outputs) publishes the chunks as tasks, the workers on any machine claim a task by creating its lease file,
+# and commit the results of the task by renaming a result file into "results/". A lease not renewed in time, or held by a dead process on the same machine, is reclaimed.
+# The coordinator takes the results in the order of the tasks, and writes them as its own chunks.
+# Current version: 1.0-beta
+
+# Standard Python libraries:
+import os
+import json
+import time
+import pickle
+import shutil
+import socket
+import threading
+
+
+# A lease is reclaimed if it is not renewed within this time in seconds, it is renewed every quarter of it while its task is processed.
+LEASE_TIMEOUT = 120
+
+# The interval of checking the queue in seconds, while waiting for a task or a result.
+POLL_INTERVAL = 0.5
+
+
+# ================================= Defining Functions ====================================
+def getDatetime():
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+
+def writeAtomic(file_name, text):
+    tmp_name = f"{file_name}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_name, "w") as f:
+        f.write(text)
+    os.replace(tmp_name, file_name)
+
+
+def pidAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+# ================================= Work Queue ====================================
+class WorkQueue:
+    """
+    A work queue in a directory:
+      queue.json       the stage, the command line and the working directory of the coordinator, the tasks, and the key of the publication;
+      progress.json    the number of tasks written by the coordinator, and whether the run is finished;
+      leases/          "<task_id>.lease" for each claimed task, containing its owner "<host>:<pid>";
+      results/         "<task_id>.pkl" for each committed task, the pickled key of the publication and the results of the task.
+
+    Attributes:
+      queue_dir (str): the directory of the queue, which should be on a file system shared by all the machines.
+      owner (str): "<host>:<pid>" of this process.
+      lease_timeout (float): the time in seconds a lease is valid without being renewed.
+      info (dict): the content of "queue.json", None before the tasks are published.
+      republished (bool): whether the tasks were published again while working on them, e.g. by a new run of the coordinator with other options.
+    """
+
+    def __init__(self, queue_dir, lease_timeout=LEASE_TIMEOUT):
+        self.queue_dir = os.path.abspath(queue_dir)
+        self.lease_timeout = lease_timeout
+        self.info = None
+        self.republished = False
+
+        self._lease_dir = os.path.join(self.queue_dir, "leases")
+        self._result_dir = os.path.join(self.queue_dir, "results")
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(os.path.join(self.queue_dir, "queue.json")) as qf:
+                self.info = json.load(qf)
+        except (OSError, ValueError):
+            self.info = None
+
+        return self.info
+
+    # Wait for the coordinator to publish the tasks, a worker can be started before its coordinator.
+    def waitPublished(self):
+        while self.load() is None:
+            time.sleep(POLL_INTERVAL)
+
+        return self.info
+
+    @property
+    def owner(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @property
+    def tasks(self):
+        return self.info["tasks"]
+
+    # Publish the tasks of a stage. The results committed before are kept if the stage, the command line and the tasks are the same as the published ones, e.g. for "--resume",
+    # where the tasks before "written" are already written by the coordinator.
+    # Otherwise the tasks are published with a new key, and a result committed later by a worker of the former publication is ignored.
+    def publish(self, stage, argv, cwd, tasks, written=0):
+        info = json.loads(json.dumps({"stage": stage, "argv": argv, "cwd": cwd, "tasks": tasks}))
+
+        if self.info and info=={key: self.info.get(key) for key in info.keys()}:
+            info["key"] = self.info["key"]
+        else:
+            info["key"] = f"{self.owner}:{time.time()}"
+            shutil.rmtree(self._lease_dir, ignore_errors=True)
+            shutil.rmtree(self._result_dir, ignore_errors=True)
+
+        os.makedirs(self._lease_dir, exist_ok=True)
+        os.makedirs(self._result_dir, exist_ok=True)
+
+        self.info = info
+        writeAtomic(os.path.join(self.queue_dir, "progress.json"), json.dumps({"written": written, "finished": False}))
+        writeAtomic(os.path.join(self.queue_dir, "queue.json"), json.dumps(info))
+
+    def progress(self):
+        try:
+            with open(os.path.join(self.queue_dir, "progress.json")) as pf:
+                return json.load(pf)
+        except (OSError, ValueError):
+            return {"written": 0, "finished": False}
+
+    # The tasks before "task_num" have been written by the coordinator, their results are removed.
+    # The progress is saved at first, so that no worker claims a task again after its results are removed.
+    def markWritten(self, task_num, finished=False):
+        written = self.progress()["written"]
+        writeAtomic(os.path.join(self.queue_dir, "progress.json"), json.dumps({"written": task_num, "finished": finished}))
+
+        for task_id in range(written, task_num):
+            try:
+                os.remove(self._resultFile(task_id))
+            except FileNotFoundError:
+                pass
+
+    def _leaseFile(self, task_id):
+        return os.path.join(self._lease_dir, f"{task_id}.lease")
+
+    def _resultFile(self, task_id):
+        return os.path.join(self._result_dir, f"{task_id}.pkl")
+
+    # The files in "leases/" or "results/", which are removed for a moment while the tasks are published again.
+    def _listDir(self, dir_name):
+        try:
+            return set(os.listdir(dir_name))
+        except FileNotFoundError:
+            return set()
+
+    # Whether a lease is stale: held by a dead process on this machine, or not renewed within the timeout.
+    def _leaseStale(self, lease_file):
+        try:
+            with open(lease_file) as lf:
+                lease_owner = lf.read()
+            lease_age = time.time() - os.path.getmtime(lease_file)
+        except OSError:
+            return None
+
+        lease_host, _, lease_pid = lease_owner.rpartition(":")
+        if lease_host==socket.gethostname() and lease_pid.isdigit() and not pidAlive(int(lease_pid)):
+            return lease_owner
+        if lease_age > self.lease_timeout:
+            return lease_owner
+
+        return None
+
+    # Whether a lease is held by this process, it may have been reclaimed by another process while this one was too slow to renew it.
+    def _ownsLease(self, lease_file):
+        try:
+            with open(lease_file) as lf:
+                return lf.read()==self.owner
+        except OSError:
+            return False
+
+    # Claim a task by creating its lease file, a stale lease is reclaimed by renaming it away at first.
+    # Only one process renames a lease successfully; a fresh lease renamed by mistake (it was replaced after it was read) is linked back.
+    def claim(self, task_id):
+        lease_file = self._leaseFile(task_id)
+
+        try:
+            lease_fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileNotFoundError:
+            return False
+        except FileExistsError:
+            stale_owner = self._leaseStale(lease_file)
+            if stale_owner is None:
+                return False
+
+            stale_file = f"{lease_file}.{socket.gethostname()}.{os.getpid()}.stale"
+            try:
+                os.rename(lease_file, stale_file)
+            except FileNotFoundError:
+                return False
+
+            with open(stale_file) as lf:
+                renamed_owner = lf.read()
+            if renamed_owner!=stale_owner:
+                try:
+                    os.link(stale_file, lease_file)
+                except FileExistsError:
+                    pass
+                os.remove(stale_file)
+                return False
+
+            os.remove(stale_file)
+            print(f"[{getDatetime()}] The lease of task {task_id} held by {stale_owner} is reclaimed.", flush=True)
+            return self.claim(task_id)
+
+        with os.fdopen(lease_fd, "w") as lf:
+            lf.write(self.owner)
+
+        return True
+
+    # Process a claimed task with "task_func", renewing its lease meanwhile, and commit its results.
+    # The results are written into a temporary file and renamed into "results/", a task committed twice has the same results.
+    def process(self, task_id, task_func):
+        lease_file = self._leaseFile(task_id)
+        stop_event = threading.Event()
+
+        # A lease reclaimed by another process is not renewed any more, the task is still finished here and committed with the same results.
+        def renewLease():
+            while not stop_event.wait(self.lease_timeout / 4):
+                if not self._ownsLease(lease_file):
+                    return
+                try:
+                    os.utime(lease_file)
+                except OSError:
+                    return
+
+        renew_thread = threading.Thread(target=renewLease, daemon=True)
+        renew_thread.start()
+        try:
+            task_res = task_func(self.tasks[task_id])
+        finally:
+            stop_event.set()
+            renew_thread.join()
+
+        # The results are dropped if "results/" was removed meanwhile, as the tasks were published again.
+        tmp_name = f"{self._resultFile(task_id)}.{socket.gethostname()}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_name, "wb") as rf:
+                pickle.dump((self.info["key"], task_res), rf, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_name, self._resultFile(task_id))
+        except FileNotFoundError:
+            pass
+
+        # The lease of the new owner is kept, if it was reclaimed meanwhile.
+        if self._ownsLease(lease_file):
+            try:
+                os.remove(lease_file)
+            except FileNotFoundError:
+                pass
+
+        return task_res
+
+    # The results of a committed task, or None if the task isn't committed for the current publication.
+    def result(self, task_id):
+        try:
+            with open(self._resultFile(task_id), "rb") as rf:
+                res_key, task_res = pickle.load(rf)
+        except FileNotFoundError:
+            return None
+
+        return task_res if res_key==self.info["key"] else None
+
+    # The results of a task for the coordinator, the task is processed here if no other process holds it, or waited for.
+    def collect(self, task_id, task_func):
+        while True:
+            task_res = self.result(task_id)
+            if task_res is not None:
+                return task_res
+
+            if self.claim(task_id):
+                return self.process(task_id, task_func)
+
+            time.sleep(POLL_INTERVAL)
+
+    # Claim the first task not written, committed or held by another process. Return None if there isn't one now.
+    def nextTask(self):
+        written = self.progress()["written"]
+        result_set = self._listDir(self._result_dir)
+        lease_set = self._listDir(self._lease_dir)
+
+        for task_id in range(written, len(self.tasks)):
+            if f"{task_id}.pkl" in result_set:
+                continue
+            if f"{task_id}.lease" in lease_set and self._leaseStale(self._leaseFile(task_id)) is None:
+                continue
+            if self.claim(task_id):
+                return task_id
+
+        return None
+
+    # Process tasks until the coordinator finishes, or all the tasks are committed. Return the number of tasks processed here.
+    # Without "wait", return as soon as there isn't any task to claim, e.g. to move on to the work queue of another run.
+    # Return as well if the tasks are published again, the worker should be restarted with the new command line.
+    def work(self, task_func, wait=True):
+        task_num = 0
+        queue_key = self.info["key"]
+
+        while True:
+            if self.load() is None or self.info["key"]!=queue_key:
+                self.republished = True
+                return task_num
+
+            task_id = self.nextTask()
+            if task_id is not None:
+                self.process(task_id, task_func)
+                task_num += 1
+                print(f"[{getDatetime()}] Task {task_id} committed by {self.owner}, {task_num} tasks done.", flush=True)
+                continue
+
+            if not wait:
+                return task_num
+
+            queue_progress = self.progress()
+            result_set = self._listDir(self._result_dir)
+            if queue_progress["finished"] or all(f"{task_id}.pkl" in result_set for task_id in range(queue_progress["written"], len(self.tasks))):
+                return task_num
+
+            time.sleep(POLL_INTERVAL)
@@ -0,0 +1,22 @@
+# Author: JIA Zheng
+# The shared settings of the tests of the modules in "scripts/", which are imported the same as the scripts import them.
+# Run the tests under the root of this repository: python -m pytest -q tests/
+
+# Standard Python libraries:
+import os
+import sys
+import json
+
+# Third party packages:
+import pytest
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "scripts"))
+
+
+# The meta information of the example project, with all the barcodes in "AdapterBC".
+@pytest.fixture(scope="session")
+def meta_inf():
+    with open(os.path.join(REPO_DIR, "proj_meta.json")) as metaf:
+        return json.load(metaf)
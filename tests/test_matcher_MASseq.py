@@ -0,0 +1,216 @@
+# Author: JIA Zheng
+# The tests of "matcher_MASseq": the spans of the signature matchers against the "regex" fuzzy patterns they replace,
+# and the barcodes assigned by "BarcodeIndex" against the former "adapterAssign" functions.
+
+# Standard Python libraries:
+import random
+
+# Third party packages:
+import regex
+import pytest
+
+# Modules in the same directory:
+import matcher_MASseq
+
+
+SIG_CASES = [
+    (matcher_MASseq.SigF, 2),
+    (matcher_MASseq.SigRc, 2),
+    (matcher_MASseq.SigF_comp, 2),
+    (matcher_MASseq.SigRc_comp, 2),
+    (matcher_MASseq.SplitSig, 3),
+]
+
+
+# ================================= Defining Functions ====================================
+def randSeq(rng, seq_len):
+    return "".join(rng.choice("ACGT") for _ in range(seq_len))
+
+
+# Add substitutions (including "N"), insertions and deletions to a sequence at the given rate.
+def mutateRate(rng, seq, rate):
+    out_lis = []
+    for base in seq:
+        x = rng.random()
+        if x < rate/3:
+            continue
+        elif x < 2*rate/3:
+            out_lis.append(rng.choice("ACGTN"))
+        elif x < rate:
+            out_lis.append(base)
+            out_lis.append(rng.choice("ACGT"))
+        else:
+            out_lis.append(base)
+
+    return "".join(out_lis)
+
+
+# Add a number of edits to a sequence.
+def mutateNum(rng, seq, edit_num):
+    seq_lis = list(seq)
+    for _ in range(edit_num):
+        x = rng.random()
+        i = rng.randrange(len(seq_lis))
+        if x < 1/3:
+            seq_lis[i] = rng.choice("ACGT")
+        elif x < 2/3:
+            del seq_lis[i]
+        else:
+            seq_lis.insert(i, rng.choice("ACGT"))
+
+    return "".join(seq_lis)
+
+
+# Random sequences with mutated signatures in them, including short ones (shorter than the signatures) and empty ones.
+def sigSequences(rng, seq_num):
+    for i in range(seq_num):
+        if i % 2:
+            seq = randSeq(rng, rng.randint(0, 60))
+            sig_num = rng.randint(0, 6)
+        else:
+            seq = randSeq(rng, rng.randint(0, 20))
+            sig_num = rng.randint(0, 1)
+
+        for _ in range(sig_num):
+            seq += mutateRate(rng, rng.choice(SIG_CASES)[0], rng.choice([0.05, 0.1, 0.2])) + randSeq(rng, rng.randint(0, 80))
+
+        yield seq
+
+
+def spans(hit_iter):
+    return [hit.span() for hit in hit_iter]
+
+
+# The former barcode assignment of 'split_MASseq_<version>.py' and 'recall_MASseq_<version>.py': the first barcode with a hit in the last 25 nt wins.
+def adapterAssign(seq, pdic):
+    for bc in pdic.keys():
+        bc_hit = regex.search(pdic[bc], seq[-25:])
+        if bc_hit:
+            return (bc, bc_hit.span()[0]-25)
+
+    return None
+
+
+# The former barcode assignment of the recall and the false split detection in a whole read.
+def adapterAssign4Recall(seq, pdic):
+    for bc in pdic.keys():
+        bc_hit = regex.search(pdic[bc], seq)
+        if bc_hit:
+            return (bc, bc_hit.span()[0])
+
+    return None
+
+
+# The barcodes with a hit of the former patterns in a sequence.
+def hitBarcodes(seq, pdic):
+    return [bc for bc in pdic.keys() if regex.search(pdic[bc], seq)]
+
+
+@pytest.fixture(scope="module")
+def bc_setting(meta_inf):
+    bc_dic = meta_inf["AdapterBC"]
+    pdic = {bc: regex.compile("(?e)(" + bc_seq + "){e<=2}") for bc, bc_seq in bc_dic.items()}
+    return (bc_dic, matcher_MASseq.BarcodeIndex(bc_dic, 2), pdic)
+
+
+# ================================= Signature Matchers ====================================
+@pytest.mark.parametrize("sig, max_err", SIG_CASES)
+def test_myers_same_as_regex(sig, max_err):
+    rng = random.Random(5)
+    myers = matcher_MASseq.MyersPattern(sig, max_err)
+    pattern = regex.compile(f"(?e)({sig}){{e<={max_err}}}")
+
+    for seq in sigSequences(rng, 400):
+        # "endpos" can be beyond the end of the sequence, e.g. the first 50 nt of a short split read.
+        pos = rng.randint(0, 10)
+        endpos = len(seq) + rng.randint(-10, 60)
+
+        assert spans(myers.finditer(seq, pos, endpos)) == spans(pattern.finditer(seq, pos, endpos))
+
+        regex_hit = pattern.search(seq, pos, endpos)
+        myers_hit = myers.search(seq, pos, endpos)
+        assert (myers_hit and myers_hit.span()) == (regex_hit and regex_hit.span())
+
+
+def test_myers_short_segment():
+    myers = matcher_MASseq.sigF_5end_matcher
+    pattern = regex.compile(f"(?e)({matcher_MASseq.SigF[1:]}){{e<=2}}")
+
+    for seq in ("", "A", matcher_MASseq.SigF[1:10], matcher_MASseq.SigF[1:], matcher_MASseq.SigF + "ACGT"):
+        regex_hit = pattern.search(seq, 0, 50)
+        myers_hit = myers.search(seq, 0, 50)
+        assert (myers_hit and myers_hit.span()) == (regex_hit and regex_hit.span())
+
+
+@pytest.mark.parametrize("sig, max_err", SIG_CASES)
+def test_anchor_same_as_regex(sig, max_err):
+    rng = random.Random(7)
+    anchor = matcher_MASseq.AnchorPattern(sig, max_err)
+    pattern = regex.compile(f"(?e)({sig}){{e<={max_err}}}")
+
+    for seq in sigSequences(rng, 400):
+        assert spans(anchor.finditer(seq)) == spans(pattern.finditer(seq))
+
+        regex_hit = pattern.search(seq)
+        anchor_hit = anchor.search(seq)
+        assert (anchor_hit and anchor_hit.span()) == (regex_hit and regex_hit.span())
+
+
+# A sequence without any exact seed of a signature has no hit of it.
+def test_anchor_no_seed_no_hit():
+    rng = random.Random(3)
+    anchor_lis = [matcher_MASseq.AnchorPattern(sig, max_err) for sig, max_err in SIG_CASES]
+
+    for _ in range(200):
+        seq = randSeq(rng, rng.randint(0, 300))
+        for anchor in anchor_lis:
+            if not anchor.windows(seq):
+                assert not anchor.matcher.search(seq)
+
+
+# ================================= Barcode Index ====================================
+# Tails with one mutated barcode, where only one barcode has a hit of the former patterns, are assigned the same barcode at the same position.
+def test_assign_tail_same_as_adapter_assign(bc_setting):
+    bc_dic, bc_index, pdic = bc_setting
+    rng = random.Random(11)
+    compared = 0
+
+    for _ in range(1500):
+        bc = rng.choice(list(bc_dic))
+        seq = randSeq(rng, rng.randint(5, 40)) + mutateNum(rng, bc_dic[bc], rng.randint(0, 2)) + randSeq(rng, rng.randint(0, 6))
+        if len(hitBarcodes(seq[-25:], pdic))!=1:
+            continue
+
+        compared += 1
+        assert bc_index.assignTail(seq, 25) == adapterAssign(seq, pdic)
+
+    assert compared > 1250
+
+
+def test_assign_read_same_as_adapter_assign(bc_setting):
+    bc_dic, bc_index, pdic = bc_setting
+    rng = random.Random(13)
+    compared = 0
+
+    for _ in range(120):
+        bc = rng.choice(list(bc_dic))
+        seq = randSeq(rng, rng.randint(50, 600)) + mutateNum(rng, bc_dic[bc], rng.randint(0, 2)) + randSeq(rng, rng.randint(0, 300))
+        if len(hitBarcodes(seq, pdic))!=1:
+            continue
+
+        compared += 1
+        assert bc_index.assignRead(seq) == adapterAssign4Recall(seq, pdic)
+
+    assert compared > 100
+
+
+# The first (leftmost) barcode region wins, whatever the order of the barcodes.
+def test_assign_leftmost_region(bc_setting):
+    bc_dic, bc_index, pdic = bc_setting
+    rng = random.Random(17)
+    flank = randSeq(rng, 80)
+    seq = flank[:30] + bc_dic["BC15"] + flank[30:] + bc_dic["BC1"] + flank[:20]
+
+    assert bc_index.assignRead(seq) == ("BC15", 30)
+    assert matcher_MASseq.BarcodeIndex(dict(reversed(bc_dic.items())), 2).assignRead(seq) == ("BC15", 30)
+    assert bc_index.assignTail(flank[:9] + bc_dic["BC2"], 25) == ("BC2", -16)
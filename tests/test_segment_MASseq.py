@@ -0,0 +1,104 @@
+# Author: JIA Zheng
+# The tests of "segment_MASseq": the lines of the .tsv files are parsed into segments and formatted back the same.
+
+# Third party packages:
+import pytest
+
+# Modules in the same directory:
+from segment_MASseq import Segment, Status, segmentLines, fastqRecords
+
+
+# ================================= Round Trips ====================================
+@pytest.mark.parametrize("line, status, seq_num", [
+    ("m84008_230101_000000_s1/101/ccs|12|3|Degraded\tACGTACGT\tIIIIIIII\n", Status.DEGRADED, 3),
+    ("m84008_230101_000000_s1/101/ccs|12|0|noBC\tACGT\tI!I!\n", Status.NO_BC, 0),
+    ("m84008_230101_000000_s1/101/ccs|12|5|noUMI\tACGT\tIIII\n", Status.NO_UMI, 5),
+    ("m84008_230101_000000_s1/101/ccs|12|Error\tACGTACGT\tIIIIIIII\n", Status.ERROR, None),
+])
+def test_line_round_trip(line, status, seq_num):
+    seg = Segment.fromLine(line)
+
+    assert seg.ccs_id == "m84008_230101_000000_s1/101/ccs"
+    assert seg.pass_num == 12
+    assert seg.seq_num == seq_num
+    assert seg.status is status
+    assert seg.raw is None
+    assert seg.line() == line
+
+
+def test_false_split_round_trip():
+    line = "m84008/7/ccs|5|4|BC12_falseSplit\tACGTTT\tIIIIII\n"
+    seg = Segment.fromLine(line)
+
+    assert seg.status is Status.FALSE_SPLIT
+    assert seg.bc == "BC12"
+    assert seg.line() == line
+
+
+def test_mark_false_split():
+    seg = Segment.fromLine("m84008/7/ccs|5|4|Degraded\tACGTTT\tIIIIII\n")
+    seg.markFalseSplit("BC3")
+
+    assert seg.line() == "m84008/7/ccs|5|4|BC3_falseSplit\tACGTTT\tIIIIII\n"
+
+
+# Lines that can't be formatted back the same are kept as they are: without a sequence, with more than three fields, or with an unknown suffix.
+@pytest.mark.parametrize("line", [
+    "m84008/7/ccs|5|4|noBC\n",
+    "m84008/7/ccs|5|4|noBC\t\n",
+    "m84008/7/ccs|5|4|noBC\tACGT\tIIII\textra\n",
+    "m84008/7/ccs|5|4|unknown\tACGT\tIIII\n",
+])
+def test_raw_line_kept(line):
+    seg = Segment.fromLine(line)
+
+    assert seg.raw == line
+    assert seg.line() == line
+    assert segmentLines([seg]) == [line]
+
+
+# The numbers of an ID with leading zeros are kept as strings, so the ID is formatted back the same without a raw line.
+def test_leading_zero_kept():
+    line = "m84008/7/ccs|05|007|Degraded\tACGT\tIIII\n"
+    seg = Segment.fromLine(line)
+
+    assert seg.pass_num == "05"
+    assert seg.seq_num == "007"
+    assert seg.raw is None
+    assert seg.line() == line
+
+
+# The last line of a file without a line break gets one, so that the lines written after it are not joined to it.
+def test_last_line_break():
+    seg = Segment.fromLine("m84008/7/ccs|5|4|Degraded\tACGT\tIIII")
+
+    assert seg.raw is None
+    assert seg.line() == "m84008/7/ccs|5|4|Degraded\tACGT\tIIII\n"
+
+
+def test_line_with_status():
+    seg = Segment.fromLine("m84008/7/ccs|5|4|Degraded\tACGT\tIIII\n")
+
+    assert seg.line(Status.NO_BC) == "m84008/7/ccs|5|4|noBC\tACGT\tIIII\n"
+
+
+# ================================= Child Segments ====================================
+def test_child_and_valid():
+    ccs = Segment.fromReadID("m84008/7/ccs|5", "AAAACCCCGGGGTTTT", "ABCDEFGHIJKLMNOP")
+    seg = ccs.child(2, 4, 16).cut(2)
+
+    assert (seg.ID, seg.seq, seg.start, seg.end) == ("m84008/7/ccs|5|2", "CCGGGGTTTT", 6, 16)
+
+    val = seg.valid("BC1", "CCGG", 4, 10)
+    assert (val.seq, val.qual, val.start, val.end) == ("GGTTTT", "KLMNOP", 10, 16)
+    assert val.line() == "m84008/7/ccs|5|2|BC1|CCGG\tGGTTTT\tKLMNOP\n"
+    assert fastqRecords([val]) == ["@m84008/7/ccs|5|2|BC1|CCGG\nGGTTTT\n+\nKLMNOP\n"]
+
+
+def test_rejoined_id():
+    val = Segment("m84008/7/ccs", 5, 3, "ACGT", "IIII", status=Status.VALID)
+    val.bc = "BC2"
+    val.umi = "ACGTACGT"
+    val.join_num = 2
+
+    assert val.line() == "m84008/7/ccs|5|3-4|BC2|ACGTACGT\tACGT\tIIII\n"
@@ -0,0 +1,111 @@
+# Author: JIA Zheng
+# The tests of "workqueue_MASseq": the leases of the tasks claimed by two processes on this machine.
+
+# Standard Python libraries:
+import os
+import time
+import multiprocessing
+
+# Modules in the same directory:
+import workqueue_MASseq
+
+
+# The processes are forked, so that they share the imported modules, and each of them is an owner "<host>:<pid>" of its own.
+mp_ctx = multiprocessing.get_context("fork")
+
+
+# ================================= Defining Functions ====================================
+def publishQueue(queue_dir, task_num, lease_timeout=workqueue_MASseq.LEASE_TIMEOUT):
+    work_queue = workqueue_MASseq.WorkQueue(queue_dir, lease_timeout)
+    work_queue.publish("test", [], str(queue_dir), [{"task": i} for i in range(task_num)])
+    return work_queue
+
+
+def leaseOwner(work_queue, task_id):
+    with open(work_queue._leaseFile(task_id)) as lf:
+        return lf.read()
+
+
+# Claim a task and exit without processing it, as a worker killed while holding a lease.
+def claimAndDie(queue_dir, task_id):
+    workqueue_MASseq.WorkQueue(queue_dir).claim(task_id)
+    os._exit(0)
+
+
+# Claim a task, wait until it is reclaimed by another process, and still process it.
+def claimAndStall(queue_dir, lease_timeout, claimed, reclaimed):
+    work_queue = workqueue_MASseq.WorkQueue(queue_dir, lease_timeout)
+    work_queue.claim(0)
+    claimed.set()
+    reclaimed.wait(30)
+    work_queue.process(0, lambda task: ("stalled", task["task"]))
+
+
+# Process a task which takes longer than the lease timeout, the lease is renewed meanwhile.
+def processSlowly(queue_dir, lease_timeout, claimed):
+    work_queue = workqueue_MASseq.WorkQueue(queue_dir, lease_timeout)
+    work_queue.claim(0)
+    claimed.set()
+    work_queue.process(0, lambda task: time.sleep(lease_timeout * 3) or ("slow", task["task"]))
+
+
+# ================================= Leases ====================================
+# The lease held by a dead process on this machine is reclaimed at once.
+def test_dead_owner_reclaimed(tmp_path):
+    work_queue = publishQueue(tmp_path, 2)
+
+    worker = mp_ctx.Process(target=claimAndDie, args=(str(tmp_path), 0))
+    worker.start()
+    worker.join()
+
+    assert leaseOwner(work_queue, 0) == f"{work_queue.owner.rpartition(':')[0]}:{worker.pid}"
+    assert work_queue.nextTask() == 0
+    assert leaseOwner(work_queue, 0) == work_queue.owner
+
+
+# A lease not renewed in time is reclaimed. The former owner still commits the same task, but neither renews nor removes the new lease.
+def test_timed_out_lease_kept_by_new_owner(tmp_path):
+    lease_timeout = 0.4
+    work_queue = publishQueue(tmp_path, 1, lease_timeout)
+    claimed = mp_ctx.Event()
+    reclaimed = mp_ctx.Event()
+
+    worker = mp_ctx.Process(target=claimAndStall, args=(str(tmp_path), lease_timeout, claimed, reclaimed))
+    worker.start()
+    assert claimed.wait(30)
+
+    assert not work_queue.claim(0)
+    time.sleep(lease_timeout * 1.5)
+    assert work_queue.claim(0)
+    lease_mtime = os.path.getmtime(work_queue._leaseFile(0))
+
+    reclaimed.set()
+    worker.join(30)
+
+    assert worker.exitcode == 0
+    assert work_queue.result(0) == ("stalled", 0)
+    assert leaseOwner(work_queue, 0) == work_queue.owner
+    assert os.path.getmtime(work_queue._leaseFile(0)) == lease_mtime
+
+
+# A lease renewed by a live process is not reclaimed, even after the lease timeout, and is removed when the task is committed.
+def test_renewed_lease_not_reclaimed(tmp_path):
+    lease_timeout = 0.4
+    work_queue = publishQueue(tmp_path, 1, lease_timeout)
+    claimed = mp_ctx.Event()
+
+    worker = mp_ctx.Process(target=processSlowly, args=(str(tmp_path), lease_timeout, claimed))
+    worker.start()
+    assert claimed.wait(30)
+
+    # The task takes three times the lease timeout, the lease is tried until twice the timeout.
+    try_end = time.time() + lease_timeout * 2
+    while time.time() < try_end:
+        assert not work_queue.claim(0)
+        time.sleep(lease_timeout / 8)
+    worker.join(30)
+
+    assert worker.exitcode == 0
+    assert work_queue.result(0) == ("slow", 0)
+    assert not os.path.exists(work_queue._leaseFile(0))
+    assert work_queue.collect(0, lambda task: ("coordinator", task["task"])) == ("slow", 0)